@@ -0,0 +1,147 @@
+"""
+This class computes the electricity bill of many hourly consumption profiles under every toll of a PriceMatrix at
+once. Bills are matrix products between the consumption and the hourly prices, instead of loops over days, so
+thousands of load curves can be backtested over years of prices
+"""
+
+from datetime import date
+
+import numpy as np
+import pandas as pd
+
+from data_management.constants import PRICE_FIELDS, BACKTEST_CHUNK_SIZE
+from data_management.price_matrix import PriceMatrix
+
+
+class BacktestResult:
+    def __init__(self, pairs: list[tuple[str, str]], energy: np.ndarray, teu: np.ndarray, tcu: np.ndarray,
+                 kwh: np.ndarray, covered_kwh: np.ndarray, missing_days: np.ndarray, months: np.ndarray | None = None):
+        """
+        Bills of N profiles under P location/toll pairs (and M months, if grouped by month). Prices are in €/kWh,
+        so bills are in €
+
+        :param pairs: list[tuple[str, str]]. (location, toll) pairs, in the order of the pair axis
+        :param energy: np.ndarray. Energy cost (PVPC_price_kwh), of shape (N, P) or (N, P, M)
+        :param teu: np.ndarray. Part of the energy cost due to the tolls and charges (TEU_charges_kwh)
+        :param tcu: np.ndarray. Part of the energy cost due to the production price (TCU_production_price_kwh)
+        :param kwh: np.ndarray. Consumption of each profile, of shape (N,) or (N, M)
+        :param covered_kwh: np.ndarray. Consumption in hours with prices, of shape (N, P) or (N, P, M). If lower than
+                            kwh, some days of the pair were missing and their consumption was not billed
+        :param missing_days: np.ndarray. Number of days without prices of each pair, of shape (P,)
+        :param months: np.ndarray | None. First day of each month (datetime64[D]), if grouped by month
+        """
+        self.pairs = pairs
+        self.energy, self.teu, self.tcu = energy, teu, tcu
+        self.kwh, self.covered_kwh = kwh, covered_kwh
+        self.missing_days = missing_days
+        self.months = months
+
+    def cheapest_pairs(self) -> list[tuple[str, str]]:
+        """
+        :return: list[tuple[str, str]]. Pair with the lowest total bill of the range for each profile
+        """
+        totals = self.energy if self.months is None else self.energy.sum(axis=2)
+        return [self.pairs[pair] for pair in np.argmin(totals, axis=1)]
+
+    def to_frame(self) -> pd.DataFrame:
+        """
+        :return: pd.DataFrame. Long format frame with one row per profile and pair (and month), with the columns
+                                profile, location, toll, (month), kwh, covered_kwh, energy, teu and tcu
+        """
+        index = np.indices(self.energy.shape).reshape(self.energy.ndim, -1)
+        frame = pd.DataFrame({
+            'profile': index[0],
+            'location': np.array([location for location, _ in self.pairs])[index[1]],
+            'toll': np.array([toll for _, toll in self.pairs])[index[1]],
+        })
+        if self.months is not None:
+            frame['month'] = self.months[index[2]]
+            frame['kwh'] = self.kwh[index[0], index[2]]
+        else:
+            frame['kwh'] = self.kwh[index[0]]
+        for name in ('covered_kwh', 'energy', 'teu', 'tcu'):
+            frame[name] = getattr(self, name).reshape(-1)
+        return frame
+
+
+class BillBacktester:
+    def __init__(self, prices: PriceMatrix):
+        """
+        :param prices: PriceMatrix. Prices of the pairs to compare, with the fields PVPC_price_kwh, TEU_charges_kwh
+                        and TCU_production_price_kwh
+        """
+        assert all(field in prices.fields for field in PRICE_FIELDS), f"The price matrix needs the fields {PRICE_FIELDS}"
+        self.prices = prices
+        pairs, days = len(prices.pairs), len(prices.dates)
+        # Flattened to (pair, hour of the range), with the missing hours as 0 so they add nothing
+        self._available = ~np.repeat(prices.missing, 24, axis=1)
+        self._hourly = {field: np.nan_to_num(prices[field].reshape(pairs, days * 24), nan=0.0) for field in PRICE_FIELDS}
+
+    @classmethod
+    def from_backend(cls, backend, start_date: date, end_date: date,
+                     pairs: list[tuple[str, str]]) -> 'BillBacktester':
+        """
+        :param backend: StorageBackend | FirebaseQuerier. Where the prices are read from (a SQLite file, Firestore...)
+        :param start_date: date. Start date of the range
+        :param end_date: date. End date of the range
+        :param pairs: list[tuple[str, str]]. (location, toll) pairs to compare
+        """
+        return cls(prices=backend.get_price_matrix(start_date=start_date, end_date=end_date, pairs=pairs,
+                                                   fields=PRICE_FIELDS))
+
+    @classmethod
+    def from_price_cube(cls, cube, start_date: date, end_date: date,
+                        pairs: list[tuple[str, str]]) -> 'BillBacktester':
+        """
+        :param cube: PriceCube. Local cube with the prices
+        :param start_date: date. Start date of the range
+        :param end_date: date. End date of the range
+        :param pairs: list[tuple[str, str]]. (location, toll) pairs to compare
+        """
+        return cls(prices=PriceMatrix.from_price_cube(cube=cube, pairs=pairs, start_date=start_date,
+                                                      end_date=end_date, fields=PRICE_FIELDS))
+
+    def run(self, consumption: np.ndarray, by_month: bool = False,
+            chunk_size: int = BACKTEST_CHUNK_SIZE) -> BacktestResult:
+        """
+        Compute the bill of every profile under every pair
+
+        :param consumption: np.ndarray. kWh consumed by N profiles in each hour of the range, of shape (N, days * 24)
+                            or (N, days, 24). Days have always 24 hours, as in the database (the repeated hour of the
+                            winter time change is dropped, the missing one of summer is a copy of the previous hour)
+        :param by_month: bool. If True, bills are broken down by calendar month
+        :param chunk_size: int. Profiles computed at once, to bound the memory used
+
+        :return: BacktestResult. Bills of each profile and pair
+        """
+        pairs, days = len(self.prices.pairs), len(self.prices.dates)
+        consumption = np.asarray(consumption, dtype=np.float64).reshape(len(consumption), -1)
+        assert consumption.shape[1] == days * 24, f"Expected {days * 24} hours of consumption, got {consumption.shape[1]}"
+        # Hour slices of the groups (the whole range, or each month)
+        if by_month:
+            months = np.unique(self.prices.dates.astype('datetime64[M]'))
+            starts = (months.astype('datetime64[D]') - self.prices.dates[0]).astype(np.int64).clip(min=0) * 24
+            bounds = list(zip(starts, list(starts[1:]) + [days * 24]))
+        else:
+            months, bounds = None, [(0, days * 24)]
+
+        shape = (len(consumption), pairs, len(bounds))
+        results = {name: np.zeros(shape) for name in ('energy', 'teu', 'tcu', 'covered_kwh')}
+        kwh = np.zeros((len(consumption), len(bounds)))
+        available = self._available.astype(np.float64)
+        for first in range(0, len(consumption), chunk_size):
+            chunk = consumption[first:first + chunk_size]
+            for group, (start, end) in enumerate(bounds):
+                hours = chunk[:, start:end]
+                # (profiles, hours) @ (hours, pairs), one BLAS call per field
+                results['energy'][first:first + chunk_size, :, group] = hours @ self._hourly['PVPC_price_kwh'][:, start:end].T
+                results['teu'][first:first + chunk_size, :, group] = hours @ self._hourly['TEU_charges_kwh'][:, start:end].T
+                results['tcu'][first:first + chunk_size, :, group] = hours @ self._hourly['TCU_production_price_kwh'][:, start:end].T
+                results['covered_kwh'][first:first + chunk_size, :, group] = hours @ available[:, start:end].T
+                kwh[first:first + chunk_size, group] = hours.sum(axis=1)
+
+        if not by_month:
+            results = {name: values[:, :, 0] for name, values in results.items()}
+            kwh = kwh[:, 0]
+        return BacktestResult(pairs=self.prices.pairs, kwh=kwh, missing_days=self.prices.missing.sum(axis=1),
+                              months=months.astype('datetime64[D]') if months is not None else None, **results)
@@ -0,0 +1,128 @@
+"""
+Vectorized search of the cheapest hours to run shiftable loads (EV charging, heat pumps...) for every day of a
+(day, hour) price matrix, as built from the BY_DAY data (PriceMatrix, PriceCube.series...). Windows can cross
+midnight, and every day is solved at once with sliding windows instead of looping over days
+"""
+
+import numpy as np
+
+
+class ScheduleResult:
+    def __init__(self, hours: np.ndarray, costs: np.ndarray, fixed_costs: np.ndarray):
+        """
+        Schedule of each day. Costs are in € for a load of power_kw kW during every selected hour
+
+        :param hours: np.ndarray. Selected hours of each day, of shape (days, K), as hours from the midnight that
+                        starts the day (values of 24 or more are hours of the next day). -1 if the day has no prices
+        :param costs: np.ndarray. Cost of the selected hours of each day, of shape (days,). NaN if no prices
+        :param fixed_costs: np.ndarray. Cost of the fixed schedule of each day, of shape (days,). NaN if no prices
+        """
+        self.hours = hours
+        self.costs = costs
+        self.fixed_costs = fixed_costs
+
+    @property
+    def starts(self) -> np.ndarray:
+        """
+        :return: np.ndarray. First selected hour of each day, of shape (days,)
+        """
+        return self.hours[:, 0]
+
+    @property
+    def savings(self) -> np.ndarray:
+        """
+        :return: np.ndarray. Savings of each day against the fixed schedule, of shape (days,)
+        """
+        return self.fixed_costs - self.costs
+
+    @property
+    def total_savings(self) -> float:
+        """
+        :return: float. Savings of the whole range against the fixed schedule (days without prices are ignored)
+        """
+        return float(np.nansum(self.savings))
+
+
+def cheapest_windows(prices: np.ndarray, hours: int, earliest: int = 0, latest: int | None = None,
+                     fixed_start: int | None = None, power_kw: float = 1.0) -> ScheduleResult:
+    """
+    Find the cheapest contiguous window of some hours for every day
+
+    :param prices: np.ndarray. Prices (€/kWh) of shape (days, 24), of consecutive days. Missing days are NaN
+    :param hours: int. Length of the window
+    :param earliest: int. Earliest hour (0-23) the window of a day can start
+    :param latest: int | None. Hour the window of a day must be finished by (exclusive). If lower or equal than
+                    earliest, it is an hour of the next day (22 to 7 is the night from a day to the next one). If None,
+                    the window can start at any hour of the 24 from earliest, and end the next day
+    :param fixed_start: int | None. Start hour of the fixed schedule to compare with. If None, earliest (as soon as
+                    the load is available)
+    :param power_kw: float. Power of the load, in kW
+
+    :return: ScheduleResult. Cheapest window of each day, with the savings against the fixed schedule
+    """
+    first, last = _availability(earliest=earliest, latest=latest, hours=hours)
+    fixed_start = earliest if fixed_start is None else fixed_start + (24 if fixed_start < earliest else 0)
+    assert first <= fixed_start <= last - hours, f"The fixed schedule must be inside the availability window"
+    flat = _flatten(prices=prices, extra_hours=last)
+    days = len(prices)
+    # Sum of the window starting at each hour of the flattened series (NaN if any hour is missing)
+    window_sums = np.lib.stride_tricks.sliding_window_view(flat, hours).sum(axis=1)
+    candidate_starts = np.arange(days)[:, None] * 24 + np.arange(first, last - hours + 1)[None, :]
+    candidates = window_sums[candidate_starts]
+    # Days without any complete window are marked, the others ignore the windows with missing hours
+    valid = ~np.isnan(candidates).all(axis=1)
+    best = np.argmin(np.where(np.isnan(candidates), np.inf, candidates), axis=1)
+    starts = np.where(valid, first + best, -1)
+    costs = np.where(valid, candidates[np.arange(days), best], np.nan) * power_kw
+    fixed_costs = window_sums[np.arange(days) * 24 + fixed_start] * power_kw
+    window_hours = np.where(valid[:, None], starts[:, None] + np.arange(hours)[None, :], -1)
+    return ScheduleResult(hours=window_hours, costs=costs, fixed_costs=fixed_costs)
+
+
+def cheapest_hours(prices: np.ndarray, hours: int, earliest: int = 0, latest: int | None = None,
+                   power_kw: float = 1.0) -> ScheduleResult:
+    """
+    Find the cheapest hours (not necessarily contiguous) inside the availability window of every day. The fixed
+    schedule to compare with runs the first hours of the window (as soon as the load is available)
+
+    :param prices: np.ndarray. Prices (€/kWh) of shape (days, 24), of consecutive days. Missing days are NaN
+    :param hours: int. Number of hours to select
+    :param earliest: int. Earliest hour (0-23) of the availability window of a day
+    :param latest: int | None. Hour the availability window of a day ends (exclusive). If lower or equal than
+                    earliest, it is an hour of the next day. If None, the 24 hours from earliest
+    :param power_kw: float. Power of the load, in kW
+
+    :return: ScheduleResult. Cheapest hours of each day (sorted), with the savings against the fixed schedule
+    """
+    first, last = _availability(earliest=earliest, latest=24 + earliest if latest is None else latest, hours=hours)
+    flat = _flatten(prices=prices, extra_hours=last)
+    days = len(prices)
+    offsets = np.arange(first, last)
+    candidates = flat[np.arange(days)[:, None] * 24 + offsets[None, :]]
+    missing = np.isnan(candidates)
+    # A day is valid if its window has at least the hours needed
+    valid = (~missing).sum(axis=1) >= hours
+    selected = np.sort(np.argpartition(np.where(missing, np.inf, candidates), hours - 1, axis=1)[:, :hours], axis=1)
+    costs = np.where(valid, np.take_along_axis(candidates, selected, axis=1).sum(axis=1), np.nan) * power_kw
+    fixed_costs = candidates[:, :hours].sum(axis=1) * power_kw
+    return ScheduleResult(hours=np.where(valid[:, None], offsets[selected], -1), costs=costs,
+                          fixed_costs=fixed_costs)
+
+
+def _availability(earliest: int, latest: int | None, hours: int) -> tuple[int, int]:
+    # Availability window as hours from the midnight that starts the day, [first, last)
+    assert 0 <= earliest < 24, f"earliest must be an hour between 0 and 23, not {earliest}"
+    assert hours > 0, f"hours must be positive"
+    if latest is None:
+        last = earliest + 24 + hours - 1
+    else:
+        last = latest if latest > earliest else latest + 24
+    assert last - earliest >= hours, f"The availability window ({earliest} to {latest}) is shorter than {hours} hours"
+    return earliest, last
+
+
+def _flatten(prices: np.ndarray, extra_hours: int) -> np.ndarray:
+    # Hourly series of the whole range, padded with NaN so the windows of the last day can look into the next one
+    prices = np.asarray(prices, dtype=np.float64)
+    assert prices.ndim == 2 and prices.shape[1] == 24, f"Expected prices of shape (days, 24), got {prices.shape}"
+    return np.concatenate([prices.reshape(-1), np.full(extra_hours, np.nan)])
@@ -0,0 +1,53 @@
+"""
+Benchmark of the startup time of the CLI. Times `python main.py --help` (and the help of every subcommand) against
+importing the modules the old main.py loaded at startup. It also checks that building the parser doesn't import any
+heavy dependency, so a regression shows up as a failure and not just as a slower number.
+
+Run it from the repository root: python -m benchmarks.bench_cli_startup
+"""
+
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+ROOT_FOLDER = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+RUNS = 5
+# Must not be loaded just to parse the command line
+HEAVY_MODULES = ('pandas', 'numpy', 'firebase_admin', 'google.cloud.firestore_v1', 'matplotlib', 'tqdm', 'aiohttp')
+# What the old main.py imported at startup
+EAGER_IMPORTS = ('data_management.firebase.firebase_manager', 'data_management.firebase.firebase_querier',
+                 'data_management.pipeline', 'data_management.prices_downloader', 'data_management.sync')
+COMMANDS = {
+    'main.py --help': [sys.executable, 'main.py', '--help'],
+    'main.py query --help': [sys.executable, 'main.py', 'query', '--help'],
+    'main.py ingest --help': [sys.executable, 'main.py', 'ingest', '--help'],
+    'eager imports (old main.py)': [sys.executable, '-c', '; '.join(f'import {module}' for module in EAGER_IMPORTS)],
+}
+
+
+def median_seconds(command: list[str], runs: int = RUNS) -> float:
+    times = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        subprocess.run(command, cwd=ROOT_FOLDER, check=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        times.append(time.perf_counter() - start)
+    return statistics.median(times)
+
+
+def loaded_heavy_modules() -> list[str]:
+    # Build the parser of every subcommand in a fresh interpreter and list the heavy modules it loaded
+    code = (f"import sys, main; main.build_parser(); "
+            f"print(','.join(m for m in {HEAVY_MODULES!r} if m in sys.modules))")
+    output = subprocess.run([sys.executable, '-c', code], cwd=ROOT_FOLDER, check=True, capture_output=True,
+                            text=True).stdout.strip()
+    return [module for module in output.split(',') if module]
+
+
+if __name__ == '__main__':
+    heavy = loaded_heavy_modules()
+    assert len(heavy) == 0, f"Starting the CLI must not import {heavy}"
+    print(f"No heavy module imported to parse the command line ({', '.join(HEAVY_MODULES)})")
+    for name, command in COMMANDS.items():
+        print(f"{name:<32}{median_seconds(command=command) * 1000:>10.1f}ms (median of {RUNS})")
@@ -0,0 +1,75 @@
+"""
+Benchmark of the csv loaders over a year of files. Compares the old row-wise loader, the vectorized
+load_csv_as_dicts and the batch load_date_range_as_frame.
+
+Run it from the repository root: python -m benchmarks.bench_csv_loader
+"""
+
+import os
+import time
+from datetime import date, datetime, timedelta
+from tempfile import TemporaryDirectory
+
+import numpy as np
+import pandas as pd
+
+from data_management.constants import PCB, CYM, EXPECTED_DATE_FORMAT
+from utils.utils import load_csv_as_dicts, load_date_range_as_frame, frame_to_day_arrays
+
+START_DATE = date(year=2023, month=1, day=1)
+DAYS = 365
+TOLL = '2.0TD'
+
+
+def legacy_load_csv_as_dicts(csv_path: str, datetime_column_name: str = 'datetime_spain') -> list[dict]:
+    # Loader as it was before vectorizing it, kept as the baseline
+    df = pd.read_csv(filepath_or_buffer=csv_path, sep=',')
+    if len(df) == 25:
+        df = df[:-1]
+    df[datetime_column_name] = df.apply(
+        lambda row: datetime.strptime(f"{row['date']} {row['hour']}:00", "%Y-%m-%d %H:%M"), axis=1)
+    return df.to_dict(orient='records')
+
+
+def write_synthetic_year(data_folder: str) -> list[str]:
+    rng = np.random.default_rng(seed=0)
+    paths = []
+    for location in (PCB, CYM):
+        os.makedirs(os.path.join(data_folder, location, TOLL))
+        for i in range(DAYS):
+            date_str = (START_DATE + timedelta(days=i)).strftime(EXPECTED_DATE_FORMAT)
+            teu, tcu = rng.uniform(0.0, 0.05, size=24), rng.uniform(0.05, 0.3, size=24)
+            df = pd.DataFrame({'date': date_str, 'hour': range(24), 'toll': TOLL, 'period': rng.integers(1, 4, size=24),
+                               'PVPC_price_kwh': teu + tcu, 'TEU_charges_kwh': teu, 'TCU_production_price_kwh': tcu,
+                               'location': location})
+            path = os.path.join(data_folder, location, TOLL, f"{date_str}.csv")
+            df.to_csv(path, index=False)
+            paths.append(path)
+    return paths
+
+
+def timed(function, *args, **kwargs) -> tuple[float, object]:
+    start = time.perf_counter()
+    result = function(*args, **kwargs)
+    return time.perf_counter() - start, result
+
+
+if __name__ == '__main__':
+    with TemporaryDirectory() as data_folder:
+        paths = write_synthetic_year(data_folder=data_folder)
+        end_date = START_DATE + timedelta(days=DAYS - 1)
+
+        legacy_time, legacy_rows = timed(lambda: [row for path in paths for row in legacy_load_csv_as_dicts(path)])
+        new_time, new_rows = timed(lambda: [row for path in paths for row in load_csv_as_dicts(path)])
+        batch_time, frame = timed(load_date_range_as_frame, start_date=START_DATE, end_date=end_date,
+                                  data_folder=data_folder)
+        arrays_time, _ = timed(frame_to_day_arrays, df=frame)
+
+        assert len(legacy_rows) == len(new_rows) == len(frame), "All the loaders must return the same rows"
+        assert all(old['datetime_spain'] == new['datetime_spain'] for old, new in zip(legacy_rows, new_rows))
+
+        print(f"{len(paths)} files, {len(frame)} rows")
+        print(f"{'legacy load_csv_as_dicts':<32}{legacy_time:>8.3f}s")
+        print(f"{'load_csv_as_dicts':<32}{new_time:>8.3f}s ({legacy_time / new_time:.1f}x)")
+        print(f"{'load_date_range_as_frame':<32}{batch_time:>8.3f}s ({legacy_time / batch_time:.1f}x)")
+        print(f"{'frame_to_day_arrays':<32}{arrays_time:>8.3f}s")
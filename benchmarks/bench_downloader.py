@@ -0,0 +1,59 @@
+"""
+Benchmark of PricesDownloader.download_prices_for_date_range against the local ESIOS stand-in, with injected latency
+and failures. Compares the asyncio engine with the previous fixed batches of threads.
+
+Run it from the repository root: python -m benchmarks.bench_downloader
+"""
+
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from tempfile import TemporaryDirectory
+
+from benchmarks.esios_stand_in import EsiosStandIn
+from data_management.prices_downloader import PricesDownloader
+
+START_DATE = datetime(year=2023, month=1, day=1)
+DAYS = 60
+LATENCY_SECONDS = 0.2
+FAILURE_RATE = 0.05
+
+
+def legacy_download_range(downloader: PricesDownloader, start_date: datetime, end_date: datetime,
+                          _batch_size: int = 8) -> list[str]:
+    # Fixed batches of 8 days, as download_prices_for_date_range did before. Failed days are not retried
+    files = []
+    with ThreadPoolExecutor() as executor:
+        for i in range(0, (end_date - start_date).days + 1, _batch_size):
+            batch_size = min(_batch_size, (end_date - start_date).days - i + 1)
+            days = [start_date + timedelta(days=i + j) for j in range(batch_size)]
+            for paths in executor.map(lambda day: safe_download_day(downloader=downloader, day=day), days):
+                files.extend(paths)
+    return files
+
+
+def safe_download_day(downloader: PricesDownloader, day: datetime) -> list[str]:
+    try:
+        return downloader.download_day(date=day, save_manifest=False)
+    except Exception:
+        return []
+
+
+def run(name: str, download) -> None:
+    with TemporaryDirectory() as data_folder, \
+            EsiosStandIn(latency_seconds=LATENCY_SECONDS, failure_rate=FAILURE_RATE, seed=0) as stand_in:
+        with PricesDownloader(data_folder=data_folder, url=stand_in.url) as downloader:
+            start = time.perf_counter()
+            files = download(downloader)
+            elapsed = time.perf_counter() - start
+        print(f"{name:<12}{elapsed:>8.2f}s {DAYS / elapsed:>7.1f} days/s  {len(files):>4} files  "
+              f"{stand_in.requests:>4} requests  {stand_in.failures:>3} failures  {stand_in.connections:>4} connections")
+
+
+if __name__ == '__main__':
+    end_date = START_DATE + timedelta(days=DAYS - 1)
+    print(f"{DAYS} days, {LATENCY_SECONDS}s latency, {FAILURE_RATE:.0%} failures")
+    run(name='legacy', download=lambda downloader: legacy_download_range(downloader=downloader, start_date=START_DATE,
+                                                                         end_date=end_date))
+    run(name='async', download=lambda downloader: downloader.download_prices_for_date_range(
+        start_date=START_DATE, end_date=end_date, requests_per_second=0))
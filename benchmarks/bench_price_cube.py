@@ -0,0 +1,43 @@
+"""
+Benchmark of loading a year of prices from the per-day csv files and from the memory-mapped price cube.
+
+Run it from the repository root: python -m benchmarks.bench_price_cube
+"""
+
+import os
+from datetime import timedelta
+from tempfile import TemporaryDirectory
+
+import numpy as np
+import pandas as pd
+
+from benchmarks.bench_csv_loader import START_DATE, DAYS, TOLL, write_synthetic_year, timed
+from data_management.constants import PCB
+from data_management.price_cube import PriceCube
+from utils.utils import load_date_range_as_frame, frame_to_day_arrays
+
+if __name__ == '__main__':
+    with TemporaryDirectory() as data_folder:
+        paths = write_synthetic_year(data_folder=data_folder)
+        end_date = START_DATE + timedelta(days=DAYS - 1)
+
+        cube = PriceCube(folder=os.path.join(data_folder, 'cube'))
+        fill_time, _ = timed(lambda: [cube.append_frame(df=pd.read_csv(path)) for path in paths])
+        cube.save()
+
+        csv_time, frame = timed(load_date_range_as_frame, start_date=START_DATE, end_date=end_date,
+                                data_folder=data_folder, location_tolls=[(PCB, TOLL)])
+        csv_prices = frame_to_day_arrays(df=frame)['PVPC_price_kwh']
+        # A fresh read only cube, as another process would open it
+        open_time, read_cube = timed(PriceCube, folder=os.path.join(data_folder, 'cube'), read_only=True)
+        load_time, cube_prices = timed(read_cube.series, start_date=START_DATE, end_date=end_date, location=PCB,
+                                       toll=TOLL, field='PVPC_price_kwh')
+        mean_time, _ = timed(np.nanmean, cube_prices, axis=0)
+
+        assert np.allclose(csv_prices, cube_prices), "Both stores must return the same prices"
+        print(f"{len(paths)} files, {cube_prices.shape[0]} days of {PCB}/{TOLL}")
+        print(f"{'fill cube from csv':<32}{fill_time:>10.4f}s")
+        print(f"{'load_date_range_as_frame':<32}{csv_time:>10.4f}s")
+        print(f"{'open cube':<32}{open_time:>10.4f}s")
+        print(f"{'cube series (view)':<32}{load_time:>10.4f}s ({csv_time / max(load_time, 1e-9):.0f}x)")
+        print(f"{'hourly mean over the view':<32}{mean_time:>10.4f}s")
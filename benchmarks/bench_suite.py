@@ -0,0 +1,177 @@
+"""
+End-to-end benchmark suite of the ingest and query paths, running entirely on this machine: ESIOS is replaced by
+the local HTTP stand-in and Firestore by MemoryClient. For each range it measures, on a fresh process:
+    - download: PricesDownloader.download_prices_for_date_range (days/s)
+    - post: FirebaseManager.post_for_date_range of the csv files downloaded (days/s and RPCs per day)
+    - query: FirebaseQuerier.aggregate_between_dates over random sub-ranges, without query cache (p50/p99 latency
+      and RPCs per query)
+    - the peak RSS of the process
+Results are printed and written as json to benchmarks/results, so runs can be compared with --compare.
+
+Run it from the repository root: python -m benchmarks.bench_suite [--ranges 31 365 3650] [--compare <json>]
+"""
+
+import argparse
+import json
+import multiprocessing
+import os
+import platform
+import random
+import resource
+import subprocess
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timedelta
+from tempfile import TemporaryDirectory
+
+import numpy as np
+from loguru import logger
+
+from benchmarks.esios_stand_in import EsiosStandIn
+
+START_DATE = datetime(year=2014, month=1, day=1)
+RANGES_DAYS = (31, 365, 3650)
+QUERIES = 50
+RESULTS_FOLDER = os.path.join(os.path.dirname(__file__), 'results')
+# Metrics compared by --compare, and whether higher is better
+COMPARED_METRICS = {'download_days_per_second': True, 'post_days_per_second': True, 'post_rpcs_per_day': False,
+                    'query_p50_ms': False, 'query_p99_ms': False, 'peak_rss_mb': False}
+
+
+def peak_rss_mb() -> float:
+    # ru_maxrss is in kilobytes on Linux and in bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / 2 ** 20 if sys.platform == 'darwin' else peak / 2 ** 10
+
+
+def run_range(days: int, queries: int = QUERIES, rpc_latency_seconds: float = 0.0,
+              http_latency_seconds: float = 0.0, seed: int = 0) -> dict:
+    """
+    Benchmark a single range. Meant to run on its own process, so the peak RSS only belongs to this range
+
+    :param days: int. Days of the range, starting at START_DATE
+    :param queries: int. Number of aggregation queries to time
+    :param rpc_latency_seconds: float. Latency injected in every RPC of MemoryClient
+    :param http_latency_seconds: float. Latency injected in every request to the ESIOS stand-in
+    :param seed: int. Seed of the random sub-ranges queried
+
+    :return: dict. Metrics of the range
+    """
+    # Imported here, so the spawned processes load them on their own
+    from data_management.firebase.firebase_manager import FirebaseManager
+    from data_management.firebase.firebase_querier import FirebaseQuerier
+    from benchmarks.memory_client import MemoryClient
+    from data_management.manifest import DataManifest
+    from data_management.prices_downloader import PricesDownloader
+
+    logger.remove()
+    end_date = START_DATE + timedelta(days=days - 1)
+    with TemporaryDirectory() as data_folder, EsiosStandIn(latency_seconds=http_latency_seconds) as stand_in:
+        manifest = DataManifest(data_folder=data_folder)
+        with PricesDownloader(manifest=manifest, data_folder=data_folder, url=stand_in.url) as downloader:
+            start = time.perf_counter()
+            files = downloader.download_prices_for_date_range(start_date=START_DATE, end_date=end_date,
+                                                              requests_per_second=0)
+            download_seconds = time.perf_counter() - start
+
+        client = MemoryClient(latency_seconds=rpc_latency_seconds)
+        manager = FirebaseManager(client=client, manifest=manifest)
+        client.reset_rpc_counts()
+        start = time.perf_counter()
+        manager.post_for_date_range(start_date=START_DATE, end_date=end_date)
+        post_seconds = time.perf_counter() - start
+        post_rpcs = dict(client.rpc_counts)
+
+        querier = FirebaseQuerier(client=client, use_cache=False)
+        rng = random.Random(seed)
+        latencies = []
+        client.reset_rpc_counts()
+        for _ in range(queries):
+            length = rng.randint(1, days)
+            first = START_DATE + timedelta(days=rng.randint(0, days - length))
+            start = time.perf_counter()
+            querier.aggregate_between_dates(start_date=first, end_date=first + timedelta(days=length - 1))
+            latencies.append(time.perf_counter() - start)
+        query_rpcs = dict(client.rpc_counts)
+
+    return {
+        'days': days,
+        'files': len(files),
+        'download_seconds': download_seconds,
+        'download_days_per_second': days / download_seconds,
+        'post_seconds': post_seconds,
+        'post_days_per_second': days / post_seconds,
+        'post_rpcs': post_rpcs,
+        'post_rpcs_per_day': sum(post_rpcs.values()) / days,
+        'queries': queries,
+        'query_p50_ms': float(np.percentile(latencies, 50)) * 1000,
+        'query_p99_ms': float(np.percentile(latencies, 99)) * 1000,
+        'query_rpcs_per_query': sum(query_rpcs.values()) / queries,
+        'peak_rss_mb': peak_rss_mb(),
+    }
+
+
+def environment() -> dict:
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                                cwd=os.path.dirname(__file__)).stdout.strip() or None
+    except OSError:
+        commit = None
+    return {'timestamp': datetime.now().isoformat(timespec='seconds'), 'commit': commit,
+            'python': platform.python_version(), 'platform': platform.platform(), 'cpus': os.cpu_count()}
+
+
+def compare(results: dict, baseline: dict):
+    """
+    Print the relative change of every compared metric against a previous run, for the ranges both runs have
+
+    :param results: dict. Results of this run
+    :param baseline: dict. Results of a previous run, as written by this script
+    """
+    baseline_ranges = {result['days']: result for result in baseline['ranges']}
+    print(f"\nCompared with {baseline['environment']['commit']} ({baseline['environment']['timestamp']})")
+    for result in results['ranges']:
+        if result['days'] not in baseline_ranges:
+            continue
+        for metric, higher_is_better in COMPARED_METRICS.items():
+            before, after = baseline_ranges[result['days']][metric], result[metric]
+            change = (after - before) / before if before else 0.0
+            better = change > 0 if higher_is_better else change < 0
+            print(f"{result['days']:>6} days {metric:<26}{before:>12.2f} -> {after:>12.2f} "
+                  f"{change:>+8.1%} {'better' if better and change != 0 else 'worse' if change != 0 else ''}")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--ranges', type=int, nargs='+', default=RANGES_DAYS, help="Days of each range")
+    parser.add_argument('--queries', type=int, default=QUERIES, help="Aggregation queries timed per range")
+    parser.add_argument('--rpc-latency', type=float, default=0.0, help="Seconds injected in every Firestore RPC")
+    parser.add_argument('--http-latency', type=float, default=0.0, help="Seconds injected in every ESIOS request")
+    parser.add_argument('--output', default=None, help="Json file to write. Default: benchmarks/results/<time>.json")
+    parser.add_argument('--compare', default=None, help="Json file of a previous run to compare with")
+    args = parser.parse_args()
+
+    results = {'environment': environment(), 'parameters': {'queries': args.queries, 'rpc_latency': args.rpc_latency,
+                                                            'http_latency': args.http_latency}, 'ranges': []}
+    # A fresh process per range, so each one starts with cold caches and its own peak RSS. Not a Pool, its
+    # daemonic workers can't start the parse processes of PricesDownloader
+    for days in args.ranges:
+        with ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context('spawn')) as executor:
+            result = executor.submit(run_range, days=days, queries=args.queries,
+                                     rpc_latency_seconds=args.rpc_latency,
+                                     http_latency_seconds=args.http_latency).result()
+        results['ranges'].append(result)
+        print(f"{days:>6} days  download {result['download_days_per_second']:>7.1f} days/s  "
+              f"post {result['post_days_per_second']:>7.1f} days/s {result['post_rpcs_per_day']:>6.2f} RPCs/day  "
+              f"query p50 {result['query_p50_ms']:>8.2f}ms p99 {result['query_p99_ms']:>8.2f}ms "
+              f"{result['query_rpcs_per_query']:>6.1f} RPCs  peak RSS {result['peak_rss_mb']:>7.1f}MB")
+
+    output = args.output or os.path.join(RESULTS_FOLDER, f"{datetime.now().strftime('%Y%m%d-%H%M%S')}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, 'w') as file:
+        json.dump(results, file, indent=2)
+    print(f"Results written to {output}")
+    if args.compare is not None:
+        with open(args.compare) as file:
+            compare(results=results, baseline=json.load(file))
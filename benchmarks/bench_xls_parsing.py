@@ -0,0 +1,70 @@
+"""
+Benchmark of the xls parsing on the bundled data.xls. Compares the old per-sheet parsing with the single pass
+parse_workbook, and parsing from download threads against parsing in the process pool.
+
+Run it from the repository root: python -m benchmarks.bench_xls_parsing
+"""
+
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from multiprocessing import get_context
+
+import pandas as pd
+
+from data_management.constants import SHEET_NAMES_TO_FOLDER, EXPECTED_DATE_FORMAT, PARSE_WORKERS
+from data_management.prices_downloader import parse_workbook
+
+XLS_PATH = os.path.join(os.path.dirname(os.path.dirname(__file__)), 'data.xls')
+REPETITIONS = 32
+DOWNLOAD_THREADS = 8
+
+
+def legacy_parse_workbook(xls_path: str) -> dict[str, pd.DataFrame]:
+    # Parsing as it was done in cast_to_csv before, kept as the baseline
+    data_by_location = {}
+    for sheet_name, location_folder_path in SHEET_NAMES_TO_FOLDER.items():
+        try:
+            data = pd.read_excel(xls_path, sheet_name=sheet_name)
+        except ValueError:
+            data = pd.read_excel(xls_path, sheet_name="Tabla de Datos")
+        location = os.path.basename(location_folder_path)
+        data = data.dropna(axis=0, how='all').dropna(axis=1, how='all')
+        data = data.iloc[3:]
+        columns_names = ['date', 'hour', 'toll', 'period', 'PVPC_price_kwh', 'TEU_charges_kwh', 'TCU_production_price_kwh']
+        data = data.iloc[:, :len(columns_names)]
+        data.columns = columns_names
+        data['hour'] = data['hour'] - 1
+        data = data.sort_values(by='hour')
+        data.iloc[:, -3:] = data.iloc[:, -3:] / 1000
+        data['date'] = data['date'].apply(lambda x: x.strftime(EXPECTED_DATE_FORMAT))
+        data['location'] = location
+        data_by_location[location] = data
+    return data_by_location
+
+
+def timed(function) -> float:
+    start = time.perf_counter()
+    function()
+    return time.perf_counter() - start
+
+
+if __name__ == '__main__':
+    legacy, new = legacy_parse_workbook(xls_path=XLS_PATH), parse_workbook(xls_path=XLS_PATH)
+    for location in new:
+        pd.testing.assert_frame_equal(legacy[location], new[location])
+
+    legacy_time = timed(lambda: [legacy_parse_workbook(xls_path=XLS_PATH) for _ in range(REPETITIONS)])
+    new_time = timed(lambda: [parse_workbook(xls_path=XLS_PATH) for _ in range(REPETITIONS)])
+    with ThreadPoolExecutor(max_workers=DOWNLOAD_THREADS) as executor:
+        threads_time = timed(lambda: list(executor.map(parse_workbook, [XLS_PATH] * REPETITIONS)))
+    with ProcessPoolExecutor(max_workers=PARSE_WORKERS, mp_context=get_context('spawn')) as executor:
+        # Warm up the workers, so the spawn time is not measured
+        list(executor.map(parse_workbook, [XLS_PATH] * PARSE_WORKERS))
+        processes_time = timed(lambda: list(executor.map(parse_workbook, [XLS_PATH] * REPETITIONS)))
+
+    print(f"{REPETITIONS} parses of {XLS_PATH}")
+    print(f"{'legacy (one read per sheet)':<36}{legacy_time:>8.3f}s")
+    print(f"{'parse_workbook (single pass)':<36}{new_time:>8.3f}s ({legacy_time / new_time:.1f}x)")
+    print(f"{f'parse_workbook, {DOWNLOAD_THREADS} threads':<36}{threads_time:>8.3f}s ({legacy_time / threads_time:.1f}x)")
+    print(f"{f'parse_workbook, {PARSE_WORKERS} processes':<36}{processes_time:>8.3f}s ({legacy_time / processes_time:.1f}x)")
@@ -0,0 +1,164 @@
+"""
+Local HTTP stand-in for the ESIOS archive. It serves, for any requested date, a copy of the bundled data.xls with
+its dates moved to the requested day, with injectable latency and failures. Responses carry an ETag and honor
+If-None-Match. Generated workbooks are written as xlsx, so openpyxl is needed.
+"""
+
+import hashlib
+import io
+import os
+import random
+import time
+from datetime import datetime
+from functools import lru_cache
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from threading import Thread, Lock
+from urllib.parse import urlsplit, parse_qs
+
+import pandas as pd
+
+from data_management.constants import EXPECTED_DATE_FORMAT
+
+TEMPLATE_XLS_PATH = os.path.join(os.path.dirname(os.path.dirname(__file__)), 'data.xls')
+DOWNLOAD_PATH = '/archives/71/download'
+
+
+@lru_cache(maxsize=1)
+def _template_sheets() -> dict[str, pd.DataFrame]:
+    return pd.read_excel(TEMPLATE_XLS_PATH, sheet_name=None, header=None)
+
+
+@lru_cache(maxsize=4096)
+def build_workbook(date_str: str) -> bytes:
+    """
+    Build the workbook ESIOS would serve for a day, from the data.xls template
+
+    :param date_str: str. Day of the workbook, as EXPECTED_DATE_FORMAT
+
+    :return: bytes. Content of the workbook
+    """
+    date = datetime.strptime(date_str, EXPECTED_DATE_FORMAT)
+    buffer = io.BytesIO()
+    with pd.ExcelWriter(buffer, engine='openpyxl') as writer:
+        for sheet_name, sheet in _template_sheets().items():
+            sheet = sheet.copy()
+            dates = sheet.iloc[:, 0]
+            is_date = dates.map(lambda value: isinstance(value, datetime))
+            # Keep the hour of the original cells, but move them to the requested day
+            sheet.loc[is_date, 0] = dates[is_date].map(lambda value: datetime.combine(date.date(), value.time()))
+            sheet.to_excel(writer, sheet_name=sheet_name, header=False, index=False)
+    return buffer.getvalue()
+
+
+class EsiosStandIn:
+    def __init__(self, latency_seconds: float = 0.0, failure_rate: float = 0.0, seed: int | None = None,
+                 statuses: dict[str, list[int]] | None = None):
+        """
+        HTTP server answering like api.esios.ree.es/archives/71/download?date=<date>
+
+        :param latency_seconds: float. Latency injected before answering each request
+        :param failure_rate: float. Probability [0, 1] of answering a request with a 503
+        :param seed: int | None. Seed for the failure injection
+        :param statuses: dict[str, list[int]] | None. Statuses answered, in order, to the first requests of some
+                        dates (as EXPECTED_DATE_FORMAT). Once they are used up, the date is served normally
+        """
+        self.latency_seconds = latency_seconds
+        self.failure_rate = failure_rate
+        self.statuses = {date_str: list(date_statuses) for date_str, date_statuses in (statuses or {}).items()}
+        self.requests, self.failures, self.connections, self.not_modified = 0, 0, 0, 0
+        # Requests being answered right now, and the most there ever were at the same time
+        self.in_flight, self.max_in_flight = 0, 0
+        # Requests received for each date
+        self.requests_by_date = {}
+        self._random = random.Random(seed)
+        self._lock = Lock()
+        self._server = ThreadingHTTPServer(('127.0.0.1', 0), self.__build_handler())
+        self._server.daemon_threads = True
+        self._thread = None
+
+    @property
+    def url(self) -> str:
+        """
+        Url template to give to PricesDownloader, with the {date} placeholder
+        """
+        host, port = self._server.server_address
+        return f"http://{host}:{port}{DOWNLOAD_PATH}?date={{date}}"
+
+    def __build_handler(self):
+        stand_in = self
+
+        class Handler(BaseHTTPRequestHandler):
+            # HTTP/1.1 keeps the connections alive
+            protocol_version = 'HTTP/1.1'
+
+            def setup(self):
+                super().setup()
+                with stand_in._lock:
+                    stand_in.connections += 1
+
+            def do_GET(self):
+                with stand_in._lock:
+                    stand_in.in_flight += 1
+                    stand_in.max_in_flight = max(stand_in.max_in_flight, stand_in.in_flight)
+                try:
+                    self.__get()
+                finally:
+                    with stand_in._lock:
+                        stand_in.in_flight -= 1
+
+            def __get(self):
+                url = urlsplit(self.path)
+                date_str = parse_qs(url.query).get('date', [None])[0]
+                with stand_in._lock:
+                    stand_in.requests += 1
+                    stand_in.requests_by_date[date_str] = stand_in.requests_by_date.get(date_str, 0) + 1
+                    scripted = stand_in.statuses.get(date_str, [])
+                    status = scripted.pop(0) if len(scripted) > 0 else \
+                        503 if stand_in._random.random() < stand_in.failure_rate else 200
+                    if status != 200:
+                        stand_in.failures += 1
+                if stand_in.latency_seconds > 0:
+                    time.sleep(stand_in.latency_seconds)
+                if url.path != DOWNLOAD_PATH or date_str is None:
+                    self.__answer(status=404, body=b'')
+                elif status != 200:
+                    self.__answer(status=status, body=b'Injected failure')
+                else:
+                    body = build_workbook(date_str=date_str)
+                    etag = f'"{hashlib.sha256(body).hexdigest()[:32]}"'
+                    if self.headers.get('If-None-Match') == etag:
+                        with stand_in._lock:
+                            stand_in.not_modified += 1
+                        self.__answer(status=304, body=b'', headers={'ETag': etag})
+                    else:
+                        self.__answer(status=200, body=body, headers={'ETag': etag})
+
+            def __answer(self, status: int, body: bytes, headers: dict[str, str] | None = None):
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/vnd.ms-excel')
+                self.send_header('Content-Length', str(len(body)))
+                for header, value in (headers or {}).items():
+                    self.send_header(header, value)
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
+
+    def start(self) -> 'EsiosStandIn':
+        self._thread = Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.stop()
+
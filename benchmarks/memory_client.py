@@ -0,0 +1,254 @@
+"""
+In-memory stand-in for the Firestore client. It implements the subset of the google-cloud-firestore API used by
+FirebaseManager and FirebaseQuerier, so both can run against it (instead of the real database or the emulator)
+to test or benchmark the ingest and query paths. Every call is counted in rpc_counts.
+"""
+
+import random
+import time
+from collections import Counter
+from copy import deepcopy
+from threading import RLock
+
+from google.api_core.exceptions import ServiceUnavailable
+
+MAX_BATCH_WRITES = 500
+
+
+class MemoryDocumentSnapshot:
+    def __init__(self, reference, data: dict | None, field_paths: list[str] | None = None):
+        self.reference = reference
+        self.id = reference.id
+        self.exists = data is not None
+        if data is not None and field_paths is not None:
+            data = {field: value for field, value in data.items() if field in field_paths}
+        self._data = data
+
+    def to_dict(self) -> dict | None:
+        return deepcopy(self._data)
+
+    def get(self, field_path: str):
+        return deepcopy(self._data[field_path])
+
+
+class MemoryDocumentReference:
+    def __init__(self, client, collection_path: str, doc_id: str):
+        self._client = client
+        self._collection_path = collection_path
+        self.id = doc_id
+        self.path = f"{collection_path}/{doc_id}"
+
+    def collection(self, collection_id: str):
+        return MemoryCollectionReference(client=self._client, path=f"{self.path}/{collection_id}")
+
+    def get(self, field_paths: list[str] | None = None) -> MemoryDocumentSnapshot:
+        self._client._rpc('get')
+        return MemoryDocumentSnapshot(reference=self, data=self._client._read(self._collection_path, self.id),
+                                      field_paths=field_paths)
+
+    def set(self, document_data: dict, merge: bool = False):
+        self._client._rpc('set')
+        self._client._write(self._collection_path, self.id, document_data, merge=merge)
+
+    def delete(self):
+        self._client._rpc('delete')
+        self._client._delete(self._collection_path, self.id)
+
+
+class MemoryQuery:
+    def __init__(self, collection, filters: tuple = (), projection: list[str] | None = None,
+                 orders: tuple = (), limit: int | None = None, cursor: dict | None = None):
+        self._collection = collection
+        self._filters = filters
+        self._projection = projection
+        self._orders = orders
+        self._limit = limit
+        self._cursor = cursor
+
+    def _copy(self, **kwargs):
+        values = dict(filters=self._filters, projection=self._projection, orders=self._orders,
+                      limit=self._limit, cursor=self._cursor)
+        values.update(kwargs)
+        return MemoryQuery(collection=self._collection, **values)
+
+    def where(self, field_path: str | None = None, op_string: str | None = None, value=None, filter=None):
+        if filter is not None:
+            field_path, op_string, value = filter.field_path, filter.op_string, filter.value
+        return self._copy(filters=self._filters + ((field_path, op_string, value),))
+
+    def select(self, field_paths: list[str]):
+        return self._copy(projection=list(field_paths))
+
+    def order_by(self, field_path: str, direction: str = 'ASCENDING'):
+        return self._copy(orders=self._orders + ((field_path, direction),))
+
+    def limit(self, count: int):
+        return self._copy(limit=count)
+
+    def start_after(self, document_fields):
+        if isinstance(document_fields, MemoryDocumentSnapshot):
+            reference = document_fields.reference
+            document_fields = {'__name__': reference.id,
+                               **self._collection._client._read(reference._collection_path, reference.id)}
+        return self._copy(cursor=document_fields)
+
+    def _sort_fields(self) -> list[str]:
+        if self._orders:
+            return [field for field, _ in self._orders]
+        # Firestore implicitly orders by the field of an inequality filter before the document id
+        return [field for field, op, _ in self._filters if op in ('<', '<=', '>', '>=')][:1]
+
+    def stream(self):
+        client = self._collection._client
+        client._rpc('query')
+        documents = client._documents(self._collection.path)
+        matches = [(doc_id, data) for doc_id, data in documents.items()
+                   if all(field in data and _compare(data[field], op, value) for field, op, value in self._filters)]
+        sort_fields = self._sort_fields()
+        descending = any(direction == 'DESCENDING' for _, direction in self._orders)
+        sort_key = lambda item: tuple(item[1][field] for field in sort_fields) + (item[0],)
+        matches.sort(key=sort_key, reverse=descending)
+        if self._cursor is not None:
+            cursor_key = tuple(self._cursor[field] for field in sort_fields) + (self._cursor.get('__name__', ''),)
+            matches = [item for item in matches
+                       if (sort_key(item) < cursor_key if descending else sort_key(item) > cursor_key)]
+        if self._limit is not None:
+            matches = matches[:self._limit]
+        client._rpc('read', amount=len(matches))
+        for doc_id, data in matches:
+            reference = MemoryDocumentReference(client=client, collection_path=self._collection.path, doc_id=doc_id)
+            yield MemoryDocumentSnapshot(reference=reference, data=deepcopy(data), field_paths=self._projection)
+
+    def get(self) -> list[MemoryDocumentSnapshot]:
+        return list(self.stream())
+
+
+class MemoryCollectionReference(MemoryQuery):
+    def __init__(self, client, path: str):
+        self._client = client
+        self.path = path
+        self.id = path.rsplit('/', 1)[-1]
+        super().__init__(collection=self)
+
+    def document(self, document_id: str | None = None) -> MemoryDocumentReference:
+        if document_id is None:
+            document_id = f"{random.getrandbits(80):020x}"
+        return MemoryDocumentReference(client=self._client, collection_path=self.path, doc_id=document_id)
+
+    def list_documents(self, page_size: int | None = None):
+        self._client._rpc('list')
+        for doc_id in sorted(self._client._documents(self.path)):
+            yield MemoryDocumentReference(client=self._client, collection_path=self.path, doc_id=doc_id)
+
+
+class MemoryWriteBatch:
+    def __init__(self, client):
+        self._client = client
+        self._writes = []
+
+    def set(self, reference: MemoryDocumentReference, document_data: dict, merge: bool = False):
+        self._writes.append(('set', reference, deepcopy(document_data), merge))
+
+    def delete(self, reference: MemoryDocumentReference):
+        self._writes.append(('delete', reference, None, False))
+
+    def commit(self) -> list:
+        assert len(self._writes) <= MAX_BATCH_WRITES, f"A batch can contain up to {MAX_BATCH_WRITES} writes"
+        self._client._rpc('commit')
+        if self._client.failure_rate and self._client._random.random() < self._client.failure_rate:
+            raise ServiceUnavailable("Injected failure from MemoryClient")
+        with self._client._lock:
+            for operation, reference, data, merge in self._writes:
+                if operation == 'set':
+                    self._client._write(reference._collection_path, reference.id, data, merge=merge)
+                else:
+                    self._client._delete(reference._collection_path, reference.id)
+        writes, self._writes = self._writes, []
+        return writes
+
+
+class MemoryClient:
+    def __init__(self, latency_seconds: float = 0.0, failure_rate: float = 0.0, seed: int | None = None):
+        """
+        In-memory Firestore client
+
+        :param latency_seconds: float. Latency to inject in every RPC, to simulate the network round-trip
+        :param failure_rate: float. Probability [0, 1] of a batch commit failing with ServiceUnavailable
+        :param seed: int | None. Seed for the failure injection
+        """
+        self.latency_seconds = latency_seconds
+        self.failure_rate = failure_rate
+        self.rpc_counts = Counter()
+        self._random = random.Random(seed)
+        self._lock = RLock()
+        self._collections = {}
+        # Set by close, so tests can check who closes the client
+        self.closed = False
+
+    def _rpc(self, kind: str, amount: int = 1):
+        with self._lock:
+            self.rpc_counts[kind] += amount
+        if self.latency_seconds > 0 and kind != 'read':
+            time.sleep(self.latency_seconds)
+
+    def _documents(self, collection_path: str) -> dict[str, dict]:
+        with self._lock:
+            return dict(self._collections.get(collection_path, {}))
+
+    def _read(self, collection_path: str, doc_id: str) -> dict | None:
+        with self._lock:
+            return deepcopy(self._collections.get(collection_path, {}).get(doc_id))
+
+    def _write(self, collection_path: str, doc_id: str, data: dict, merge: bool = False):
+        with self._lock:
+            documents = self._collections.setdefault(collection_path, {})
+            if merge and doc_id in documents:
+                documents[doc_id] = {**documents[doc_id], **deepcopy(data)}
+            else:
+                documents[doc_id] = deepcopy(data)
+
+    def _delete(self, collection_path: str, doc_id: str):
+        with self._lock:
+            self._collections.get(collection_path, {}).pop(doc_id, None)
+
+    def collection(self, collection_id: str) -> MemoryCollectionReference:
+        return MemoryCollectionReference(client=self, path=collection_id)
+
+    def batch(self) -> MemoryWriteBatch:
+        return MemoryWriteBatch(client=self)
+
+    def get_all(self, references, field_paths: list[str] | None = None):
+        references = list(references)
+        self._rpc('batch_get')
+        self._rpc('read', amount=len(references))
+        for reference in references:
+            yield MemoryDocumentSnapshot(reference=reference,
+                                         data=self._read(reference._collection_path, reference.id),
+                                         field_paths=field_paths)
+
+    def reset_rpc_counts(self):
+        with self._lock:
+            self.rpc_counts.clear()
+
+    def close(self):
+        self.closed = True
+
+
+def _compare(left, op_string: str, right) -> bool:
+    if op_string == '==':
+        return left == right
+    elif op_string == '!=':
+        return left != right
+    elif op_string == '<':
+        return left < right
+    elif op_string == '<=':
+        return left <= right
+    elif op_string == '>':
+        return left > right
+    elif op_string == '>=':
+        return left >= right
+    elif op_string == 'in':
+        return left in right
+    elif op_string == 'array-contains':
+        return right in left
+    raise ValueError(f"Unsupported operator {op_string}")
@@ -0,0 +1,184 @@
+"""
+This class downloads many urls concurrently with asyncio. It keeps a sliding window of requests in flight over a
+pool of persistent connections, retries failed requests with jittered backoff and rate limits each host
+"""
+
+import asyncio
+import random
+import time
+from collections import defaultdict
+from typing import Awaitable, Callable, Hashable, Iterable
+from urllib.parse import urlsplit
+
+import aiohttp
+from loguru import logger
+
+from data_management.constants import DOWNLOAD_MAX_IN_FLIGHT, DOWNLOAD_REQUESTS_PER_SECOND, DOWNLOAD_MAX_RETRIES, \
+    DOWNLOAD_RETRY_BACKOFF_SECONDS, DOWNLOAD_TIMEOUT_SECONDS
+from utils.metrics import metrics
+
+RETRYABLE_STATUSES = (429, 500, 502, 503, 504)
+
+
+class DownloadResponse:
+    def __init__(self, url: str, status: int, body: bytes, headers):
+        """
+        :param url: str. Url requested
+        :param status: int. HTTP status of the response
+        :param body: bytes. Content of the response
+        :param headers: Case insensitive mapping with the headers of the response
+        """
+        self.url = url
+        self.status = status
+        self.body = body
+        self.headers = headers
+
+
+class RateLimiter:
+    def __init__(self, requests_per_second: float):
+        """
+        Spaces the requests to a host so that no more than requests_per_second are started
+
+        :param requests_per_second: float. Maximum rate. If 0 or less, there is no limit
+        """
+        self.interval = 1 / requests_per_second if requests_per_second > 0 else 0.0
+        self._next_time = 0.0
+        self._lock = asyncio.Lock()
+
+    async def wait(self):
+        if self.interval == 0:
+            return
+        async with self._lock:
+            now = time.monotonic()
+            if self._next_time > now:
+                await asyncio.sleep(self._next_time - now)
+            self._next_time = max(now, self._next_time) + self.interval
+
+
+class AsyncDownloadEngine:
+    def __init__(self, max_in_flight: int = DOWNLOAD_MAX_IN_FLIGHT,
+                 requests_per_second: float = DOWNLOAD_REQUESTS_PER_SECOND, max_retries: int = DOWNLOAD_MAX_RETRIES,
+                 backoff_seconds: float = DOWNLOAD_RETRY_BACKOFF_SECONDS, timeout_seconds: float = DOWNLOAD_TIMEOUT_SECONDS):
+        """
+        :param max_in_flight: int. Maximum number of requests in flight. A new one starts as soon as any finishes
+        :param requests_per_second: float. Maximum requests started per second for each host. 0 means no limit
+        :param max_retries: int. Number of retries for failed requests (connection errors, timeouts, 429 and 5xx)
+        :param backoff_seconds: float. Base waiting time between retries, doubled on each retry and jittered
+        :param timeout_seconds: float. Timeout of each request
+        """
+        assert max_in_flight > 0, f"max_in_flight must be positive"
+        self.max_in_flight = max_in_flight
+        self.requests_per_second = requests_per_second
+        self.max_retries = max_retries
+        self.backoff_seconds = backoff_seconds
+        self.timeout_seconds = timeout_seconds
+
+    def run(self, requests: Iterable[tuple[Hashable, str, dict[str, str] | None]],
+            on_response: Callable[[Hashable, DownloadResponse], Awaitable | None]) -> dict:
+        """
+        Download all the requests and call on_response for each of them, as they arrive
+
+        :param requests: Iterable[tuple[Hashable, str, dict[str, str] | None]]. (key, url, headers) of each request.
+                            It is consumed lazily, as the window moves
+        :param on_response: Callable[[Hashable, DownloadResponse], Awaitable | None]. Called with the key and the
+                            response of each successful request. It can be a coroutine function
+
+        :return: dict. Stats with the requests, retries, bytes, elapsed seconds and the keys that failed
+        """
+        return asyncio.run(self.fetch_all(requests=requests, on_response=on_response))
+
+    async def fetch_all(self, requests: Iterable[tuple[Hashable, str, dict[str, str] | None]],
+                        on_response: Callable[[Hashable, DownloadResponse], Awaitable | None]) -> dict:
+        """
+        Coroutine version of run()
+        """
+        stats = {'requests': 0, 'retries': 0, 'bytes': 0, 'elapsed_seconds': 0.0, 'failed': []}
+        rate_limiters = defaultdict(lambda: RateLimiter(requests_per_second=self.requests_per_second))
+        requests = iter(requests)
+        pending = set()
+        start_time = time.perf_counter()
+
+        # A single session keeps the connections alive between requests
+        connector = aiohttp.TCPConnector(limit=self.max_in_flight, limit_per_host=self.max_in_flight)
+        timeout = aiohttp.ClientTimeout(total=self.timeout_seconds)
+        async with aiohttp.ClientSession(connector=connector, timeout=timeout) as session:
+
+            def start_next() -> bool:
+                try:
+                    key, url, headers = next(requests)
+                except StopIteration:
+                    return False
+                pending.add(asyncio.ensure_future(self.__process(session=session, key=key, url=url, headers=headers,
+                                                                 on_response=on_response, stats=stats,
+                                                                 rate_limiters=rate_limiters)))
+                return True
+
+            # Fill the window, and then start a new request each time one finishes
+            while len(pending) < self.max_in_flight and start_next():
+                pass
+            while len(pending) > 0:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    task.result()
+                    start_next()
+
+        stats['elapsed_seconds'] = time.perf_counter() - start_time
+        return stats
+
+    async def __process(self, session: aiohttp.ClientSession, key: Hashable, url: str, headers: dict[str, str] | None,
+                        on_response: Callable, stats: dict, rate_limiters: dict):
+        try:
+            response = await self.fetch(session=session, url=url, headers=headers, stats=stats,
+                                        rate_limiter=rate_limiters[urlsplit(url).netloc])
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            logger.error(f"Failed to download {url}: {e}")
+            stats['failed'].append(key)
+            return
+        result = on_response(key, response)
+        if asyncio.iscoroutine(result) or isinstance(result, asyncio.Future):
+            await result
+
+    async def fetch(self, session: aiohttp.ClientSession, url: str, headers: dict[str, str] | None = None,
+                    stats: dict | None = None, rate_limiter: RateLimiter | None = None) -> DownloadResponse:
+        """
+        Download a single url, retrying with jittered exponential backoff
+
+        :param session: aiohttp.ClientSession. Session to use
+        :param url: str. Url to download
+        :param headers: dict[str, str] | None. Headers of the request
+        :param stats: dict | None. If given, the request, retries and bytes counters are updated
+        :param rate_limiter: RateLimiter | None. Rate limiter of the host
+
+        :return: DownloadResponse. Response with a status lower than 400
+
+        :raises aiohttp.ClientError: If the request still fails after all the retries
+        """
+        stats = stats if stats is not None else defaultdict(int)
+        for attempt in range(self.max_retries + 1):
+            if rate_limiter is not None:
+                await rate_limiter.wait()
+            stats['requests'] += 1
+            start_time = time.perf_counter()
+            try:
+                async with session.get(url, headers=headers) as response:
+                    body = await response.read()
+                    metrics.observe('http_request_seconds', time.perf_counter() - start_time)
+                    metrics.inc('http_requests_total', status=response.status)
+                    if response.status in RETRYABLE_STATUSES:
+                        raise aiohttp.ClientResponseError(request_info=response.request_info, history=(),
+                                                          status=response.status, message=response.reason)
+                    response.raise_for_status()
+                    stats['bytes'] += len(body)
+                    metrics.inc('http_bytes_total', len(body))
+                    return DownloadResponse(url=url, status=response.status, body=body, headers=response.headers.copy())
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                retryable = not isinstance(e, aiohttp.ClientResponseError) or e.status in RETRYABLE_STATUSES
+                if not retryable or attempt == self.max_retries:
+                    metrics.inc('http_failures_total')
+                    raise
+                # Full jitter, so the retries of many requests don't synchronize
+                wait = random.uniform(0, self.backoff_seconds * (2 ** attempt))
+                logger.warning(f"Download of {url} failed ({e}). Retrying in {wait:.2f}s [{attempt + 1}/{self.max_retries}]")
+                stats['retries'] += 1
+                metrics.inc('http_retries_total')
+                await asyncio.sleep(wait)
@@ -1,10 +1,31 @@
 import os
+from datetime import date
 
 DOWNLOAD_PRICE_DAY_URL_XLS = 'https://api.esios.ree.es/archives/71/download?date={date}'
 EXPECTED_DATE_FORMAT = '%Y-%m-%d'
 
 DATA_FOLDER = os.path.join(os.path.dirname(os.path.dirname(__file__)), 'data')
 TEMP_FOLDER = os.path.join(DATA_FOLDER, 'temp')
+MANIFEST_FILENAME = 'manifest.json'
+RAW_CACHE_FOLDER_NAME = 'raw'
+RAW_CACHE_FOLDER = os.path.join(DATA_FOLDER, RAW_CACHE_FOLDER_NAME)
+PRICE_CUBE_FOLDER_NAME = 'cube'
+PRICE_CUBE_FOLDER = os.path.join(DATA_FOLDER, PRICE_CUBE_FOLDER_NAME)
+# First day that the price cube can hold (first day of PVPC prices)
+PRICE_CUBE_START_DATE = date(2014, 4, 1)
+# Days allocated each time the price cube runs out of space
+PRICE_CUBE_GROWTH_DAYS = 366
+PRICE_INDEX_FOLDER = os.path.join(DATA_FOLDER, 'price_index')
+PRICE_INDEX_START_DATE = PRICE_CUBE_START_DATE
+# Highest tariff period (6 periods tolls, like 3.0TD)
+PRICE_INDEX_MAX_PERIOD = 6
+QUERY_CACHE_PATH = os.path.join(DATA_FOLDER, 'query_cache.json')
+# Maximum number of BY_DAY documents kept in the query cache (around 1.5 KB each)
+QUERY_CACHE_MAX_DAYS = 20000
+# The journal of the query cache is folded into its snapshot once it is larger than the snapshot and than this
+QUERY_CACHE_JOURNAL_MIN_BYTES = 4 * 1024 * 1024
+# A lock of the query cache journal older than this is considered left behind by a crashed process
+QUERY_CACHE_LOCK_STALE_SECONDS = 60
 
 PCB, CYM = 'PCB', 'CYM'
 
@@ -12,6 +33,12 @@ SHEET_NAMES_TO_FOLDER = {
     'Tabla de Datos PCB': os.path.join(DATA_FOLDER, PCB),
     'Tabla de Datos CYM': os.path.join(DATA_FOLDER, CYM)
 }
+# Old files came with a single sheet for all the locations
+OLD_FORMAT_SHEET_NAME = 'Tabla de Datos'
+# Processes used to parse the downloaded xls files
+PARSE_WORKERS = max(1, (os.cpu_count() or 2) // 2)
+
+PRICE_FIELDS = ('PVPC_price_kwh', 'TEU_charges_kwh', 'TCU_production_price_kwh')
 
 # --- COLLECTIONS ---
 
@@ -25,10 +52,74 @@ PRICES = 'PRICES'
 # ---- AGGREGATIONS ----
 NO_AGGREGATION = 'NO-AGGREGATION'
 BY_DAY = 'BY-DAY'
-#BY_MONTH = 'BY-MONTH'
+BY_MONTH = 'BY-MONTH'
 
 
 LOCATION_DESCRIPTIONS = {
     PCB: 'Peninsula, Canarias, Baleares',
     CYM: 'Ceuta, Melilla'
-}
\ No newline at end of file
+}
+# Collections whose parent documents are checked when a client is first used (see client_pool)
+WARM_UP_LOCATION_TOLLS = [(PCB, '2.0TD'), (CYM, '2.0TD')]
+
+# ---- DOWNLOADS ----
+DOWNLOAD_MAX_IN_FLIGHT = 8
+DOWNLOAD_REQUESTS_PER_SECOND = 10.0
+DOWNLOAD_MAX_RETRIES = 5
+DOWNLOAD_RETRY_BACKOFF_SECONDS = 1.0
+DOWNLOAD_TIMEOUT_SECONDS = 60
+
+# ---- STREAMING PIPELINE ----
+PIPELINE_QUEUE_SIZE = 16
+PIPELINE_PUBLISH_WORKERS = 4
+
+# ---- FIRESTORE WRITES ----
+MAX_WRITE_BATCH_SIZE = 500
+WRITE_BATCH_MAX_IN_FLIGHT = 4
+WRITE_MAX_RETRIES = 5
+WRITE_RETRY_BACKOFF_SECONDS = 0.5
+# Maximum number of references requested in a single get_all call
+GET_ALL_CHUNK_SIZE = 300
+
+# Little-endian float dtype of the hourly values of compact BY_DAY documents ('<f8' or '<f4')
+COMPACT_ENCODING_DTYPE = '<f8'
+# Decimals the hourly values are rounded to before computing the fingerprint of a day, so the noise of a csv
+# round-trip doesn't make an unchanged day look revised
+FINGERPRINT_DECIMALS = 10
+
+# ---- FIRESTORE QUERIES ----
+# Documents read per page of a range query
+QUERY_PAGE_SIZE = 300
+# Long ranges are split in partitions of these days, queried concurrently
+QUERY_PARTITION_DAYS = 180
+QUERY_MAX_WORKERS = 4
+
+# ---- LOCAL STORAGE ----
+SQLITE_PATH = os.path.join(DATA_FOLDER, 'prices.sqlite3')
+# Days read from the source and written to the target at once when replicating
+REPLICATE_CHUNK_DAYS = 366
+
+# ---- SYNC ----
+# Watermarks of the last day ingested of each location/toll, and lock against overlapping runs
+SYNC_STATE_PATH = os.path.join(DATA_FOLDER, 'sync_state.json')
+SYNC_LOCK_PATH = os.path.join(DATA_FOLDER, 'sync.lock')
+# Days before the watermark that are synced again, to pick up the revisions of ESIOS
+SYNC_LOOKBACK_DAYS = 3
+# First day synced when there is no watermark yet
+SYNC_INITIAL_DATE = date(2020, 1, 1)
+# A lock older than this is considered left behind by a crashed run
+SYNC_LOCK_STALE_SECONDS = 6 * 60 * 60
+
+# ---- METRICS ----
+# Prefix of the metric names, as pvpc_<name>
+METRICS_PREFIX = 'pvpc'
+# Upper bounds (in seconds) of the buckets of the timing histograms
+METRICS_TIME_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+METRICS_PROMETHEUS_PATH = os.path.join(DATA_FOLDER, 'metrics.prom')
+METRICS_JSON_PATH = os.path.join(DATA_FOLDER, 'metrics.json')
+# cProfile stats of the stage being profiled, as <stage>.prof
+PROFILE_FOLDER = os.path.join(DATA_FOLDER, 'profiles')
+
+# ---- ANALYSIS ----
+# Consumption profiles billed at once by the backtester
+BACKTEST_CHUNK_SIZE = 1024
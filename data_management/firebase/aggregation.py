@@ -0,0 +1,151 @@
+"""
+This class reduces BY_DAY documents into running sums, counts, minimums and maximums by hour and by period as they
+stream in, so an aggregation over any range takes constant memory. Accumulators of different partitions of a range
+can be merged, and persisted as the rollups of the BY_MONTH documents
+"""
+
+import numpy as np
+
+
+class PriceAccumulator:
+    def __init__(self, field: str = 'PVPC_price_kwh'):
+        """
+        :param field: str. Hourly field of the BY_DAY documents to aggregate
+        """
+        self.field = field
+        self.days = 0
+        self.hour_sums, self.hour_counts = np.zeros(24, dtype=np.float64), np.zeros(24, dtype=np.int64)
+        self.hour_mins, self.hour_maxs = np.full(24, np.inf), np.full(24, -np.inf)
+        # Period statistics keep the order in which periods were first seen
+        self.period_sums, self.period_counts, self.period_mins, self.period_maxs = {}, {}, {}, {}
+        # Periods of each hour of the first day seen, as a reference to color plots
+        self.periods_by_hour = None
+
+    def add(self, doc: dict):
+        """
+        Add a BY_DAY document
+
+        :param doc: dict. Document with the hourly lists (or arrays) of the field and 'period'
+        """
+        periods, prices = np.asarray(doc['period']), np.asarray(doc[self.field], dtype=np.float64)
+        assert len(periods) == len(prices), f"Periods and prices should have the same length. Got {len(periods)} periods and {len(prices)} prices"
+        self.hour_sums += prices
+        self.hour_counts += 1
+        np.minimum(self.hour_mins, prices, out=self.hour_mins)
+        np.maximum(self.hour_maxs, prices, out=self.hour_maxs)
+        # In the order in which the periods appear in the day
+        unique_periods, first_hours = np.unique(periods, return_index=True)
+        for period in unique_periods[np.argsort(first_hours)]:
+            period_prices = prices[periods == period]
+            self.__add_period(period=int(period), price_sum=float(period_prices.sum()), count=len(period_prices),
+                              price_min=float(period_prices.min()), price_max=float(period_prices.max()))
+        if self.periods_by_hour is None:
+            self.periods_by_hour = [int(period) for period in periods]
+        self.days += 1
+
+    def add_all(self, docs) -> 'PriceAccumulator':
+        """
+        Add every document of an iterable, consuming it lazily
+
+        :param docs: Iterable[dict]. BY_DAY documents
+        :return: PriceAccumulator. Itself
+        """
+        for doc in docs:
+            self.add(doc=doc)
+        return self
+
+    def merge(self, other: 'PriceAccumulator') -> 'PriceAccumulator':
+        """
+        Add the values accumulated by another accumulator. Merging the partitions of a range in order gives the same
+        result as accumulating the whole range
+
+        :param other: PriceAccumulator. Accumulator of the same field
+        :return: PriceAccumulator. Itself
+        """
+        assert other.field == self.field, f"Can't merge accumulators of {self.field} and {other.field}"
+        self.hour_sums += other.hour_sums
+        self.hour_counts += other.hour_counts
+        np.minimum(self.hour_mins, other.hour_mins, out=self.hour_mins)
+        np.maximum(self.hour_maxs, other.hour_maxs, out=self.hour_maxs)
+        for period, price_sum in other.period_sums.items():
+            self.__add_period(period=period, price_sum=price_sum, count=other.period_counts[period],
+                              price_min=other.period_mins[period], price_max=other.period_maxs[period])
+        if self.periods_by_hour is None:
+            self.periods_by_hour = other.periods_by_hour
+        self.days += other.days
+        return self
+
+    def __add_period(self, period: int, price_sum: float, count: int, price_min: float, price_max: float):
+        if period not in self.period_sums:
+            self.period_sums[period], self.period_counts[period] = price_sum, count
+            self.period_mins[period], self.period_maxs[period] = price_min, price_max
+        else:
+            self.period_sums[period] += price_sum
+            self.period_counts[period] += count
+            self.period_mins[period] = min(self.period_mins[period], price_min)
+            self.period_maxs[period] = max(self.period_maxs[period], price_max)
+
+    def to_dict(self) -> dict:
+        """
+        :return: dict. Statistics as plain python types, to be stored in a Firestore document. Periods are the
+                        keys of the maps, as strings. Maps don't keep their order in Firestore, so the order in which
+                        the periods were first seen is kept in period_order
+        """
+        return {
+            'days': self.days,
+            'hour_sum': [float(value) for value in self.hour_sums],
+            'hour_count': [int(value) for value in self.hour_counts],
+            'hour_min': [float(value) for value in self.hour_mins],
+            'hour_max': [float(value) for value in self.hour_maxs],
+            'period_sum': {str(period): float(value) for period, value in self.period_sums.items()},
+            'period_count': {str(period): int(value) for period, value in self.period_counts.items()},
+            'period_min': {str(period): float(value) for period, value in self.period_mins.items()},
+            'period_max': {str(period): float(value) for period, value in self.period_maxs.items()},
+            'period_order': [int(period) for period in self.period_sums],
+            'periods_by_hour': self.periods_by_hour
+        }
+
+    @classmethod
+    def from_dict(cls, statistics: dict, field: str = 'PVPC_price_kwh') -> 'PriceAccumulator':
+        """
+        Build an accumulator from the statistics returned by to_dict
+
+        :param statistics: dict. Statistics, as returned by to_dict
+        :param field: str. Hourly field the statistics belong to
+        :return: PriceAccumulator. Accumulator that can be merged with others
+        """
+        accumulator = cls(field=field)
+        accumulator.days = statistics['days']
+        accumulator.hour_sums = np.array(statistics['hour_sum'], dtype=np.float64)
+        accumulator.hour_counts = np.array(statistics['hour_count'], dtype=np.int64)
+        accumulator.hour_mins = np.array(statistics['hour_min'], dtype=np.float64)
+        accumulator.hour_maxs = np.array(statistics['hour_max'], dtype=np.float64)
+        for period in cls.__period_order(statistics=statistics):
+            accumulator.period_sums[int(period)] = statistics['period_sum'][period]
+            accumulator.period_counts[int(period)] = statistics['period_count'][period]
+            accumulator.period_mins[int(period)] = statistics['period_min'][period]
+            accumulator.period_maxs[int(period)] = statistics['period_max'][period]
+        accumulator.periods_by_hour = statistics['periods_by_hour']
+        return accumulator
+
+    @staticmethod
+    def __period_order(statistics: dict) -> list[str]:
+        # Rollups written before period_order existed take the order of the first day, then the rest of periods
+        order = statistics.get('period_order')
+        if order is None:
+            order = list(dict.fromkeys(statistics['periods_by_hour'] or [])) + sorted(map(int, statistics['period_sum']))
+        return [period for period in dict.fromkeys(str(period) for period in order) if period in statistics['period_sum']]
+
+    def hourly_means(self) -> dict[int, float]:
+        """
+        :return: dict[int, float]. Average of the field for each hour (0 to 23). NaN if no day was added
+        """
+        with np.errstate(invalid='ignore', divide='ignore'):
+            means = self.hour_sums / self.hour_counts
+        return {hour: means[hour] for hour in range(24)}
+
+    def period_means(self) -> dict[int, float]:
+        """
+        :return: dict[int, float]. Average of the field for each period seen
+        """
+        return {period: price_sum / self.period_counts[period] for period, price_sum in self.period_sums.items()}
@@ -0,0 +1,222 @@
+"""
+This class groups Firestore writes into write batches and commits them concurrently, so that long ingests don't
+pay one round-trip per document
+"""
+
+import random
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from threading import Lock, BoundedSemaphore, local
+
+from google.api_core import exceptions as google_exceptions
+from loguru import logger
+
+from data_management.constants import MAX_WRITE_BATCH_SIZE, WRITE_BATCH_MAX_IN_FLIGHT, WRITE_MAX_RETRIES, \
+    WRITE_RETRY_BACKOFF_SECONDS
+from utils.metrics import metrics
+
+RETRYABLE_EXCEPTIONS = (google_exceptions.Aborted, google_exceptions.DeadlineExceeded,
+                        google_exceptions.InternalServerError, google_exceptions.ResourceExhausted,
+                        google_exceptions.ServiceUnavailable)
+
+
+class BatchWriter:
+    def __init__(self, client, batch_size: int = MAX_WRITE_BATCH_SIZE, max_in_flight: int = WRITE_BATCH_MAX_IN_FLIGHT,
+                 max_retries: int = WRITE_MAX_RETRIES, backoff_seconds: float = WRITE_RETRY_BACKOFF_SECONDS):
+        """
+        Buffer of pending writes that is committed in batches of batch_size documents
+
+        :param client: Firestore client (or any client implementing batch(), like the MemoryClient of
+                        benchmarks/memory_client.py)
+        :param batch_size: int. Maximum number of writes per batch (Firestore allows up to 500)
+        :param max_in_flight: int. Maximum number of batches being committed at the same time. When reached,
+                                    new writes block until one of them finishes
+        :param max_retries: int. Number of times a failed batch is retried before raising the error
+        :param backoff_seconds: float. Base waiting time between retries. It is doubled on each retry and jittered
+        """
+        assert 0 < batch_size <= MAX_WRITE_BATCH_SIZE, f"batch_size must be in (0, {MAX_WRITE_BATCH_SIZE}]"
+        assert max_in_flight > 0, f"max_in_flight must be positive"
+        self.client = client
+        self.batch_size = batch_size
+        self.max_retries = max_retries
+        self.backoff_seconds = backoff_seconds
+
+        self._lock = Lock()
+        self._pending = []
+        self._futures = []
+        self._in_flight = BoundedSemaphore(value=max_in_flight)
+        self._executor = ThreadPoolExecutor(max_workers=max_in_flight)
+        # Operations of the group open in each thread (see group)
+        self._groups = local()
+
+        self._writes, self._batches, self._retries = 0, 0, 0
+        self._start_time, self._end_time = None, None
+
+    def set(self, doc_ref, data: dict):
+        """
+        Add a set operation to the buffer. It is committed when the current batch is full or on flush()
+
+        :param doc_ref: Document reference to write
+        :param data: dict. Content of the document
+        """
+        self.__buffer(operation=('set', doc_ref, data))
+
+    def delete(self, doc_ref):
+        """
+        Add a delete operation to the buffer. It is committed when the current batch is full or on flush()
+
+        :param doc_ref: Document reference to delete
+        """
+        self.__buffer(operation=('delete', doc_ref, None))
+
+    @contextmanager
+    def group(self):
+        """
+        Commit all the writes added by this thread inside the block in the same batch, so they are applied
+        atomically (all or none). Writes to the same document are collapsed into the last one, so a delete followed
+        by a set of the same document is a single set. Nothing is added if the block raises
+
+        Example:
+            with writer.group():
+                writer.delete(doc_ref=old_ref)
+                writer.set(doc_ref=new_ref, data=data)
+        """
+        assert getattr(self._groups, 'operations', None) is None, f"Groups can't be nested"
+        operations = {}
+        self._groups.operations = operations
+        try:
+            yield self
+        finally:
+            self._groups.operations = None
+        assert len(operations) <= self.batch_size, \
+            f"A group can contain up to {self.batch_size} documents, got {len(operations)}"
+        if len(operations) > 0:
+            self.__add(operations=list(operations.values()), atomic=True)
+
+    def __buffer(self, operation: tuple):
+        operations = getattr(self._groups, 'operations', None)
+        if operations is None:
+            self.__add(operations=[operation])
+        else:
+            # Removed first so the document keeps the position of its last write
+            operations.pop(operation[1].path, None)
+            operations[operation[1].path] = operation
+
+    def __add(self, operations: list[tuple], atomic: bool = False):
+        with self._lock:
+            if self._start_time is None:
+                self._start_time = time.perf_counter()
+            self._end_time = None
+            ready = []
+            # An atomic group never spans 2 batches, the pending writes are sent first if it doesn't fit
+            if atomic and len(self._pending) + len(operations) > self.batch_size:
+                ready.append(self._pending)
+                self._pending = []
+            self._pending.extend(operations)
+            while len(self._pending) >= self.batch_size:
+                ready.append(self._pending[:self.batch_size])
+                self._pending = self._pending[self.batch_size:]
+        for batch in ready:
+            self.__submit(operations=batch)
+
+    def __submit(self, operations: list[tuple]):
+        # Blocks when max_in_flight batches are already being committed (backpressure)
+        with metrics.timer('write_backpressure_seconds'):
+            self._in_flight.acquire()
+        future = self._executor.submit(self.__commit, operations)
+        future.add_done_callback(lambda _: self._in_flight.release())
+        with self._lock:
+            self._futures.append(future)
+
+    def __commit(self, operations: list[tuple]) -> int:
+        for attempt in range(self.max_retries + 1):
+            batch = self.client.batch()
+            for operation, doc_ref, data in operations:
+                if operation == 'set':
+                    batch.set(doc_ref, data)
+                else:
+                    batch.delete(doc_ref)
+            try:
+                metrics.inc('firestore_rpcs_total', method='commit')
+                with metrics.timer('firestore_commit_seconds'):
+                    batch.commit()
+                break
+            except RETRYABLE_EXCEPTIONS as e:
+                if attempt == self.max_retries:
+                    metrics.inc('firestore_commit_failures_total')
+                    raise
+                metrics.inc('firestore_commit_retries_total')
+                wait = self.backoff_seconds * (2 ** attempt) * random.uniform(0.5, 1.5)
+                logger.warning(f"Batch commit failed ({e}). Retrying in {wait:.2f}s [{attempt + 1}/{self.max_retries}]")
+                with self._lock:
+                    self._retries += 1
+                time.sleep(wait)
+        with self._lock:
+            self._writes += len(operations)
+            self._batches += 1
+        metrics.inc('firestore_writes_total', len(operations))
+        return len(operations)
+
+    def flush(self) -> dict[str, float]:
+        """
+        Commit every pending write and wait for all the batches in flight
+
+        :return: dict[str, float]. Throughput stats (see stats)
+
+        :raises Exception: The first error of the batches that could not be committed after all the retries
+        """
+        with self._lock:
+            pending, self._pending = self._pending, []
+        if len(pending) > 0:
+            self.__submit(operations=pending)
+        with self._lock:
+            futures, self._futures = self._futures, []
+        # Wait for all of them before raising, so no batch is left running in the background
+        errors = [future.exception() for future in futures]
+        self._end_time = time.perf_counter()
+        errors = [error for error in errors if error is not None]
+        if len(errors) > 0:
+            raise errors[0]
+        return self.stats
+
+    @property
+    def stats(self) -> dict[str, float]:
+        """
+        Throughput stats of the writer
+
+        :return: dict[str, float]. Dict with the committed writes, batches, retries, elapsed seconds and writes/second
+        """
+        with self._lock:
+            if self._start_time is None:
+                elapsed = 0.0
+            else:
+                elapsed = (self._end_time or time.perf_counter()) - self._start_time
+            return {
+                'writes': self._writes,
+                'batches': self._batches,
+                'retries': self._retries,
+                'elapsed_seconds': elapsed,
+                'writes_per_second': self._writes / elapsed if elapsed > 0 else 0.0
+            }
+
+    def close(self) -> dict[str, float]:
+        """
+        Flush the writer and release its threads
+
+        :return: dict[str, float]. Throughput stats (see stats)
+        """
+        try:
+            return self.flush()
+        finally:
+            self._executor.shutdown(wait=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        if exc_type is None:
+            self.close()
+        else:
+            # Don't hide the original error with a flush error
+            self._executor.shutdown(wait=True)
@@ -0,0 +1,163 @@
+"""
+Process-wide Firestore clients and collection references. The firebase app is initialized once and its client is
+shared by every FirebaseManager and FirebaseQuerier. The LOCATIONS/TOLLS parent documents of the collections are
+checked once per client (all of them in a single get_all at warm-up), so the write and query paths never pay an
+existence round-trip
+"""
+
+import os
+import weakref
+from threading import Lock
+
+from loguru import logger
+
+from data_management.constants import PVPC_PRICES, LOCATIONS, TOLLS, PRICES, NO_AGGREGATION, BY_DAY, BY_MONTH, \
+    LOCATION_DESCRIPTIONS, GET_ALL_CHUNK_SIZE, WARM_UP_LOCATION_TOLLS
+from utils.metrics import metrics
+
+CREDENTIALS_PATH = os.path.join(os.path.dirname(__file__), "..", "..", "resources", "credentials",
+                                "electric-bill-backtesting-firebase-adminsdk-d44q1-c89a4a1bb7.json")
+
+_lock = Lock()
+# Clients will have the format {<credentials path>: <Firestore client>}
+_clients = {}
+# Firebase apps of the clients, with the same keys
+_apps = {}
+# Registries are dropped with their client
+_registries = weakref.WeakKeyDictionary()
+
+
+def get_client(credentials_path: str = CREDENTIALS_PATH):
+    """
+    Get the shared Firestore client of some credentials, initializing the firebase app the first time
+
+    :param credentials_path: str. Path to the service account credentials
+
+    :return: Firestore client
+    """
+    with _lock:
+        if credentials_path not in _clients:
+            # Imported here so modules that only need the registry don't load the firebase sdk
+            import firebase_admin
+            from firebase_admin import credentials as firebase_crendentials, firestore
+
+            credentials = firebase_crendentials.Certificate(cert=credentials_path)
+            # The first credentials use the default app, others get their own one
+            app = firebase_admin.initialize_app(credential=credentials,
+                                                **({} if len(_apps) == 0 else {'name': credentials_path}))
+            _apps[credentials_path] = app
+            _clients[credentials_path] = firestore.client(app=app)
+        return _clients[credentials_path]
+
+
+def close_clients():
+    """
+    Close every shared client and delete its firebase app. Later calls to get_client create new ones
+    """
+    with _lock:
+        clients, apps = list(_clients.values()), list(_apps.values())
+        _clients.clear()
+        _apps.clear()
+    for client in clients:
+        client.close()
+    if len(apps) > 0:
+        import firebase_admin
+
+        for app in apps:
+            firebase_admin.delete_app(app)
+
+
+def get_registry(client) -> 'CollectionRegistry':
+    """
+    :param client: Firestore client (or any client implementing the same interface, like the MemoryClient of
+                    benchmarks/memory_client.py)
+    :return: CollectionRegistry. Registry shared by every user of the client
+    """
+    with _lock:
+        if client not in _registries:
+            _registries[client] = CollectionRegistry(client=client)
+        return _registries[client]
+
+
+class CollectionRegistry:
+    def __init__(self, client):
+        """
+        Thread-safe registry of the PRICES collection references of a client
+
+        :param client: Firestore client (or any client implementing the same interface, like the MemoryClient of
+                    benchmarks/memory_client.py)
+        """
+        self.client = client
+        self.lock = Lock()
+        # References will have the format {(<aggregation>, <location>, <toll>): <collection reference>}
+        self._collections = {}
+        # Paths of the LOCATIONS/TOLLS parent documents already checked, and of those that exist
+        self._checked_parents, self._existing_parents = set(), set()
+
+    def collection(self, location: str = 'PCB', toll: str = '2.0TD', aggregation: str = NO_AGGREGATION):
+        """
+        Get the PRICES collection of a location, toll and aggregation. The first time, its parent documents are
+        created if they don't exist yet (unless warm_up found them)
+
+        :param location: str. Location of the data [PCB (Peninsula, Canarias, Baleares) or CYM (Ceuta, Melilla)]
+        :param toll: str. Toll of the data (2.0TD, 2.0A, 2.0DHA, 2.0-DHS...)
+        :param aggregation: str. Aggregation of the data (NO_AGGREGATION, BY_DAY, BY_MONTH)
+
+        :return: Collection reference
+        """
+        key = (aggregation, location, toll.replace('.', '-'))
+        collection_ref = self._collections.get(key)
+        if collection_ref is not None:
+            return collection_ref
+        with self.lock:
+            if key not in self._collections:
+                location_ref, toll_ref = self.__parent_refs(aggregation=aggregation, location=location, toll=key[2])
+                parents = [(location_ref, {'name': LOCATION_DESCRIPTIONS[location]}),
+                           (toll_ref, {'name': key[2].replace('-', '.')})]
+                self.__check(refs=[ref for ref, _ in parents if ref.path not in self._checked_parents])
+                for ref, data in parents:
+                    if ref.path not in self._existing_parents:
+                        metrics.inc('firestore_rpcs_total', method='set')
+                        ref.set(data)
+                        self._existing_parents.add(ref.path)
+                self._collections[key] = toll_ref.collection(PRICES)
+            return self._collections[key]
+
+    def warm_up(self, location_tolls: list[tuple[str, str]] = WARM_UP_LOCATION_TOLLS,
+                aggregations: tuple[str, ...] = (NO_AGGREGATION, BY_DAY, BY_MONTH)) -> int:
+        """
+        Check the parent documents of many collections with a single get_all. Those that exist are never checked
+        again, the missing ones are created when their collection is first used
+
+        :param location_tolls: list[tuple[str, str]]. (location, toll) pairs to check
+        :param aggregations: tuple[str, ...]. Aggregations to check
+
+        :return: int. Number of parent documents found
+        """
+        refs = {}
+        for aggregation in aggregations:
+            for location, toll in location_tolls:
+                for ref in self.__parent_refs(aggregation=aggregation, location=location, toll=toll.replace('.', '-')):
+                    refs[ref.path] = ref
+        with self.lock:
+            refs = [ref for path, ref in refs.items() if path not in self._checked_parents]
+            existing = self.__check(refs=refs)
+        logger.debug(f"Collection registry warmed up, {len(existing)} of {len(refs)} parent documents exist")
+        return len(existing)
+
+    def __check(self, refs: list) -> set[str]:
+        # Must be called holding the lock
+        existing = set()
+        for i in range(0, len(refs), GET_ALL_CHUNK_SIZE):
+            metrics.inc('firestore_rpcs_total', method='get_all')
+            existing.update(doc.reference.path for doc in self.client.get_all(refs[i:i + GET_ALL_CHUNK_SIZE],
+                                                                              field_paths=[])
+                            if doc.exists)
+        self._checked_parents.update(ref.path for ref in refs)
+        self._existing_parents.update(existing)
+        return existing
+
+    def __parent_refs(self, aggregation: str, location: str, toll: str) -> tuple:
+        location_ref = self.client.collection(PVPC_PRICES).document(aggregation).collection(LOCATIONS).\
+            document(location)
+        return location_ref, location_ref.collection(TOLLS).document(toll)
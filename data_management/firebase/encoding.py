@@ -0,0 +1,95 @@
+"""
+Compact format of the BY_DAY documents. The hourly series are packed as little-endian float bytes in a single field,
+and the periods of the day are stored inline as their pattern, a string with one digit per hour, instead of a 24
+elements array. Decoding is a zero-copy np.frombuffer, each distinct pattern is decoded once and shared by all the
+documents that have it, and documents in the original format are accepted as they are
+"""
+
+import hashlib
+from functools import lru_cache
+
+import numpy as np
+
+from data_management.constants import PRICE_FIELDS, COMPACT_ENCODING_DTYPE, FINGERPRINT_DECIMALS
+
+# Marks the documents in the compact format, with the dtype of the packed values
+ENCODING_FIELD = 'encoding'
+HOURLY_FIELD = 'hourly'
+PERIOD_PATTERN_FIELD = 'period_pattern'
+# Content hash of the values of a day, to rewrite only the days that changed
+FINGERPRINT_FIELD = 'fingerprint'
+# Fields to select in a query to be able to decode both formats
+DECODE_FIELD_PATHS = [ENCODING_FIELD, HOURLY_FIELD, PERIOD_PATTERN_FIELD, 'period', 'date', *PRICE_FIELDS]
+
+
+def encode_day(doc: dict, dtype: str = COMPACT_ENCODING_DTYPE) -> dict:
+    """
+    Encode a BY_DAY document in the compact format
+
+    :param doc: dict. BY_DAY document in the original format, with the hourly lists of PRICE_FIELDS and 'period'
+    :param dtype: str. Little-endian float dtype of the packed values ('<f8' or '<f4')
+
+    :return: dict. Document with the same keys, except the hourly lists, that are replaced by the HOURLY_FIELD bytes
+                    (PRICE_FIELDS in order, 24 values each) and the PERIOD_PATTERN_FIELD pattern string
+    """
+    assert dtype in ('<f8', '<f4'), f"dtype must be a little-endian float, not {dtype}"
+    periods = [int(period) for period in doc['period']]
+    assert all(0 <= period <= 9 for period in periods), f"Periods must be single digits, got {periods}"
+    encoded = {key: value for key, value in doc.items() if key not in PRICE_FIELDS and key != 'period'}
+    encoded[ENCODING_FIELD] = dtype
+    encoded[HOURLY_FIELD] = np.array([doc[field] for field in PRICE_FIELDS], dtype=dtype).tobytes()
+    encoded[PERIOD_PATTERN_FIELD] = ''.join(str(period) for period in periods)
+    return encoded
+
+
+def decode_day(doc: dict) -> dict:
+    """
+    Decode a BY_DAY document in any of the formats
+
+    :param doc: dict. BY_DAY document, in the compact or the original format
+
+    :return: dict. Document in the original format. If it was compact, the hourly fields and 'period' are read only
+                    numpy arrays (views over the packed bytes and a shared pattern)
+    """
+    if ENCODING_FIELD not in doc:
+        return doc
+    decoded = {key: value for key, value in doc.items()
+               if key not in (ENCODING_FIELD, HOURLY_FIELD, PERIOD_PATTERN_FIELD)}
+    values = np.frombuffer(doc[HOURLY_FIELD], dtype=doc[ENCODING_FIELD]).reshape(len(PRICE_FIELDS), -1)
+    for i, field in enumerate(PRICE_FIELDS):
+        decoded[field] = values[i]
+    decoded['period'] = period_pattern(pattern=doc[PERIOD_PATTERN_FIELD])
+    return decoded
+
+
+def day_fingerprint(doc: dict) -> str:
+    """
+    Get the content fingerprint of a BY_DAY document. It only depends on the hourly values and periods, so it is the
+    same for both formats, and for the data of a day parsed again from an unchanged ESIOS file
+
+    :param doc: dict. BY_DAY document, in the compact or the original format
+
+    :return: str. Hex digest of the hourly values (as float64, rounded to FINGERPRINT_DECIMALS) and periods
+    """
+    doc = decode_day(doc=doc)
+    values = np.round(np.array([doc[field] for field in PRICE_FIELDS], dtype='<f8'), FINGERPRINT_DECIMALS)
+    hasher = hashlib.blake2b(digest_size=16)
+    # Adding 0.0 turns -0.0 into 0.0, so both hash the same
+    hasher.update((values + 0.0).tobytes())
+    hasher.update(np.array(doc['period'], dtype='<i8').tobytes())
+    return hasher.hexdigest()
+
+
+@lru_cache(maxsize=256)
+def period_pattern(pattern: str) -> np.ndarray:
+    """
+    Get the periods of a pattern. There are very few distinct patterns, so each one is decoded once and shared by all
+    the documents that have it
+
+    :param pattern: str. Pattern of the day, one digit per hour
+
+    :return: np.ndarray. Read only array with the period of each hour
+    """
+    periods = np.array([int(period) for period in pattern], dtype=np.int64)
+    periods.flags.writeable = False
+    return periods
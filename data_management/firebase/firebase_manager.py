@@ -1,57 +1,139 @@
-import os
 from concurrent.futures import ThreadPoolExecutor
 from copy import deepcopy
 from datetime import datetime, date, timedelta
+from threading import Lock
+
+import pandas as pd
 
 from google.cloud.firestore_v1 import FieldFilter
 from loguru import logger
-import firebase_admin
-from firebase_admin import credentials as firebase_crendentials, firestore
 from tqdm import tqdm
-from data_management.constants import DATA_FOLDER, BY_DAY, NO_AGGREGATION
-from utils.utils import load_csv_as_dicts, get_all_files_with_filename_in_subfolders, get_doc_id_for_row, \
-    get_collection_name, get_collection
-
-CREDENTIALS_PATH = os.path.join(os.path.dirname(__file__), "..", "..", "resources", "credentials",
-                                "electric-bill-backtesting-firebase-adminsdk-d44q1-c89a4a1bb7.json")
+from data_management.constants import DATA_FOLDER, BY_DAY, BY_MONTH, NO_AGGREGATION, MAX_WRITE_BATCH_SIZE, \
+    WRITE_BATCH_MAX_IN_FLIGHT, WRITE_MAX_RETRIES, GET_ALL_CHUNK_SIZE, PRICE_FIELDS, WARM_UP_LOCATION_TOLLS
+from data_management.firebase.aggregation import PriceAccumulator
+from data_management.firebase.batch_writer import BatchWriter
+from data_management.firebase.client_pool import get_client, get_registry
+from data_management.firebase.encoding import encode_day, decode_day, day_fingerprint, FINGERPRINT_FIELD
+from data_management.firebase.query_cache import QueryCache, default_query_cache
+from data_management.manifest import DataManifest
+from utils.metrics import metrics
+from utils.utils import load_csv_as_dicts, get_doc_id_for_row, get_collection_name, get_collection, \
+    add_datetime_column
 
 class FirebaseManager:
-    def __init__(self):
-        credentials = firebase_crendentials.Certificate(cert=CREDENTIALS_PATH)
-        firebase_admin.initialize_app(credential=credentials)
-        self.client = firestore.client()
-
-
-    def post_day(self, day: date, skip_if_exist: bool = True) -> bool:
+    def __init__(self, client=None, manifest: DataManifest | None = None, query_cache: QueryCache | None = None,
+                 compact: bool = False):
+        """
+        :param client: Firestore client to use. If None, the shared client of the process (see client_pool).
+                        Any client implementing the same interface (like the MemoryClient of benchmarks/memory_client.py)
+                        can be given for testing
+        :param manifest: DataManifest | None. Manifest used to find the csv files. If None, the default one of
+                        DATA_FOLDER is used. It is only read when posting from csv files
+        :param query_cache: QueryCache | None. Every day posted is invalidated in it, so queries read the new data.
+                        Days buffered in a writer are invalidated again by flush, once the writes are done, and the
+                        cache is persisted. If None, the default persistent one (the one
+                        FirebaseQuerier reads) when the shared client is used, and none for any other client
+        :param compact: bool. If True, BY_DAY documents are written in the compact format (see encoding.encode_day).
+                        Queries read both formats, so collections can be migrated progressively
         """
-        Post the content of a csv file to the firebase database
+        # Never closed here: the shared client is closed by client_pool.close_clients, and a given one by its owner
+        self.client = client if client is not None else get_client()
+        self.manifest = manifest if manifest is not None else DataManifest()
+        # Parent documents of the known collections are checked at once, not on the first write of each one. Those
+        # of the manifest are added when posting from csv files (see __load_manifest)
+        get_registry(client=self.client).warm_up(location_tolls=WARM_UP_LOCATION_TOLLS)
+        self.query_cache = query_cache if query_cache is not None or client is not None else default_query_cache()
+        self.compact = compact
+        self.lock = Lock()
+        # Months with days posted since their BY_MONTH rollup was computed, as (<location>, <toll>, <first day>)
+        self._touched_months = set()
+        # Days buffered in a writer since the last flush, as (<location>, <toll>, <datetime>). A query running before
+        # their batch is committed may cache the old document again, so they are invalidated again once written
+        self._written_days = set()
+        # Location/toll/days not written because their content fingerprint didn't change
+        self.unchanged_days = 0
+
+
+    def post_day(self, day: date, skip_if_exist: bool = True, writer: BatchWriter | None = None,
+                 existing_doc_ids: dict[str, str | None] | None = None, skip_unchanged: bool = False) -> bool:
+        """
+        Post the content of a csv file to the firebase database. The BY_MONTH rollups of the days posted are
+        recomputed by flush (or close), once the writes are done
 
         :param day: date. Day of the data to post (example: datetime(year=2021, month=6, day=1))
+        :param skip_if_exist: bool. If True, the location/tolls that already exist in the database are skipped
+        :param writer: BatchWriter | None. If given, the documents are buffered in it instead of being written one
+                        by one. The caller is responsible for flushing it
+        :param existing_doc_ids: dict[str, str | None] | None. Fingerprints of the days already in the database, by
+                        doc id (see existing_doc_ids_for_date_range). If given, it is used instead of reading them
+        :param skip_unchanged: bool. If True (and skip_if_exist is False), the location/tolls that already exist are
+                        only written again if their content fingerprint changed (ESIOS revised the day)
         """
         date_str = day.strftime("%Y-%m-%d")
-        files = get_all_files_with_filename_in_subfolders(parent_folder=DATA_FOLDER,
-                                                          filename=f"{date_str}.csv")
+        files = self.manifest.files_for_date(day=day)
         assert len(files) > 0, f"No files found for date {date_str}"
         # Files will have the format {<PCB/CYM>: {<TOLL>: <PATH>}}
         for location, tolls in files.items():
             for toll, file_path in tolls.items():
-                if skip_if_exist and self.data_exists(day=day, location=location, toll=toll):
+                if skip_if_exist and self.__exists(day=day, location=location, toll=toll,
+                                                   existing_doc_ids=existing_doc_ids):
                     logger.info(f"Data for {date_str} already exists in the database. Skipping")
+                    metrics.inc('days_posted_total', result='existing')
                     continue
                 rows = load_csv_as_dicts(csv_path=file_path)
                 # Post the data to the database
-                self.__post(rows=rows, location=location, toll=toll)
+                self.__post(rows=rows, location=location, toll=toll, writer=writer,
+                            skip_unchanged=skip_unchanged and not skip_if_exist, existing_doc_ids=existing_doc_ids)
 
         return True
 
-    def __post(self, rows: list[dict[str, str | datetime | float | int]], location: str, toll: str) -> bool:
+    def post_frame(self, df: pd.DataFrame, location: str, toll: str, skip_if_exist: bool = True,
+                   writer: BatchWriter | None = None, existing_doc_ids: dict[str, str | None] | None = None,
+                   skip_unchanged: bool = False) -> bool:
+        """
+        Post the parsed data of a single day, location and toll to the database, without going through a csv file.
+        As post_day, its BY_MONTH rollup is recomputed by flush (or close)
+
+        :param df: pd.DataFrame. Data of the day, with the columns of the csv files written by PricesDownloader
+        :param location: str. Location of the data [PCB (Peninsula, Canarias, Baleares) or CYM (Ceuta, Melilla)]
+        :param toll: str. Toll of the data (2.0TD, 2.0A, 2.0DHA, 2.0-DHS...)
+        :param skip_if_exist: bool. If True, the day is skipped when it already exists in the database
+        :param writer: BatchWriter | None. If given, the documents are buffered in it instead of written directly
+        :param existing_doc_ids: dict[str, str | None] | None. Fingerprints of the days already in the database, by
+                        doc id (see existing_doc_ids_for_date_range). If given, it is used instead of reading them
+        :param skip_unchanged: bool. If True (and skip_if_exist is False), the day is only written again if it
+                        doesn't exist or its content fingerprint changed
+
+        :return: bool. True if the data was posted successfully (or skipped), False otherwise
+        """
+        day = datetime.strptime(df['date'].iloc[0], "%Y-%m-%d")
+        if skip_if_exist and self.__exists(day=day, location=location, toll=toll, existing_doc_ids=existing_doc_ids):
+            logger.info(f"Data for {df['date'].iloc[0]} already exists in the database. Skipping")
+            metrics.inc('days_posted_total', result='existing')
+            return True
+        # Same types and row criteria as a csv round-trip
+        df = df.sort_values(by='hour').infer_objects()
+        # If the day contains 25 hours, that's a winter time change, let's assume the last hour never existed
+        if len(df) == 25:
+            df = df[:-1]
+        rows = add_datetime_column(df=df.copy()).to_dict(orient='records')
+        return self.__post(rows=rows, location=location, toll=toll, writer=writer,
+                           skip_unchanged=skip_unchanged and not skip_if_exist, existing_doc_ids=existing_doc_ids)
+
+    def __post(self, rows: list[dict[str, str | datetime | float | int]], location: str, toll: str,
+               writer: BatchWriter | None = None, skip_unchanged: bool = False,
+               existing_doc_ids: dict[str, str | None] | None = None) -> bool:
         """
         Post the data to the database
         :param rows: list[dict[str, str | datetime | float | int]]. Data to post, should be always 24 rows, one for each hour
         :param location: str. Location of the data [PCB (Peninsula, Canarias, Baleares) or CYM (Ceuta, Melilla)]
         :param toll: str. Toll of the data (2.0TD, 2.0A, 2.0DHA, 2.0-DHS...)
+        :param writer: BatchWriter | None. If given, the documents are buffered in it instead of written directly
+        :param skip_unchanged: bool. If True, nothing is written if the stored fingerprint of the day is the same
+        :param existing_doc_ids: dict[str, str | None] | None. Fingerprints of the days already in the database, by
+                        doc id. If None and skip_unchanged, the stored fingerprint is read from the database
 
-        :return: bool. True if the data was posted successfully, False otherwise
+        :return: bool. True if the data was posted successfully (or skipped), False otherwise
         """
         # It happens during the day that the summer time changes, so there are 23 rows instead of 24
         if len(rows) == 23:
@@ -63,17 +145,29 @@ class FirebaseManager:
             rows = rows[:-1]
         assert len(rows) == 24, f"Expected 24 rows, got {len(rows)}"
 
-        ok_no_aggregation = self.__post_no_aggregation(rows=rows, location=location, toll=toll)
-        ok_day_aggregation = self.__post_day_aggregation(rows=rows, location=location, toll=toll)
+        full_day_row = self.__full_day_row(rows=rows, location=location, toll=toll)
+        if skip_unchanged and self.__stored_fingerprint(row=full_day_row, existing_doc_ids=existing_doc_ids) == \
+                full_day_row[FINGERPRINT_FIELD]:
+            logger.info(f"Data for {full_day_row['date']} {location}/{toll} is unchanged in the database. Skipping")
+            with self.lock:
+                self.unchanged_days += 1
+            metrics.inc('days_posted_total', result='unchanged')
+            return True
+
+        ok_no_aggregation = self.__post_no_aggregation(rows=rows, location=location, toll=toll, writer=writer)
+        ok_day_aggregation = self.__post_day_aggregation(full_day_row=full_day_row, writer=writer)
+        metrics.inc('days_posted_total', result='written')
 
         return ok_no_aggregation and ok_day_aggregation
 
-    def __post_no_aggregation(self, rows: list[dict[str, str | datetime | float | int]], location: str, toll: str) -> bool:
+    def __post_no_aggregation(self, rows: list[dict[str, str | datetime | float | int]], location: str, toll: str,
+                              writer: BatchWriter | None = None) -> bool:
         """
         Post the data to the database
         :param rows: list[dict[str, str | datetime | float | int]]. Data to post, should be always 24 rows, one for each hour
         :param location: str. Location of the data [PCB (Peninsula, Canarias, Baleares) or CYM (Ceuta, Melilla)]
         :param toll: str. Toll of the data (2.0TD, 2.0A, 2.0DHA, 2.0-DHS...)
+        :param writer: BatchWriter | None. If given, the documents are buffered in it instead of written directly
 
         :return: bool. True if the data was posted successfully, False otherwise
         """
@@ -89,23 +183,23 @@ class FirebaseManager:
             # Create a document reference
             doc_ref = collection_ref.document(doc_id)
             # Post the data to the database
-            doc_ref.set(row)
+            self.__set(doc_ref=doc_ref, data=row, writer=writer)
 
         return True
 
-    def __post_day_aggregation(self, rows: list[dict[str, str | datetime | float | int]], location: str, toll: str) -> bool:
+    @staticmethod
+    def __full_day_row(rows: list[dict[str, str | datetime | float | int]], location: str, toll: str) -> dict:
         """
-        Post the data to the database
-        :param rows: list[dict[str, str | datetime | float | int]]. Data to post, should be always 24 rows, one for each hour
+        Build the BY_DAY document of a day, with the fingerprint of its content
+        :param rows: list[dict[str, str | datetime | float | int]]. Data of the day, should be always 24 rows
         :param location: str. Location of the data [PCB (Peninsula, Canarias, Baleares) or CYM (Ceuta, Melilla)]
         :param toll: str. Toll of the data (2.0TD, 2.0A, 2.0DHA, 2.0-DHS...)
 
-        :return: bool. True if the data was posted successfully, False otherwise
+        :return: dict. BY_DAY document, in the original format
         """
         # It happens during the day that the summer time changes, so there are 23 rows instead of 24
         assert len(rows) == 24, f"Expected 24 rows, got {len(rows)}"
 
-        collection_ref = get_collection(client=self.client, location=location, toll=toll, aggregation=BY_DAY)
         full_day_row = {
             'datetime_spain': rows[0]['datetime_spain'],
             'date': rows[0]['date'],
@@ -119,15 +213,42 @@ class FirebaseManager:
         }
 
         assert all(key in rows[0] for key in full_day_row.keys()), f"Some defined names mismatch with NO_AGGREGATION"
+        full_day_row[FINGERPRINT_FIELD] = day_fingerprint(doc=full_day_row)
+        return full_day_row
 
+    def __post_day_aggregation(self, full_day_row: dict, writer: BatchWriter | None = None) -> bool:
+        """
+        Post the data to the database
+        :param full_day_row: dict. BY_DAY document of the day (see __full_day_row)
+        :param writer: BatchWriter | None. If given, the documents are buffered in it instead of written directly
+
+        :return: bool. True if the data was posted successfully, False otherwise
+        """
+        location, toll = full_day_row['location'], full_day_row['toll']
+        collection_ref = get_collection(client=self.client, location=location, toll=toll, aggregation=BY_DAY)
         # Format datetime_spain to create the document_id
         doc_id = get_doc_id_for_row(row=full_day_row)
         # Create a document reference
         doc_ref = collection_ref.document(doc_id)
         # Post the data to the database
-        doc_ref.set(full_day_row)
+        self.__set(doc_ref=doc_ref, data=encode_day(doc=full_day_row) if self.compact else full_day_row, writer=writer)
+        if self.query_cache is not None:
+            self.query_cache.invalidate(location=location, toll=toll, day=full_day_row['datetime_spain'])
+        with self.lock:
+            self._touched_months.add((location, toll, full_day_row['datetime_spain'].date().replace(day=1)))
+            if writer is not None:
+                self._written_days.add((location, toll, full_day_row['datetime_spain']))
         return True
 
+    @staticmethod
+    def __set(doc_ref, data: dict, writer: BatchWriter | None = None):
+        if writer is None:
+            metrics.inc('firestore_rpcs_total', method='set')
+            with metrics.timer('firestore_set_seconds'):
+                doc_ref.set(data)
+        else:
+            writer.set(doc_ref=doc_ref, data=data)
+
 
     def data_exists(self, day: date, location: str = 'PCB', toll: str = '2.0TD') -> bool:
         """
@@ -143,41 +264,351 @@ class FirebaseManager:
         collection_ref_no_aggregation = get_collection(client=self.client, location=location, toll=toll, aggregation=NO_AGGREGATION)
         collection_ref_day_aggregation = get_collection(client=self.client, location=location, toll=toll, aggregation=BY_DAY)
         # Get the document
-        doc_no_aggregation = collection_ref_no_aggregation.document(doc_id).get()
-        doc_day_aggregation = collection_ref_day_aggregation.document(doc_id).get()
+        metrics.inc('firestore_rpcs_total', 2, method='get')
+        with metrics.timer('exists_probe_seconds'):
+            doc_no_aggregation = collection_ref_no_aggregation.document(doc_id).get()
+            doc_day_aggregation = collection_ref_day_aggregation.document(doc_id).get()
         # Get True, only if it exists in both collections (to avoid partial data)
         return doc_no_aggregation.exists and doc_day_aggregation.exists
 
 
-    def post_for_date_range(self, start_date: date, end_date: date, _batch_size: int = 8) -> bool:
+    def __exists(self, day: date, location: str, toll: str,
+                 existing_doc_ids: dict[str, str | None] | None = None) -> bool:
+        if existing_doc_ids is None:
+            return self.data_exists(day=day, location=location, toll=toll)
+        doc_id = get_doc_id_for_row(row={'datetime_spain': day, 'location': location, 'toll': toll})
+        return doc_id in existing_doc_ids
+
+    def __stored_fingerprint(self, row: dict, existing_doc_ids: dict[str, str | None] | None = None) -> str | None:
+        # Fingerprint of the day in the database. None if it doesn't exist (in both collections, as in data_exists)
+        # or was written before fingerprints were stored, so it is always written again
+        doc_id = get_doc_id_for_row(row=row)
+        if existing_doc_ids is not None:
+            return existing_doc_ids.get(doc_id)
+        location, toll = row['location'], row['toll']
+        collection_ref_no_aggregation = get_collection(client=self.client, location=location, toll=toll, aggregation=NO_AGGREGATION)
+        collection_ref_day_aggregation = get_collection(client=self.client, location=location, toll=toll, aggregation=BY_DAY)
+        metrics.inc('firestore_rpcs_total', method='get')
+        if not collection_ref_no_aggregation.document(doc_id).get(field_paths=[]).exists:
+            return None
+        metrics.inc('firestore_rpcs_total', method='get')
+        doc_day_aggregation = collection_ref_day_aggregation.document(doc_id).get(field_paths=[FINGERPRINT_FIELD])
+        return (doc_day_aggregation.to_dict() or {}).get(FINGERPRINT_FIELD) if doc_day_aggregation.exists else None
+
+    def existing_doc_ids_for_date_range(self, start_date: date, end_date: date,
+                                        location_tolls: list[tuple[str, str]]) -> dict[str, str | None]:
+        """
+        Get the doc ids and content fingerprints of all the days in a range that exist in the database, using a single
+        range query on BY_DAY (reading only the fingerprint) and batched get_all calls on NO_AGGREGATION for each
+        location/toll. Same criteria as data_exists, a day only exists if it is present in both collections.
+
+        :param start_date: date. Start date of the range
+        :param end_date: date. End date of the range
+        :param location_tolls: list[tuple[str, str]]. List of (location, toll) pairs to check
+
+        :return: dict[str, str | None]. Fingerprint of each day that exists, by doc id (as built by
+                                        get_doc_id_for_row). None for the days written before fingerprints were stored
         """
-        Post the content of a csv file to the firebase database
+        start_timestamp = datetime.combine(start_date, datetime.min.time())
+        end_timestamp = datetime.combine(end_date, datetime.max.time())
+        existing_doc_ids = {}
+        for location, toll in location_tolls:
+            collection_ref_day_aggregation = get_collection(client=self.client, location=location, toll=toll,
+                                                            aggregation=BY_DAY)
+            # Only the keys and fingerprints are needed
+            query = collection_ref_day_aggregation.\
+                where(filter=FieldFilter(field_path='datetime_spain', op_string='>=', value=start_timestamp)).\
+                where(filter=FieldFilter(field_path='datetime_spain', op_string='<=', value=end_timestamp)).\
+                select([FINGERPRINT_FIELD]).stream()
+            with metrics.timer('existence_index_seconds'):
+                metrics.inc('firestore_rpcs_total', method='query')
+                fingerprints = {doc.id: (doc.to_dict() or {}).get(FINGERPRINT_FIELD) for doc in query}
+                day_doc_ids = list(fingerprints)
+                # The first hour of NO_AGGREGATION shares the doc id with the day
+                collection_ref_no_aggregation = get_collection(client=self.client, location=location, toll=toll,
+                                                               aggregation=NO_AGGREGATION)
+                for i in range(0, len(day_doc_ids), GET_ALL_CHUNK_SIZE):
+                    refs = [collection_ref_no_aggregation.document(doc_id) for doc_id in day_doc_ids[i:i + GET_ALL_CHUNK_SIZE]]
+                    metrics.inc('firestore_rpcs_total', method='get_all')
+                    existing_doc_ids.update((doc.id, fingerprints[doc.id])
+                                            for doc in self.client.get_all(refs, field_paths=[]) if doc.exists)
+
+        return existing_doc_ids
+
+    def post_for_date_range(self, start_date: date, end_date: date, skip_if_exist: bool = True, _batch_size: int = 8,
+                            write_batch_size: int = MAX_WRITE_BATCH_SIZE, max_in_flight: int = WRITE_BATCH_MAX_IN_FLIGHT,
+                            max_retries: int = WRITE_MAX_RETRIES, skip_unchanged: bool = False) -> bool:
+        """
+        Post the content of a csv file to the firebase database. Hourly and daily documents of all the days, locations
+        and tolls are grouped into write batches, instead of being written one by one.
 
         :param start_date: date. Start date of the range
         :param end_date: date. End date of the range
+        :param skip_if_exist: bool. If True, the days already in the database are skipped. Which ones exist is
+                        checked once for the whole range, instead of once per day
+        :param write_batch_size: int. Number of documents per write batch
+        :param max_in_flight: int. Maximum number of write batches being committed at the same time
+        :param max_retries: int. Number of retries (with exponential backoff) for a failed write batch
+        :param skip_unchanged: bool. If True (and skip_if_exist is False), only the days that don't exist or whose
+                        content fingerprint changed are written. Fingerprints are read once for the whole range
         """
         assert start_date < end_date, f"start_date must be before end_date"
-        for i in tqdm(range(0, (end_date - start_date).days + 1, _batch_size), desc="Posting data"):
-            with ThreadPoolExecutor() as executor:
-                batch_size = min(_batch_size, (end_date - start_date).days - i + 1)
-                posted = list(executor.map(self.post_day, [start_date + timedelta(days=i + j) for j in range(batch_size)]))
-                assert all(posted), f"Not all data was posted successfully"
+        self.__load_manifest()
+        existing_doc_ids = None
+        if skip_if_exist or skip_unchanged:
+            existing_doc_ids = self.existing_doc_ids_for_date_range(
+                start_date=start_date, end_date=end_date, location_tolls=self.manifest.location_tolls())
+        with BatchWriter(client=self.client, batch_size=write_batch_size, max_in_flight=max_in_flight,
+                         max_retries=max_retries) as writer:
+            self.__for_each_day(start_date=start_date, end_date=end_date, desc="Posting data", _batch_size=_batch_size,
+                                function=lambda day: self.post_day(day=day, skip_if_exist=skip_if_exist,
+                                                                   writer=writer, existing_doc_ids=existing_doc_ids,
+                                                                   skip_unchanged=skip_unchanged))
+            stats = writer.flush()
+        self.flush()
+        logger.info(f"Posted {stats['writes']} documents in {stats['batches']} batches ({stats['retries']} retries) "
+                    f"at {stats['writes_per_second']:.1f} docs/s. {self.unchanged_days} unchanged days skipped")
 
         return True
 
-    def delete_collection(self, coll_ref, batch_size):
-        docs = coll_ref.list_documents(page_size=batch_size)
+    def purge_range(self, start_date: date, end_date: date, location_tolls: list[tuple[str, str]],
+                    _batch_size: int = 8, write_batch_size: int = MAX_WRITE_BATCH_SIZE,
+                    max_in_flight: int = WRITE_BATCH_MAX_IN_FLIGHT, max_retries: int = WRITE_MAX_RETRIES) -> int:
+        """
+        Delete the NO_AGGREGATION and BY_DAY documents of a date range. Doc ids are derived from the days, so nothing
+        is read: deletes are grouped into write batches committed concurrently. BY_MONTH rollups of the months
+        touched are recomputed (or deleted, if they are left without days)
+
+        :param start_date: date. Start date of the range
+        :param end_date: date. End date of the range
+        :param location_tolls: list[tuple[str, str]]. List of (location, toll) pairs to purge
+        :param write_batch_size: int. Number of deletes per write batch
+        :param max_in_flight: int. Maximum number of write batches being committed at the same time
+        :param max_retries: int. Number of retries (with exponential backoff) for a failed write batch
+
+        :return: int. Number of documents deleted (deleting a document that doesn't exist counts too)
+        """
+        assert start_date <= end_date, f"start_date must be before end_date"
+
+        def purge_day(day: date) -> bool:
+            for location, toll in location_tolls:
+                self.__purge_day(day=day, location=location, toll=toll, writer=writer)
+            return True
+
+        with BatchWriter(client=self.client, batch_size=write_batch_size, max_in_flight=max_in_flight,
+                         max_retries=max_retries) as writer:
+            self.__for_each_day(start_date=start_date, end_date=end_date, function=purge_day, desc="Purging data",
+                                _batch_size=_batch_size)
+            stats = writer.flush()
+        self.flush()
+        logger.info(f"Deleted {stats['writes']} documents in {stats['batches']} batches "
+                    f"at {stats['writes_per_second']:.1f} docs/s")
+        return stats['writes']
+
+    def repost_range(self, start_date: date, end_date: date, location_tolls: list[tuple[str, str]] | None = None,
+                     _batch_size: int = 8, write_batch_size: int = MAX_WRITE_BATCH_SIZE,
+                     max_in_flight: int = WRITE_BATCH_MAX_IN_FLIGHT, max_retries: int = WRITE_MAX_RETRIES) -> bool:
+        """
+        Purge and post again the days of a range from the csv files. Each location/toll/day is replaced atomically:
+        its deletes and writes go in the same write batch, so a query never sees the day missing or half written.
+        Days without a csv file are only purged
+
+        :param start_date: date. Start date of the range
+        :param end_date: date. End date of the range
+        :param location_tolls: list[tuple[str, str]] | None. List of (location, toll) pairs to replace. If None, the
+                        ones in the manifest
+        :param write_batch_size: int. Number of documents per write batch
+        :param max_in_flight: int. Maximum number of write batches being committed at the same time
+        :param max_retries: int. Number of retries (with exponential backoff) for a failed write batch
+        """
+        assert start_date <= end_date, f"start_date must be before end_date"
+        self.__load_manifest()
+        location_tolls = location_tolls if location_tolls is not None else self.manifest.location_tolls()
+
+        def repost_day(day: date) -> bool:
+            files = self.manifest.files_for_date(day=day)
+            for location, toll in location_tolls:
+                file_path = files.get(location, {}).get(toll)
+                with writer.group():
+                    # Documents written again collapse with their delete (see BatchWriter.group)
+                    self.__purge_day(day=day, location=location, toll=toll, writer=writer)
+                    if file_path is not None:
+                        self.__post(rows=load_csv_as_dicts(csv_path=file_path), location=location, toll=toll,
+                                    writer=writer)
+            return True
+
+        with BatchWriter(client=self.client, batch_size=write_batch_size, max_in_flight=max_in_flight,
+                         max_retries=max_retries) as writer:
+            self.__for_each_day(start_date=start_date, end_date=end_date, function=repost_day, desc="Reposting data",
+                                _batch_size=_batch_size)
+            stats = writer.flush()
+        self.flush()
+        logger.info(f"Replaced {stats['writes']} documents in {stats['batches']} batches "
+                    f"at {stats['writes_per_second']:.1f} docs/s")
+        return True
+
+    def purge_collections(self, location_tolls: list[tuple[str, str]],
+                          aggregations: tuple[str, ...] = (NO_AGGREGATION, BY_DAY, BY_MONTH),
+                          write_batch_size: int = MAX_WRITE_BATCH_SIZE,
+                          max_in_flight: int = WRITE_BATCH_MAX_IN_FLIGHT) -> int:
+        """
+        Delete every document of the collections of some location/tolls
+
+        :param location_tolls: list[tuple[str, str]]. List of (location, toll) pairs to purge
+        :param aggregations: tuple[str, ...]. Aggregations to purge
+        :param write_batch_size: int. Number of deletes per write batch
+        :param max_in_flight: int. Maximum number of write batches being committed at the same time
+
+        :return: int. Number of documents deleted
+        """
         deleted = 0
+        for location, toll in location_tolls:
+            for aggregation in aggregations:
+                collection_ref = get_collection(client=self.client, location=location, toll=toll,
+                                                aggregation=aggregation)
+                deleted += self.delete_collection(coll_ref=collection_ref, batch_size=write_batch_size,
+                                                  max_in_flight=max_in_flight)
+        if self.query_cache is not None:
+            self.query_cache.clear()
+            self.query_cache.save()
+        return deleted
+
+    def __purge_day(self, day: date, location: str, toll: str, writer: BatchWriter):
+        # Every document a day can have, without reading them: its 24 hours and the day
+        day_start = datetime.combine(day, datetime.min.time())
+        collection_ref_no_aggregation = get_collection(client=self.client, location=location, toll=toll,
+                                                       aggregation=NO_AGGREGATION)
+        for hour in range(24):
+            doc_id = get_doc_id_for_row(row={'datetime_spain': day_start + timedelta(hours=hour),
+                                             'location': location, 'toll': toll})
+            writer.delete(doc_ref=collection_ref_no_aggregation.document(doc_id))
+        collection_ref_day_aggregation = get_collection(client=self.client, location=location, toll=toll,
+                                                        aggregation=BY_DAY)
+        doc_id = get_doc_id_for_row(row={'datetime_spain': day_start, 'location': location, 'toll': toll})
+        writer.delete(doc_ref=collection_ref_day_aggregation.document(doc_id))
+        if self.query_cache is not None:
+            self.query_cache.invalidate(location=location, toll=toll, day=day_start)
+        with self.lock:
+            self._touched_months.add((location, toll, day_start.date().replace(day=1)))
+            self._written_days.add((location, toll, day_start))
+
+    def __load_manifest(self):
+        # Pick up the files registered by the downloader since this manager was created, and check the parent
+        # documents of their collections at once
+        self.manifest.load()
+        get_registry(client=self.client).warm_up(location_tolls=self.manifest.location_tolls())
+
+    @staticmethod
+    def __for_each_day(start_date: date, end_date: date, function, desc: str, _batch_size: int = 8):
+        # Runs function(day) for every day of the range, _batch_size days at a time in parallel
+        for i in tqdm(range(0, (end_date - start_date).days + 1, _batch_size), desc=desc):
+            with ThreadPoolExecutor() as executor:
+                batch_size = min(_batch_size, (end_date - start_date).days - i + 1)
+                days = [start_date + timedelta(days=i + j) for j in range(batch_size)]
+                done = list(executor.map(function, days))
+                assert all(done), f"Not all days were processed successfully"
+
+    def flush(self) -> int:
+        """
+        Recompute the BY_MONTH rollups of the months with days posted (or purged) since the last flush, invalidate
+        again the days written through a writer, and persist the query cache. Rollups are computed from the BY_DAY
+        documents, so the writer given to post_day or post_frame must be flushed first. The range methods call it on
+        their own
+
+        :return: int. Number of rollups written
+        """
+        with self.lock:
+            written_days, self._written_days = self._written_days, set()
+        if self.query_cache is not None:
+            for location, toll, day in written_days:
+                self.query_cache.invalidate(location=location, toll=toll, day=day)
+        written = self.update_month_rollups()
+        if self.query_cache is not None:
+            self.query_cache.save()
+        return written
+
+    def close(self):
+        """
+        Flush the pending rollups (see flush). To be called when done posting days one by one
+        """
+        self.flush()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def update_month_rollups(self, months: set[tuple[str, str, date]] | None = None) -> int:
+        """
+        Recompute the BY_MONTH documents of some months from their BY_DAY documents. Each one holds, for every
+        price field, the sum, count, minimum and maximum by hour and by period (see PriceAccumulator.to_dict), so
+        queries can aggregate whole months reading a single document. BY_DAY documents must be already written (flush
+        the writer first)
 
-        for doc in docs:
-            print(f"Deleting doc {doc.id} => {doc.get().to_dict()}")
-            doc.delete()
-            deleted = deleted + 1
+        :param months: set[tuple[str, str, date]] | None. Months to update, as (location, toll, first day of month).
+                        If None, the months with days posted (or purged) since the last update. Rollups of months left without
+                        days are deleted
 
-        if deleted >= batch_size:
-            return self.delete_collection(coll_ref, batch_size)
+        :return: int. Number of rollups written
+        """
+        if months is None:
+            with self.lock:
+                months, self._touched_months = self._touched_months, set()
+        written = 0
+        for location, toll, month_start in sorted(months):
+            month_start = datetime.combine(month_start.replace(day=1), datetime.min.time())
+            next_month_start = (month_start + timedelta(days=32)).replace(day=1)
+            collection_ref_day_aggregation = get_collection(client=self.client, location=location, toll=toll,
+                                                            aggregation=BY_DAY)
+            metrics.inc('firestore_rpcs_total', method='query')
+            query = collection_ref_day_aggregation.\
+                where(filter=FieldFilter(field_path='datetime_spain', op_string='>=', value=month_start)).\
+                where(filter=FieldFilter(field_path='datetime_spain', op_string='<', value=next_month_start)).\
+                order_by('datetime_spain').stream()
+            accumulators = {field: PriceAccumulator(field=field) for field in PRICE_FIELDS}
+            for doc in query:
+                doc = decode_day(doc=doc.to_dict())
+                for accumulator in accumulators.values():
+                    accumulator.add(doc=doc)
+            collection_ref_month_aggregation = get_collection(client=self.client, location=location, toll=toll,
+                                                              aggregation=BY_MONTH)
+            if accumulators[PRICE_FIELDS[0]].days == 0:
+                # The month shares the doc id with its first day
+                doc_id = get_doc_id_for_row(row={'datetime_spain': month_start, 'location': location, 'toll': toll})
+                metrics.inc('firestore_rpcs_total', method='delete')
+                collection_ref_month_aggregation.document(doc_id).delete()
+                continue
+            rollup = {
+                'datetime_spain': month_start,
+                'month': month_start.strftime("%Y-%m"),
+                'location': location,
+                'toll': toll,
+                'days': accumulators[PRICE_FIELDS[0]].days,
+                **{field: accumulator.to_dict() for field, accumulator in accumulators.items()}
+            }
+            doc_id = get_doc_id_for_row(row=rollup)
+            self.__set(doc_ref=collection_ref_month_aggregation.document(doc_id), data=rollup)
+            written += 1
+        if written > 0:
+            logger.info(f"Updated {written} monthly rollups")
+        return written
+
+    def delete_collection(self, coll_ref, batch_size: int = MAX_WRITE_BATCH_SIZE,
+                          max_in_flight: int = WRITE_BATCH_MAX_IN_FLIGHT) -> int:
+        """
+        Delete every document of a collection. Only the references are listed (documents are not read), and the
+        deletes are grouped into write batches committed concurrently
 
+        :param coll_ref: Reference to the collection
+        :param batch_size: int. Number of deletes per write batch (and page size of the listing)
+        :param max_in_flight: int. Maximum number of write batches being committed at the same time
 
-    def __del__(self):
-        # Close the connection to the database
-        self.client.close()
+        :return: int. Number of documents deleted
+        """
+        with BatchWriter(client=self.client, batch_size=batch_size, max_in_flight=max_in_flight) as writer:
+            for doc_ref in coll_ref.list_documents(page_size=batch_size):
+                writer.delete(doc_ref=doc_ref)
+            stats = writer.flush()
+        logger.info(f"Deleted {stats['writes']} documents of {coll_ref.id}")
+        return stats['writes']
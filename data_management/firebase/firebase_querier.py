@@ -1,43 +1,75 @@
-import os
-import numpy as np
-from collections import defaultdict
-from datetime import date, datetime
+import calendar
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, datetime, timedelta
 from google.cloud.firestore_v1 import FieldFilter
-import firebase_admin
-from firebase_admin import credentials as firebase_crendentials, firestore
 
-from data_management.constants import BY_DAY
+from data_management.constants import BY_DAY, BY_MONTH, QUERY_PAGE_SIZE, QUERY_PARTITION_DAYS, QUERY_MAX_WORKERS
+from data_management.firebase.aggregation import PriceAccumulator
+from data_management.firebase.client_pool import get_client, get_registry
+from data_management.firebase.encoding import decode_day, DECODE_FIELD_PATHS
+from data_management.price_matrix import PriceMatrix
+from data_management.firebase.query_cache import QueryCache, default_query_cache
+from utils.metrics import metrics
+from utils.plots import plot_avg_price_by_hour
 from utils.utils import get_collection_name, get_doc_id_for_row, get_collection
 
-CREDENTIALS_PATH = os.path.join(os.path.dirname(__file__), "..", "..", "resources", "credentials",
-                                "electric-bill-backtesting-firebase-adminsdk-d44q1-c89a4a1bb7.json")
-
-PERIOD_COLORS = {
-    1: 'red',
-    2: 'orange',
-    3: 'green'
-}
-
 class FirebaseQuerier():
-    def __init__(self):
-        credentials = firebase_crendentials.Certificate(cert=CREDENTIALS_PATH)
-        firebase_admin.initialize_app(credential=credentials)
-        self.client = firestore.client()
-
-
-    def avg_price_between_dates_by_period(self, start_date: date, end_date: date,
-                                          location: str = 'PCB', toll: str = '2.0TD') -> dict[int, float]:
+    def __init__(self, client=None, cache: QueryCache | None = None, use_cache: bool = True,
+                 page_size: int = QUERY_PAGE_SIZE, partition_days: int = QUERY_PARTITION_DAYS,
+                 max_workers: int = QUERY_MAX_WORKERS, use_rollups: bool = True):
         """
-        Get the average price between 2 dates by period
+        :param client: Firestore client to use. If None, the shared client of the process (see client_pool).
+                        Any client implementing the same interface (like the MemoryClient of benchmarks/memory_client.py)
+                        can be given for testing
+        :param cache: QueryCache | None. Cache of the BY_DAY documents already read. If None (and use_cache), the
+                        default persistent one when the shared client is used (the one FirebaseManager invalidates),
+                        and none for any other client
+        :param use_cache: bool. If False, every query reads from the database
+        :param page_size: int. Number of documents read per page of a range query
+        :param partition_days: int. Aggregations over longer ranges are split in partitions of these days, that are
+                        queried concurrently
+        :param max_workers: int. Maximum number of partitions queried at the same time
+        :param use_rollups: bool. If True, aggregations read the BY_MONTH rollup of every whole month in the range,
+                        and only the BY_DAY documents of the remaining days
+        """
+        self.client = client if client is not None else get_client()
+        get_registry(client=self.client).warm_up()
+        if cache is None and client is None:
+            cache = default_query_cache()
+        self.cache = cache if use_cache else None
+        self.page_size = page_size
+        self.partition_days = partition_days
+        self.max_workers = max_workers
+        self.use_rollups = use_rollups
 
+    def get_days_between_dates(self, start_date: date, end_date: date, location: str = 'PCB',
+                               toll: str = '2.0TD') -> list[dict[str, str | datetime | float | int]]:
+        """
+        Get the BY_DAY documents between 2 dates. Only the days that are not in the cache are read from the database
 
         :param start_date: date. Start date of the range
         :param end_date: date. End date of the range
         :param location: str. Location of the data [PCB (Peninsula, Canarias, Baleares) or CYM (Ceuta, Melilla)]
         :param toll: str. Toll of the data (2.0TD, 2.0A, 2.0DHA, 2.0-DHS...)
 
-        :return: dict[int, float]. Dict with the average price by period
+        :return: list[dict[str, str | datetime | float | int]]. Documents of the days that exist, sorted by date.
+                        Documents stored in the compact format are decoded (hourly fields as numpy arrays)
         """
+        fetch = lambda first, last: self.__query_days(start_date=first, end_date=last, location=location, toll=toll)
+        with metrics.timer('query_seconds', query='days'):
+            if self.cache is None:
+                return [decode_day(doc=doc) for doc in fetch(start_date, end_date)]
+            docs = self.cache.get_range(start_date=start_date, end_date=end_date, location=location, toll=toll,
+                                        fetch=fetch)
+            self.cache.save()
+            return [decode_day(doc=doc) for doc in docs]
+
+    def __query_days(self, start_date: date, end_date: date, location: str, toll: str) -> list[dict]:
+        # Whole documents are read, so the cache can also answer get_data_for_day
+        return list(self.__stream_days(start_date=start_date, end_date=end_date, location=location, toll=toll))
+
+    def __stream_days(self, start_date: date, end_date: date, location: str, toll: str,
+                      field_paths: list[str] | None = None):
         collection_ref = get_collection(client=self.client, location=location, toll=toll, aggregation=BY_DAY)
 
         # Build the timestamps to cover the whole day
@@ -47,25 +79,132 @@ class FirebaseQuerier():
         # Query Firestore
         query = collection_ref.where(filter=FieldFilter(field_path='datetime_spain', op_string='>=', value=start_timestamp)).\
                                where(filter=FieldFilter(field_path='datetime_spain', op_string='<=', value=end_timestamp)).\
-                               select(['period', 'PVPC_price_kwh', 'day']).stream()
-        docs = [doc.to_dict() for doc in query]
-        period_prices = defaultdict(list)
-        for day in docs:
-            periods, prices = day['period'], day['PVPC_price_kwh']
-            assert len(periods) == len(prices), f"Periods and prices should have the same length. Got {len(periods)} periods and {len(prices)} prices"
-            for period, price in zip(periods, prices):
-                period_prices[period].append(price)
-
-        # Calculate averages
-        avg_prices = {}
-        for period, prices in period_prices.items():
-            avg_prices[period] = sum(prices) / len(prices)
-
-        return avg_prices
+                               order_by('datetime_spain')
+        if field_paths is not None:
+            # The cursor needs the ordering field
+            query = query.select(list(field_paths) + ['datetime_spain'])
+        # Read it page by page, each one starting after the last document of the previous one
+        last_snapshot = None
+        while True:
+            page = query.limit(self.page_size) if last_snapshot is None else \
+                query.start_after(last_snapshot).limit(self.page_size)
+            metrics.inc('firestore_rpcs_total', method='query')
+            if metrics.enabled:
+                # Read the whole page before yielding it, so its time doesn't include the work of the caller
+                with metrics.timer('query_page_seconds'):
+                    snapshots = list(page.stream())
+                metrics.inc('firestore_documents_read_total', len(snapshots), aggregation=BY_DAY)
+            else:
+                snapshots = page.stream()
+            count = 0
+            for snapshot in snapshots:
+                count += 1
+                last_snapshot = snapshot
+                yield snapshot.to_dict()
+            if count < self.page_size:
+                break
 
-    def avg_price_between_dates_by_hour(self, start_date: date, end_date: date,
-                                          location: str = 'PCB', toll: str = '2.0TD',
-                                        plot: bool = True) -> dict[int, float]:
+    def aggregate_between_dates(self, start_date: date, end_date: date, location: str = 'PCB', toll: str = '2.0TD',
+                                field: str = 'PVPC_price_kwh') -> PriceAccumulator:
+        """
+        Aggregate an hourly field of the BY_DAY documents between 2 dates, by hour and by period. Whole months are
+        read from their BY_MONTH rollups (if use_rollups and they hold every day of the month). The remaining days
+        are split in partitions queried concurrently, and each document is reduced as it arrives (when the cache is
+        disabled, memory doesn't grow with the size of the range)
+
+        :param start_date: date. Start date of the range
+        :param end_date: date. End date of the range
+        :param location: str. Location of the data [PCB (Peninsula, Canarias, Baleares) or CYM (Ceuta, Melilla)]
+        :param toll: str. Toll of the data (2.0TD, 2.0A, 2.0DHA, 2.0-DHS...)
+        :param field: str. Hourly field to aggregate (PVPC_price_kwh, TEU_charges_kwh, TCU_production_price_kwh)
+
+        :return: PriceAccumulator. Sums, counts, minimums and maximums of the field by hour and by period
+        """
+        with metrics.timer('query_seconds', query='aggregate'):
+            return self.__aggregate_between_dates(start_date=start_date, end_date=end_date, location=location,
+                                                  toll=toll, field=field)
+
+    def __aggregate_between_dates(self, start_date: date, end_date: date, location: str, toll: str,
+                                  field: str) -> PriceAccumulator:
+        start_date = start_date.date() if isinstance(start_date, datetime) else start_date
+        end_date = end_date.date() if isinstance(end_date, datetime) else end_date
+        # Segments of the range in date order, either rollups of whole months or ranges of days
+        segments, day_start = [], start_date
+        if self.use_rollups:
+            for month_start, rollup in self.__month_rollups(start_date=start_date, end_date=end_date,
+                                                            location=location, toll=toll):
+                if day_start < month_start:
+                    segments.append((day_start, month_start - timedelta(days=1)))
+                segments.append(rollup)
+                day_start = (month_start + timedelta(days=32)).replace(day=1)
+        if day_start <= end_date:
+            segments.append((day_start, end_date))
+
+        accumulator = PriceAccumulator(field=field)
+        for segment in segments:
+            if isinstance(segment, dict):
+                accumulator.merge(other=PriceAccumulator.from_dict(statistics=segment[field], field=field))
+            else:
+                accumulator.merge(other=self.__aggregate_days(start_date=segment[0], end_date=segment[1],
+                                                              location=location, toll=toll, field=field))
+        if self.cache is not None:
+            self.cache.save()
+        return accumulator
+
+    def __month_rollups(self, start_date: date, end_date: date, location: str, toll: str):
+        # Months fully inside the range
+        first_month_start = start_date if start_date.day == 1 else \
+            (start_date.replace(day=1) + timedelta(days=32)).replace(day=1)
+        end_month_start = (end_date + timedelta(days=1)).replace(day=1)
+        if first_month_start >= end_month_start:
+            return []
+        collection_ref = get_collection(client=self.client, location=location, toll=toll, aggregation=BY_MONTH)
+        metrics.inc('firestore_rpcs_total', method='query')
+        query = collection_ref.\
+            where(filter=FieldFilter(field_path='datetime_spain', op_string='>=',
+                                     value=datetime.combine(first_month_start, datetime.min.time()))).\
+            where(filter=FieldFilter(field_path='datetime_spain', op_string='<',
+                                     value=datetime.combine(end_month_start, datetime.min.time()))).\
+            order_by('datetime_spain').stream()
+        rollups = [doc.to_dict() for doc in query]
+        metrics.inc('firestore_documents_read_total', len(rollups), aggregation=BY_MONTH)
+        month_rollups = []
+        for rollup in rollups:
+            month_start = datetime.strptime(rollup['month'], "%Y-%m").date()
+            # Only trusted if it holds every day of the month, otherwise its days are read
+            if rollup.get('days') == calendar.monthrange(month_start.year, month_start.month)[1]:
+                month_rollups.append((month_start, rollup))
+        return month_rollups
+
+    def __aggregate_days(self, start_date: date, end_date: date, location: str, toll: str,
+                         field: str) -> PriceAccumulator:
+        partitions = [(start_date + timedelta(days=i),
+                       min(start_date + timedelta(days=i + self.partition_days - 1), end_date))
+                      for i in range(0, (end_date - start_date).days + 1, self.partition_days)]
+
+        def aggregate_partition(partition: tuple[date, date]) -> PriceAccumulator:
+            first, last = partition
+            if self.cache is not None:
+                docs = self.cache.get_range(start_date=first, end_date=last, location=location, toll=toll,
+                                            fetch=lambda missing_first, missing_last: self.__query_days(
+                                                start_date=missing_first, end_date=missing_last, location=location,
+                                                toll=toll))
+            else:
+                docs = self.__stream_days(start_date=first, end_date=last, location=location, toll=toll,
+                                          field_paths=DECODE_FIELD_PATHS)
+            # Both formats are accepted, compact documents are decoded without copies
+            return PriceAccumulator(field=field).add_all(docs=(decode_day(doc=doc) for doc in docs))
+
+        accumulator = PriceAccumulator(field=field)
+        with ThreadPoolExecutor(max_workers=max(1, min(self.max_workers, len(partitions)))) as executor:
+            # Merged in order, so the result doesn't depend on which partition finishes first
+            for partition_accumulator in executor.map(aggregate_partition, partitions):
+                accumulator.merge(other=partition_accumulator)
+        return accumulator
+
+
+    def avg_price_between_dates_by_period(self, start_date: date, end_date: date,
+                                          location: str = 'PCB', toll: str = '2.0TD') -> dict[int, float]:
         """
         Get the average price between 2 dates by period
 
@@ -77,46 +216,68 @@ class FirebaseQuerier():
 
         :return: dict[int, float]. Dict with the average price by period
         """
-        collection_ref = get_collection(client=self.client, location=location, toll=toll, aggregation=BY_DAY)
+        accumulator = self.aggregate_between_dates(start_date=start_date, end_date=end_date, location=location,
+                                                   toll=toll)
+        return accumulator.period_means()
 
-        # Build the timestamps to cover the whole day
-        start_timestamp = datetime.combine(start_date, datetime.min.time())
-        end_timestamp = datetime.combine(end_date, datetime.max.time())
+    def avg_price_between_dates_by_hour(self, start_date: date, end_date: date,
+                                          location: str = 'PCB', toll: str = '2.0TD',
+                                        plot: bool = True, plot_path: str | None = None) -> dict[int, float]:
+        """
+        Get the average price between 2 dates by period
 
-        # Query Firestore
-        query = collection_ref.where(filter=FieldFilter(field_path='datetime_spain', op_string='>=', value=start_timestamp)).\
-                               where(filter=FieldFilter(field_path='datetime_spain', op_string='<=', value=end_timestamp)).\
-                               select(['period', 'PVPC_price_kwh', 'day']).stream()
-        docs = [doc.to_dict() for doc in query]
-        # Build a matrix of 24xHour
-        hour_prices = []
-        for doc in docs:
-            hour_prices.append(doc['PVPC_price_kwh'])
-        hour_prices = np.array(hour_prices)
-        avg_prices = np.mean(hour_prices, axis=0)
-        prices_by_hour = {i: avg_prices[i] for i in range(24)}
+
+        :param start_date: date. Start date of the range
+        :param end_date: date. End date of the range
+        :param location: str. Location of the data [PCB (Peninsula, Canarias, Baleares) or CYM (Ceuta, Melilla)]
+        :param toll: str. Toll of the data (2.0TD, 2.0A, 2.0DHA, 2.0-DHS...)
+        :param plot: bool. If True, the prices are plotted (see plot_avg_price_by_hour)
+        :param plot_path: str | None. If given, the plot is written to this file instead of shown in a window
+
+        :return: dict[int, float]. Dict with the average price by period
+        """
+        accumulator = self.aggregate_between_dates(start_date=start_date, end_date=end_date, location=location,
+                                                   toll=toll)
+        prices_by_hour = accumulator.hourly_means()
         if plot:
-            import matplotlib.pyplot as plt
-            periods_by_hour = docs[0]['period']
-            colors = [PERIOD_COLORS[period] for period in periods_by_hour]
-            # Use the period by hour as color for the bars
-            plt.bar(prices_by_hour.keys(), prices_by_hour.values(), color=colors)
-            # Draw the value of the average price
-            plt.axhline(y=np.mean(list(prices_by_hour.values())), color='r', linestyle='-')
-            # Write the value of each bar
-            for i, price in prices_by_hour.items():
-                plt.text(i, round(price, 3), f'{price:.2f}', ha='center', va='bottom')
-            plt.xlabel('Hour')
-            plt.ylabel('Average price')
-            plt.title('Average price by hour')
-            # Show all x-ticks
-            plt.xticks(range(24))
-            plt.show()
+            plot_avg_price_by_hour(prices_by_hour=prices_by_hour, periods_by_hour=accumulator.periods_by_hour,
+                                   plot_path=plot_path)
 
         return prices_by_hour
 
 
 
+    def get_price_matrix(self, start_date: date, end_date: date, pairs: list[tuple[str, str]],
+                         fields: tuple[str, ...] = ('PVPC_price_kwh',)) -> PriceMatrix:
+        """
+        Get the hourly prices of many location/toll pairs between 2 dates as a single dense matrix. Pairs are read
+        concurrently (through the cache, if any)
+
+        :param start_date: date. Start date of the range
+        :param end_date: date. End date of the range
+        :param pairs: list[tuple[str, str]]. (location, toll) pairs, as [('PCB', '2.0TD'), ('CYM', '2.0TD')...]
+        :param fields: tuple[str, ...]. Hourly fields (PVPC_price_kwh, TEU_charges_kwh, TCU_production_price_kwh)
+
+        :return: PriceMatrix. Matrix of shape (pair, day, hour) for each field, with the mask of missing days
+        """
+        matrix = PriceMatrix(pairs=pairs, start_date=start_date, end_date=end_date, fields=fields)
+
+        def fetch_pair(pair: tuple[str, str]) -> list[dict]:
+            location, toll = pair
+            fetch = lambda first, last: self.__query_days(start_date=first, end_date=last, location=location, toll=toll)
+            if self.cache is None:
+                return fetch(matrix.start_date, end_date)
+            return self.cache.get_range(start_date=matrix.start_date, end_date=end_date, location=location, toll=toll,
+                                        fetch=fetch)
+
+        with metrics.timer('query_seconds', query='matrix'), \
+                ThreadPoolExecutor(max_workers=max(1, min(self.max_workers, len(matrix.pairs)))) as executor:
+            for (location, toll), docs in zip(matrix.pairs, executor.map(fetch_pair, matrix.pairs)):
+                matrix.fill(location=location, toll=toll, docs=[decode_day(doc=doc) for doc in docs])
+        if self.cache is not None:
+            self.cache.save()
+        return matrix
+
     def get_data_for_day(self, day: date, location: str = 'PCB', toll: str = '2.0TD') -> \
             list[dict[str, str | datetime | float | int]]:
         """
@@ -127,11 +288,28 @@ class FirebaseQuerier():
 
         :return: list[dict[str, str | datetime | float | int]]. List of dictionaries with the data for the given day
         """
+        if self.cache is None:
+            doc = self.__get_day(day=day, location=location, toll=toll)
+        else:
+            doc = self.cache.get_day(day=day, location=location, toll=toll,
+                                     fetch=lambda first: self.__get_day(day=first, location=location, toll=toll))
+        return decode_day(doc=doc) if doc is not None else None
+
+    def __get_day(self, day: date, location: str, toll: str) -> dict | None:
         collection_ref = get_collection(client=self.client, location=location, toll=toll, aggregation=BY_DAY)
         doc_id = get_doc_id_for_row(row={'datetime_spain': day, 'location': location, 'toll': toll})
 
         # Get the document
+        metrics.inc('firestore_rpcs_total', method='get')
         doc = collection_ref.document(doc_id).get()
         if not doc.exists:
             return None
         return doc.to_dict()
+
+    def save_cache(self):
+        """
+        Persist the query cache, so the next runs don't read again the same days. Range queries persist it on their
+        own, single days read by get_data_for_day are only persisted by the next range query or this method
+        """
+        if self.cache is not None:
+            self.cache.save()
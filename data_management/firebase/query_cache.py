@@ -0,0 +1,400 @@
+"""
+This class keeps a local copy of the BY_DAY documents already read from Firestore, tracking which date intervals of
+each location/toll it fully holds, so a query only fetches the sub-ranges that are missing
+"""
+
+import base64
+import json
+import os
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from datetime import date, datetime
+from threading import Lock
+from typing import Callable
+
+from loguru import logger
+
+from data_management.constants import QUERY_CACHE_PATH, QUERY_CACHE_MAX_DAYS, QUERY_CACHE_JOURNAL_MIN_BYTES, \
+    QUERY_CACHE_LOCK_STALE_SECONDS, EXPECTED_DATE_FORMAT
+
+# Time between attempts to take the journal lock while another process holds it
+_LOCK_POLL_SECONDS = 0.01
+
+_default_cache, _default_cache_lock = None, Lock()
+
+
+def default_query_cache() -> 'QueryCache':
+    """
+    :return: QueryCache. Cache of the default path, shared by every querier and manager of the process that use the
+                        shared Firestore client (see client_pool). Created (but not read) the first time
+    """
+    global _default_cache
+    with _default_cache_lock:
+        if _default_cache is None:
+            _default_cache = QueryCache()
+        return _default_cache
+
+
+class QueryCache:
+    def __init__(self, path: str = QUERY_CACHE_PATH, max_days: int = QUERY_CACHE_MAX_DAYS,
+                 journal_min_bytes: int = QUERY_CACHE_JOURNAL_MIN_BYTES):
+        """
+        Cache persisted as a json snapshot plus a journal with the changes made after it (one json record per line,
+        next to the snapshot with the .journal extension). For each location/toll, it holds the covered intervals
+        (inclusive, as date ordinals) and the documents of those days. A day inside a covered interval but without
+        document is known to not exist in the database. Today and future days are never considered covered, as they
+        can still be ingested.
+
+        It is only read on first use, so writers can invalidate days without loading it. Every query first applies
+        the records that other processes appended to the journal (like the invalidations of a sync), so a day is
+        never served from the cache once it was written again. save() only appends the changes since the last save,
+        and the journal is folded into the snapshot once it grows larger than it
+
+        :param path: str. Path of the json snapshot
+        :param max_days: int. Maximum number of day documents kept. The least recently used ones are evicted first
+        :param journal_min_bytes: int. The journal is never folded into the snapshot while smaller than this
+        """
+        self.path = path
+        self.journal_path = f"{os.path.splitext(path)[0]}.journal"
+        # Held (across processes) while the journal is appended to or folded into the snapshot
+        self.lock_path = f"{os.path.splitext(path)[0]}.lock"
+        self.max_days = max_days
+        self.journal_min_bytes = journal_min_bytes
+        self.lock = Lock()
+        # Intervals will have the format {(<location>, <toll>): [[<first ordinal>, <last ordinal>], ...]}, sorted
+        self._intervals = {}
+        # Docs will have the format {(<location>, <toll>, <date>): <doc>}, from the least to the most recently used
+        self._docs = OrderedDict()
+        # Records of the changes not appended to the journal yet
+        self._pending = []
+        self._loaded = False
+        # Bytes of the journal already applied, and identity of the snapshot they follow
+        self._journal_offset, self._snapshot_id = 0, None
+        self.hits, self.misses = 0, 0
+
+    def get_range(self, start_date: date, end_date: date, location: str, toll: str,
+                  fetch: Callable[[date, date], list[dict]]) -> list[dict]:
+        """
+        Get the BY_DAY documents of a range, fetching only the sub-ranges that are not cached
+
+        :param start_date: date. Start date of the range (included)
+        :param end_date: date. End date of the range (included)
+        :param location: str. Location of the data [PCB (Peninsula, Canarias, Baleares) or CYM (Ceuta, Melilla)]
+        :param toll: str. Toll of the data (2.0TD, 2.0A, 2.0DHA, 2.0-DHS...)
+        :param fetch: Callable[[date, date], list[dict]]. Function that reads the documents of a range (both
+                        included) from the database
+
+        :return: list[dict]. Documents of the days of the range that exist, sorted by date
+        """
+        start_date, end_date = _as_date(start_date), _as_date(end_date)
+        assert start_date <= end_date, f"start_date must be before end_date"
+        with self.lock:
+            self.__refresh()
+            missing = _missing_ranges(intervals=self._intervals.get((location, toll), []),
+                                      start=start_date.toordinal(), end=end_date.toordinal())
+        fetched = {}
+        for first, last in missing:
+            for doc in fetch(date.fromordinal(first), date.fromordinal(last)):
+                fetched[doc['date']] = doc
+            with self.lock:
+                self.__store(location=location, toll=toll, first=first, last=last, docs=fetched)
+
+        docs = []
+        with self.lock:
+            for ordinal in range(start_date.toordinal(), end_date.toordinal() + 1):
+                date_str = date.fromordinal(ordinal).strftime(EXPECTED_DATE_FORMAT)
+                key = (location, toll, date_str)
+                if key in self._docs:
+                    self._docs.move_to_end(key)
+                    docs.append(self._docs[key])
+                elif date_str in fetched:
+                    # Not cacheable (today or future), but just fetched
+                    docs.append(fetched[date_str])
+            missing_days = sum(last - first + 1 for first, last in missing)
+            self.hits += (end_date - start_date).days + 1 - missing_days
+            self.misses += missing_days
+        return docs
+
+    def get_day(self, day: date, location: str, toll: str, fetch: Callable[[date], dict | None]) -> dict | None:
+        """
+        Get the BY_DAY document of a day, fetching it only if it is not cached
+
+        :param day: date. Day of the document
+        :param location: str. Location of the data [PCB (Peninsula, Canarias, Baleares) or CYM (Ceuta, Melilla)]
+        :param toll: str. Toll of the data (2.0TD, 2.0A, 2.0DHA, 2.0-DHS...)
+        :param fetch: Callable[[date], dict | None]. Function that reads the document of a day from the database
+
+        :return: dict | None. Document of the day, or None if it doesn't exist
+        """
+        docs = self.get_range(start_date=day, end_date=day, location=location, toll=toll,
+                              fetch=lambda first, last: [doc for doc in (fetch(first),) if doc is not None])
+        return docs[0] if len(docs) > 0 else None
+
+    def invalidate(self, location: str, toll: str, day: date):
+        """
+        Forget a day of a location/toll, so it is read again from the database. To be called when it is re-ingested.
+        Other processes see it once it is saved
+
+        :param location: str. Location of the data [PCB (Peninsula, Canarias, Baleares) or CYM (Ceuta, Melilla)]
+        :param toll: str. Toll of the data (2.0TD, 2.0A, 2.0DHA, 2.0-DHS...)
+        :param day: date. Day to forget
+        """
+        self.__change(record=['forget', location, toll, _as_date(day).toordinal()])
+
+    def clear(self):
+        """
+        Forget everything
+        """
+        self.__change(record=['clear'])
+
+    def refresh(self):
+        """
+        Apply the changes that other processes saved since the cache was read (queries do it on their own)
+        """
+        with self.lock:
+            self.__refresh()
+
+    def save(self):
+        """
+        Persist the changes made since the last save, appending them to the journal. Nothing is written if there
+        are none
+        """
+        with self.lock:
+            if len(self._pending) == 0:
+                return
+            os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+            with _file_lock(path=self.lock_path):
+                if self._loaded:
+                    # Apply the records of other processes first, so the offset only skips the ones written here
+                    self.__refresh()
+                content = ''.join(f"{json.dumps(_serialize_record(record=record))}\n" for record in self._pending)
+                with open(self.journal_path, 'a') as f:
+                    f.write(content)
+                self._pending = []
+                if not self._loaded:
+                    return
+                self._journal_offset = os.path.getsize(self.journal_path)
+                snapshot_size = os.path.getsize(self.path) if os.path.isfile(self.path) else 0
+                if self._journal_offset > max(self.journal_min_bytes, snapshot_size):
+                    self.__compact()
+
+    def __change(self, record: list):
+        with self.lock:
+            # Not applied if never read: they are applied after the files when it is loaded
+            if self._loaded:
+                self.__apply(record=record)
+            self._pending.append(record)
+
+    def __refresh(self):
+        # Must be called holding the lock
+        if not self._loaded or _file_id(path=self.path) != self._snapshot_id or \
+                _file_size(path=self.journal_path) < self._journal_offset:
+            # Never read, or another process folded the journal into the snapshot
+            self.__load()
+        else:
+            self.__read_journal()
+
+    def __load(self):
+        # Must be called holding the lock. Retried if the snapshot is replaced while reading the journal
+        for _ in range(3):
+            snapshot_id = _file_id(path=self.path)
+            self._intervals, self._docs, self._journal_offset = {}, OrderedDict(), 0
+            if snapshot_id is not None:
+                try:
+                    with open(self.path, 'r') as f:
+                        content = json.load(f)
+                    self._intervals = {(location, toll): intervals
+                                       for location, toll, intervals in content['intervals']}
+                    self._docs = OrderedDict(((location, toll, date_str), _deserialize(doc=doc))
+                                             for location, toll, date_str, doc in content['docs'])
+                except (OSError, ValueError, KeyError) as e:
+                    logger.warning(f"Query cache {self.path} could not be read ({e}). Starting empty")
+                    self._intervals, self._docs = {}, OrderedDict()
+            self.__read_journal()
+            if _file_id(path=self.path) == snapshot_id:
+                break
+        self._snapshot_id, self._loaded = snapshot_id, True
+        for record in self._pending:
+            self.__apply(record=record)
+
+    def __read_journal(self):
+        # Must be called holding the lock. Only whole lines are applied, the last one may still be being written
+        try:
+            with open(self.journal_path, 'rb') as f:
+                f.seek(self._journal_offset)
+                content = f.read()
+        except FileNotFoundError:
+            return
+        end = content.rfind(b'\n') + 1
+        for line in content[:end].splitlines():
+            try:
+                record = _deserialize_record(record=json.loads(line))
+            except ValueError as e:
+                logger.warning(f"Skipping a corrupt record of {self.journal_path} ({e})")
+                continue
+            self.__apply(record=record)
+        self._journal_offset += end
+
+    def __compact(self):
+        # Must be called holding the lock and the journal lock, with the journal fully applied. The snapshot is
+        # replaced before the journal is emptied, so a reader never misses a record
+        content = json.dumps({
+            'intervals': [[location, toll, intervals] for (location, toll), intervals in self._intervals.items()],
+            'docs': [[location, toll, date_str, _serialize(doc=doc)]
+                     for (location, toll, date_str), doc in self._docs.items()]})
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, 'w') as f:
+            f.write(content)
+        os.replace(tmp_path, self.path)
+        open(self.journal_path, 'w').close()
+        self._journal_offset, self._snapshot_id = 0, _file_id(path=self.path)
+
+    def __store(self, location: str, toll: str, first: int, last: int, docs: dict[str, dict]):
+        # Must be called holding the lock. Only the days before today are final, the rest are not marked as covered
+        last = min(last, date.today().toordinal() - 1)
+        if first > last:
+            return
+        date_strs = (date.fromordinal(ordinal).strftime(EXPECTED_DATE_FORMAT) for ordinal in range(first, last + 1))
+        record = ['store', location, toll, first, last,
+                  {date_str: docs[date_str] for date_str in date_strs if date_str in docs}]
+        self.__apply(record=record)
+        self._pending.append(record)
+
+    def __apply(self, record: list):
+        # Must be called holding the lock
+        operation = record[0]
+        if operation == 'store':
+            _, location, toll, first, last, docs = record
+            for date_str, doc in docs.items():
+                self._docs[(location, toll, date_str)] = doc
+                self._docs.move_to_end((location, toll, date_str))
+            self._intervals[(location, toll)] = _add_range(intervals=self._intervals.get((location, toll), []),
+                                                           start=first, end=last)
+            # Evicted days are not covered anymore
+            while len(self._docs) > self.max_days:
+                (evicted_location, evicted_toll, date_str), _ = self._docs.popitem(last=False)
+                ordinal = datetime.strptime(date_str, EXPECTED_DATE_FORMAT).toordinal()
+                self.__forget(location=evicted_location, toll=evicted_toll, ordinal=ordinal)
+        elif operation == 'forget':
+            _, location, toll, ordinal = record
+            self.__forget(location=location, toll=toll, ordinal=ordinal)
+        elif operation == 'clear':
+            self._intervals, self._docs = {}, OrderedDict()
+
+    def __forget(self, location: str, toll: str, ordinal: int):
+        date_str = date.fromordinal(ordinal).strftime(EXPECTED_DATE_FORMAT)
+        self._docs.pop((location, toll, date_str), None)
+        if (location, toll) not in self._intervals:
+            return
+        intervals = self._intervals[(location, toll)]
+        self._intervals[(location, toll)] = [[first, last] for interval_first, interval_last in intervals
+                                             for first, last in ((interval_first, min(interval_last, ordinal - 1)),
+                                                                 (max(interval_first, ordinal + 1), interval_last))
+                                             if first <= last]
+
+
+@contextmanager
+def _file_lock(path: str, stale_seconds: float = QUERY_CACHE_LOCK_STALE_SECONDS):
+    # Lock shared by the processes of the machine: created atomically, and taken over if left behind by a crash
+    while True:
+        try:
+            os.close(os.open(path, os.O_CREAT | os.O_EXCL | os.O_WRONLY))
+            break
+        except FileExistsError:
+            try:
+                if time.time() - os.path.getmtime(path) > stale_seconds:
+                    logger.warning(f"Taking over the stale lock {path}")
+                    os.remove(path)
+                    continue
+            except FileNotFoundError:
+                continue
+            time.sleep(_LOCK_POLL_SECONDS)
+    try:
+        yield
+    finally:
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+
+def _file_id(path: str) -> tuple[int, int] | None:
+    # Changes whenever the file is replaced
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return stat.st_ino, stat.st_mtime_ns
+
+
+def _file_size(path: str) -> int:
+    try:
+        return os.path.getsize(path)
+    except FileNotFoundError:
+        return 0
+
+
+def _as_date(day: date) -> date:
+    return day.date() if isinstance(day, datetime) else day
+
+
+def _missing_ranges(intervals: list[list[int]], start: int, end: int) -> list[tuple[int, int]]:
+    missing, cursor = [], start
+    for first, last in intervals:
+        if last < cursor:
+            continue
+        if first > end:
+            break
+        if first > cursor:
+            missing.append((cursor, first - 1))
+        cursor = last + 1
+    if cursor <= end:
+        missing.append((cursor, end))
+    return missing
+
+
+def _add_range(intervals: list[list[int]], start: int, end: int) -> list[list[int]]:
+    # Merge the new range with the ones it overlaps or touches
+    merged = []
+    for first, last in sorted(intervals + [[start, end]]):
+        if len(merged) > 0 and first <= merged[-1][1] + 1:
+            merged[-1][1] = max(merged[-1][1], last)
+        else:
+            merged.append([first, last])
+    return merged
+
+
+def _serialize(doc: dict) -> dict:
+    # Json has no datetime nor bytes (packed values of the compact format) types
+    def serialize_value(value):
+        if isinstance(value, datetime):
+            return {'__datetime__': value.isoformat()}
+        if isinstance(value, bytes):
+            return {'__bytes__': base64.b64encode(value).decode('ascii')}
+        return value
+
+    return {key: serialize_value(value) for key, value in doc.items()}
+
+
+def _deserialize(doc: dict) -> dict:
+    def deserialize_value(value):
+        if isinstance(value, dict) and '__datetime__' in value:
+            return datetime.fromisoformat(value['__datetime__'])
+        if isinstance(value, dict) and '__bytes__' in value:
+            return base64.b64decode(value['__bytes__'])
+        return value
+
+    return {key: deserialize_value(value) for key, value in doc.items()}
+
+
+def _serialize_record(record: list) -> list:
+    if record[0] != 'store':
+        return record
+    return record[:5] + [{date_str: _serialize(doc=doc) for date_str, doc in record[5].items()}]
+
+
+def _deserialize_record(record: list) -> list:
+    if record[0] != 'store':
+        return record
+    return record[:5] + [{date_str: _deserialize(doc=doc) for date_str, doc in record[5].items()}]
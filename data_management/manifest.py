@@ -0,0 +1,208 @@
+"""
+This class keeps an index of the csv files in the data folder, mapping (date, location, toll) to the csv path, so
+files are resolved without walking the folder tree. It is only read (or built) the first time it is used
+"""
+
+import json
+import os
+from datetime import date, timedelta
+from threading import Lock
+
+from loguru import logger
+
+from data_management.constants import DATA_FOLDER, MANIFEST_FILENAME, EXPECTED_DATE_FORMAT, LOCATION_DESCRIPTIONS
+
+
+class DataManifest:
+    def __init__(self, data_folder: str = DATA_FOLDER, manifest_path: str | None = None):
+        """
+        Index of the csv files organized as <data_folder>/<PCB|CYM>/<TOLL>/<date>.csv. It is loaded from
+        manifest_path (or rebuilt from the data folder if it doesn't exist yet) on first use, so creating it touches
+        nothing on disk
+
+        :param data_folder: str. Path to the data folder
+        :param manifest_path: str | None. Path to the json file where the manifest is persisted. If None,
+                                MANIFEST_FILENAME inside data_folder
+        """
+        self.data_folder = data_folder
+        self.manifest_path = manifest_path if manifest_path is not None else \
+            os.path.join(data_folder, MANIFEST_FILENAME)
+        self.lock = Lock()
+        # Serializes the first load, so concurrent users don't rebuild it twice
+        self._load_lock = Lock()
+        self._loaded = False
+        # Files will have the format {<date>: {<PCB/CYM>: {<TOLL>: <PATH relative to data_folder>}}}
+        self._files = {}
+
+    def load(self):
+        """
+        Load the manifest from disk. If it doesn't exist, rebuild it from the data folder and persist it. Toll
+        folders modified after the manifest was written (files added or deleted out of the downloader) are scanned
+        again
+        """
+        with self._load_lock:
+            if not os.path.isfile(self.manifest_path):
+                self.rebuild()
+                return
+            manifest_mtime = os.path.getmtime(self.manifest_path)
+            with open(self.manifest_path, 'r') as f:
+                files = json.load(f)
+            stale_folders = [(location, toll, path) for location, toll, path in self.__toll_folders()
+                             if os.path.getmtime(path) > manifest_mtime]
+            for location, toll, path in stale_folders:
+                for locations in files.values():
+                    locations.get(location, {}).pop(toll, None)
+                for date_str, relative_path in self.__scan_toll_folder(location=location, toll=toll, path=path):
+                    files.setdefault(date_str, {}).setdefault(location, {})[toll] = relative_path
+            with self.lock:
+                self._files = files
+                self._loaded = True
+        if len(stale_folders) > 0:
+            logger.info(f"Manifest refreshed for {len(stale_folders)} modified folders")
+            self.save()
+
+    def rebuild(self):
+        """
+        Rebuild the manifest with a single scandir walk over the data folder and persist it
+        """
+        files = {}
+        for location, toll, path in self.__toll_folders():
+            for date_str, relative_path in self.__scan_toll_folder(location=location, toll=toll, path=path):
+                files.setdefault(date_str, {}).setdefault(location, {})[toll] = relative_path
+        with self.lock:
+            self._files = files
+            self._loaded = True
+        logger.info(f"Manifest rebuilt with {sum(len(tolls) for locations in files.values() for tolls in locations.values())} files")
+        self.save()
+
+    def __toll_folders(self) -> list[tuple[str, str, str]]:
+        # (location, toll, path) of every toll folder of the data folder
+        if not os.path.isdir(self.data_folder):
+            return []
+        with os.scandir(self.data_folder) as locations:
+            location_entries = [entry for entry in locations if entry.name in LOCATION_DESCRIPTIONS and entry.is_dir()]
+        folders = []
+        for location_entry in location_entries:
+            with os.scandir(location_entry.path) as tolls:
+                folders.extend((location_entry.name, entry.name, entry.path) for entry in tolls if entry.is_dir())
+        return folders
+
+    @staticmethod
+    def __scan_toll_folder(location: str, toll: str, path: str) -> list[tuple[str, str]]:
+        # (date, path relative to data_folder) of every csv file of a toll folder
+        with os.scandir(path) as day_files:
+            return [(entry.name[:-len('.csv')], os.path.join(location, toll, entry.name)) for entry in day_files
+                    if entry.name.endswith('.csv') and entry.is_file()]
+
+    def __ensure_loaded(self):
+        if not self._loaded:
+            self.load()
+
+    def __resolve(self, date_str: str, location: str, toll: str, relative_path: str) -> str | None:
+        # Files deleted since the manifest was loaded are forgotten. Must be called holding the lock
+        path = os.path.join(self.data_folder, relative_path)
+        if os.path.isfile(path):
+            return path
+        logger.debug(f"{path} is in the manifest but doesn't exist anymore. Forgetting it")
+        tolls = self._files[date_str][location]
+        del tolls[toll]
+        if len(tolls) == 0:
+            del self._files[date_str][location]
+        if len(self._files[date_str]) == 0:
+            del self._files[date_str]
+        return None
+
+    def save(self):
+        """
+        Persist the manifest to disk (atomically, so a crash never leaves a corrupt manifest). Nothing is written if
+        it was never loaded, as it can't have changed
+        """
+        with self.lock:
+            if not self._loaded:
+                return
+            content = json.dumps(self._files, sort_keys=True)
+        os.makedirs(os.path.dirname(self.manifest_path), exist_ok=True)
+        tmp_path = f"{self.manifest_path}.tmp"
+        with open(tmp_path, 'w') as f:
+            f.write(content)
+        os.replace(tmp_path, self.manifest_path)
+
+    def add(self, date_str: str, location: str, toll: str, csv_path: str):
+        """
+        Register a csv file in the manifest. It is not persisted until save() is called
+
+        :param date_str: str. Date of the file, as EXPECTED_DATE_FORMAT
+        :param location: str. Location of the data [PCB (Peninsula, Canarias, Baleares) or CYM (Ceuta, Melilla)]
+        :param toll: str. Toll of the data (2.0TD, 2.0A, 2.0DHA, 2.0DHS...)
+        :param csv_path: str. Path to the csv file
+        """
+        relative_path = os.path.relpath(csv_path, start=self.data_folder)
+        self.__ensure_loaded()
+        with self.lock:
+            self._files.setdefault(date_str, {}).setdefault(location, {})[toll] = relative_path
+
+    def files_for_date(self, day: date) -> dict[str, dict[str, str]]:
+        """
+        Get the csv files of a given day
+
+        :param day: date. Day of the data
+
+        :return: dict[str, dict[str, str]]. Files with the format {<PCB/CYM>: {<TOLL>: <PATH>}}. Empty if no file
+        """
+        self.__ensure_loaded()
+        date_str = day.strftime(EXPECTED_DATE_FORMAT)
+        files = {}
+        with self.lock:
+            for location, tolls in list(self._files.get(date_str, {}).items()):
+                for toll, relative_path in list(tolls.items()):
+                    path = self.__resolve(date_str=date_str, location=location, toll=toll,
+                                          relative_path=relative_path)
+                    if path is not None:
+                        files.setdefault(location, {})[toll] = path
+        return files
+
+    def get(self, day: date, location: str, toll: str) -> str | None:
+        """
+        Get the csv file of a given day, location and toll
+
+        :param day: date. Day of the data
+        :param location: str. Location of the data [PCB (Peninsula, Canarias, Baleares) or CYM (Ceuta, Melilla)]
+        :param toll: str. Toll of the data (2.0TD, 2.0A, 2.0DHA, 2.0DHS...)
+
+        :return: str | None. Path to the csv file, or None if it is not in the manifest
+        """
+        self.__ensure_loaded()
+        date_str = day.strftime(EXPECTED_DATE_FORMAT)
+        with self.lock:
+            relative_path = self._files.get(date_str, {}).get(location, {}).get(toll)
+            return None if relative_path is None else \
+                self.__resolve(date_str=date_str, location=location, toll=toll, relative_path=relative_path)
+
+    def files_for_date_range(self, start_date: date, end_date: date) -> dict[date, dict[str, dict[str, str]]]:
+        """
+        Get the csv files of every day in a range
+
+        :param start_date: date. Start date of the range (included)
+        :param end_date: date. End date of the range (included)
+
+        :return: dict[date, dict[str, dict[str, str]]]. Files by day, with the format of files_for_date. Days without
+                    files are not included
+        """
+        files = {}
+        for i in range((end_date - start_date).days + 1):
+            day = start_date + timedelta(days=i)
+            day_files = self.files_for_date(day=day)
+            if len(day_files) > 0:
+                files[day] = day_files
+        return files
+
+    def location_tolls(self) -> list[tuple[str, str]]:
+        """
+        Get the (location, toll) pairs that have at least one file
+
+        :return: list[tuple[str, str]]. Sorted list of (location, toll) pairs
+        """
+        self.__ensure_loaded()
+        with self.lock:
+            return sorted({(location, toll) for locations in self._files.values()
+                           for location, tolls in locations.items() for toll in tolls})
@@ -0,0 +1,260 @@
+"""
+This class streams the ingest of a date range: download, parse and publish stages run concurrently, connected by
+bounded queues, so parsed data goes straight to the Firestore writer. A large backfill runs at the speed of the
+slowest stage and with flat memory use, as every stage blocks when the next one is full
+"""
+
+import asyncio
+import time
+from concurrent.futures import Future
+from datetime import datetime, timedelta
+from queue import Queue, Empty, Full
+from threading import Thread, Event, Lock
+
+from loguru import logger
+from tqdm import tqdm
+
+from data_management.async_downloader import AsyncDownloadEngine, DownloadResponse
+from data_management.constants import DOWNLOAD_MAX_IN_FLIGHT, DOWNLOAD_REQUESTS_PER_SECOND, PARSE_WORKERS, \
+    PIPELINE_PUBLISH_WORKERS, PIPELINE_QUEUE_SIZE, MAX_WRITE_BATCH_SIZE, WRITE_BATCH_MAX_IN_FLIGHT, \
+    EXPECTED_DATE_FORMAT
+from data_management.firebase.batch_writer import BatchWriter
+from data_management.firebase.firebase_manager import FirebaseManager
+from data_management.prices_downloader import PricesDownloader
+from utils.metrics import metrics
+
+# Marks the end of a queue
+_END = object()
+# Time between checks of the failure flag while blocked on a queue
+_POLL_SECONDS = 0.1
+
+
+class _Aborted(Exception):
+    pass
+
+
+class IngestPipeline:
+    def __init__(self, downloader: PricesDownloader, firebase_manager: FirebaseManager, write_csv: bool = False,
+                 max_in_flight: int = DOWNLOAD_MAX_IN_FLIGHT, requests_per_second: float = DOWNLOAD_REQUESTS_PER_SECOND,
+                 parse_workers: int = PARSE_WORKERS, publish_workers: int = PIPELINE_PUBLISH_WORKERS,
+                 queue_size: int = PIPELINE_QUEUE_SIZE, write_batch_size: int = MAX_WRITE_BATCH_SIZE,
+                 write_max_in_flight: int = WRITE_BATCH_MAX_IN_FLIGHT):
+        """
+        :param downloader: PricesDownloader. Downloader used to build the requests, cache and parse the xls files
+        :param firebase_manager: FirebaseManager. Manager used to post the parsed data
+        :param write_csv: bool. If True, the csv files are also written (and registered in the manifest). Days are
+                                always appended to the price cube of the downloader, if it has one
+        :param max_in_flight: int. Maximum number of concurrent downloads
+        :param requests_per_second: float. Maximum requests started per second to the ESIOS host
+        :param parse_workers: int. Number of parsing stage workers (each one feeds the downloader parse pool)
+        :param publish_workers: int. Number of publishing stage workers
+        :param queue_size: int. Capacity of the queues between stages, in days
+        :param write_batch_size: int. Number of documents per Firestore write batch
+        :param write_max_in_flight: int. Maximum number of write batches being committed at the same time
+        """
+        assert parse_workers > 0 and publish_workers > 0, f"Every stage needs at least one worker"
+        self.downloader = downloader
+        self.firebase_manager = firebase_manager
+        self.write_csv = write_csv
+        self.max_in_flight = max_in_flight
+        self.requests_per_second = requests_per_second
+        self.parse_workers = parse_workers
+        self.publish_workers = publish_workers
+        self.queue_size = queue_size
+        self.write_batch_size = write_batch_size
+        self.write_max_in_flight = write_max_in_flight
+
+    def run(self, start_date: datetime, end_date: datetime, skip_if_exist: bool = True,
+            skip_unchanged: bool = False) -> dict[str, dict]:
+        """
+        Download, parse and post all the days of a range
+
+        :param start_date: datetime. Start date of the range
+        :param end_date: datetime. End date of the range
+        :param skip_if_exist: bool. If True, the location/tolls/days that already exist in the database are skipped.
+                                    Existence is checked once per location/toll for the whole range
+        :param skip_unchanged: bool. If True (and skip_if_exist is False), days that exist are only written again if
+                                    their content fingerprint changed, so ESIOS revisions are picked up without
+                                    rewriting the whole range. Fingerprints are read once per location/toll
+
+        :return: dict[str, dict]. Stats of each stage (items, busy seconds, maximum depth of its input queue), of
+                                    the writer and of the monthly rollups updated once all the days are written. The
+                                    publish stage also counts the location/toll/days skipped as unchanged, and
+                                    'last_days' holds the last day published of each '<location>/<toll>'
+
+        :raises Exception: The first error raised by any stage. Days that could not be downloaded (after their
+                            retries) are an error of the download stage too
+        """
+        assert start_date <= end_date, f"start_date must be before end_date"
+        dates = [start_date + timedelta(days=i) for i in range((end_date - start_date).days + 1)]
+        self._failed, self._errors, self._lock = Event(), [], Lock()
+        # Futures with the existing doc ids of each location/toll, by (<location>, <toll>)
+        self._existing_doc_ids = {}
+        self._last_days = {}
+        self._parse_queue, self._publish_queue = Queue(maxsize=self.queue_size), Queue(maxsize=self.queue_size)
+        self._parsers_alive = self.parse_workers
+        self._stats = {stage: {'items': 0, 'busy_seconds': 0.0, 'max_queue_depth': 0}
+                       for stage in ('download', 'parse', 'publish')}
+        self._progress_bar = tqdm(total=len(dates), desc="Ingesting prices")
+        unchanged_days = self.firebase_manager.unchanged_days
+        writer = BatchWriter(client=self.firebase_manager.client, batch_size=self.write_batch_size,
+                             max_in_flight=self.write_max_in_flight)
+
+        threads = [Thread(target=self.__guarded, args=(self.__download_stage, dates), name='download')]
+        threads += [Thread(target=self.__guarded, args=(self.__parse_stage,), name=f'parse-{i}')
+                    for i in range(self.parse_workers)]
+        threads += [Thread(target=self.__guarded, args=(self.__publish_stage, writer, start_date, end_date,
+                                                        skip_if_exist, skip_unchanged), name=f'publish-{i}')
+                    for i in range(self.publish_workers)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self._progress_bar.close()
+        self._stats['publish']['unchanged'] = self.firebase_manager.unchanged_days - unchanged_days
+        self._stats['last_days'] = {f"{location}/{toll}": day.strftime(EXPECTED_DATE_FORMAT)
+                                    for (location, toll), day in sorted(self._last_days.items())}
+
+        try:
+            self._stats['writer'] = writer.close()
+        except Exception as e:
+            self._errors.append(e)
+        try:
+            # Also after an error, so the rollups reflect the days that were written
+            self._stats['rollups'] = {'written': self.firebase_manager.flush()}
+        except Exception as e:
+            self._errors.append(e)
+        self.downloader.save()
+        if len(self._errors) > 0:
+            raise self._errors[0]
+        logger.info(f"Ingested {len(dates)} days. Stages: {self._stats}")
+        return self._stats
+
+    def __guarded(self, stage, *args):
+        try:
+            stage(*args)
+        except _Aborted:
+            pass
+        except Exception as e:
+            logger.error(f"Pipeline stage failed: {e}")
+            with self._lock:
+                self._errors.append(e)
+            self._failed.set()
+
+    def __put(self, queue: Queue, item, stage: str):
+        while True:
+            if self._failed.is_set():
+                raise _Aborted()
+            try:
+                queue.put(item, timeout=_POLL_SECONDS)
+                break
+            except Full:
+                continue
+        depth = queue.qsize()
+        with self._lock:
+            self._stats[stage]['max_queue_depth'] = max(self._stats[stage]['max_queue_depth'], depth)
+        metrics.set_gauge('pipeline_queue_depth', depth, queue=stage)
+
+    def __get(self, queue: Queue):
+        while True:
+            if self._failed.is_set():
+                return _END
+            try:
+                return queue.get(timeout=_POLL_SECONDS)
+            except Empty:
+                continue
+
+    def __count(self, stage: str, start_time: float):
+        busy_seconds = time.perf_counter() - start_time
+        with self._lock:
+            self._stats[stage]['items'] += 1
+            self._stats[stage]['busy_seconds'] += busy_seconds
+        metrics.observe('pipeline_stage_seconds', busy_seconds, stage=stage)
+
+    def __download_stage(self, dates: list[datetime]):
+        async def on_response(date: datetime, response: DownloadResponse):
+            start_time = time.perf_counter()
+            with metrics.profile(stage='download'):
+                content, _ = self.downloader.cache_download(date=date, status=response.status, content=response.body,
+                                                            headers=response.headers)
+            self.__count(stage='download', start_time=start_time)
+            # Blocks (out of the event loop) while the parse queue is full, which stops the download window
+            await asyncio.get_running_loop().run_in_executor(None, self.__put, self._parse_queue, (date, content),
+                                                             'parse')
+
+        engine = AsyncDownloadEngine(max_in_flight=self.max_in_flight, requests_per_second=self.requests_per_second)
+        try:
+            stats = engine.run(requests=(self.downloader.request_for_day(date=date) for date in dates),
+                               on_response=on_response)
+            if len(stats['failed']) > 0:
+                failed = sorted(date.strftime(EXPECTED_DATE_FORMAT) for date in stats['failed'])
+                # Same as an error of any stage: the days still queued are not published
+                raise AssertionError(f"Could not download {failed}")
+        finally:
+            for _ in range(self.parse_workers):
+                self.__put(self._parse_queue, _END, stage='parse')
+
+    def __parse_stage(self):
+        try:
+            while (item := self.__get(self._parse_queue)) is not _END:
+                date, content = item
+                start_time = time.perf_counter()
+                with metrics.profile(stage='parse'):
+                    data_by_location = self.downloader.parse_content(content=content)
+                    # Csv files are only written if asked to, the price cube (if any) always gets the data
+                    self.downloader.store(data_by_location=data_by_location, write_csv=self.write_csv)
+                self.__count(stage='parse', start_time=start_time)
+                self.__put(self._publish_queue, (date, data_by_location), stage='publish')
+        finally:
+            # The last parser closes the publish queue
+            with self._lock:
+                self._parsers_alive -= 1
+                last = self._parsers_alive == 0
+            if last:
+                for _ in range(self.publish_workers):
+                    self.__put(self._publish_queue, _END, stage='publish')
+
+    def __publish_stage(self, writer: BatchWriter, start_date: datetime, end_date: datetime, skip_if_exist: bool,
+                        skip_unchanged: bool):
+        while (item := self.__get(self._publish_queue)) is not _END:
+            date, data_by_location = item
+            start_time = time.perf_counter()
+            with metrics.profile(stage='publish'):
+                self.__publish_day(date=date, data_by_location=data_by_location, writer=writer,
+                                   start_date=start_date, end_date=end_date, skip_if_exist=skip_if_exist,
+                                   skip_unchanged=skip_unchanged)
+            self.__count(stage='publish', start_time=start_time)
+            self._progress_bar.update(1)
+
+    def __publish_day(self, date: datetime, data_by_location: dict, writer: BatchWriter, start_date: datetime,
+                      end_date: datetime, skip_if_exist: bool, skip_unchanged: bool):
+        for location, data in data_by_location.items():
+            for toll in data['toll'].unique():
+                existing_doc_ids = self.__existing_doc_ids_for(location=location, toll=toll, start_date=start_date,
+                                                               end_date=end_date) \
+                    if skip_if_exist or skip_unchanged else None
+                posted = self.firebase_manager.post_frame(df=data[data['toll'] == toll], location=location,
+                                                          toll=toll, skip_if_exist=skip_if_exist, writer=writer,
+                                                          existing_doc_ids=existing_doc_ids,
+                                                          skip_unchanged=skip_unchanged)
+                assert posted, f"Data for {date} {location}/{toll} was not posted successfully"
+                with self._lock:
+                    if date > self._last_days.get((location, toll), date.min):
+                        self._last_days[(location, toll)] = date
+
+    def __existing_doc_ids_for(self, location: str, toll: str, start_date: datetime,
+                               end_date: datetime) -> dict[str, str | None]:
+        # Built once per location/toll for the whole range, the first time one of its days arrives. The query runs
+        # out of the shared lock, the other workers that need the same location/toll wait for its future
+        with self._lock:
+            future = self._existing_doc_ids.get((location, toll))
+            owner = future is None
+            if owner:
+                future = self._existing_doc_ids[(location, toll)] = Future()
+        if owner:
+            try:
+                future.set_result(self.firebase_manager.existing_doc_ids_for_date_range(
+                    start_date=start_date, end_date=end_date, location_tolls=[(location, toll)]))
+            except Exception as e:
+                future.set_exception(e)
+        return future.result()
@@ -0,0 +1,182 @@
+"""
+This class stores all the hourly prices in a single memory-mapped array laid out as (day, hour, location, toll, field),
+so any date range can be loaded as a zero-copy view instead of re-parsing thousands of small csv files
+"""
+
+import json
+import os
+from datetime import date, datetime
+from threading import Lock
+
+import numpy as np
+import pandas as pd
+
+from data_management.constants import PRICE_CUBE_FOLDER, PRICE_CUBE_START_DATE, PRICE_CUBE_GROWTH_DAYS, PRICE_FIELDS, \
+    EXPECTED_DATE_FORMAT, PCB, CYM
+from utils.utils import fix_day_length
+
+CUBE_FIELDS = PRICE_FIELDS + ('period',)
+
+
+class PriceCube:
+    def __init__(self, folder: str = PRICE_CUBE_FOLDER, read_only: bool = False):
+        """
+        Cube persisted as <folder>/cube.bin (raw float64, C order) and <folder>/layout.json, which keeps the first
+        day, the number of days allocated and the labels of the location, toll and field axes. Missing values are NaN
+
+        :param folder: str. Folder of the cube
+        :param read_only: bool. If True, the cube is mapped read only and can't be appended to
+        """
+        self.folder = folder
+        self.read_only = read_only
+        self.data_path = os.path.join(folder, 'cube.bin')
+        self.layout_path = os.path.join(folder, 'layout.json')
+        self.lock = Lock()
+        if os.path.isfile(self.layout_path):
+            with open(self.layout_path, 'r') as f:
+                layout = json.load(f)
+            self.start_date = datetime.strptime(layout['start_date'], EXPECTED_DATE_FORMAT).date()
+            self.days, self.locations = layout['days'], layout['locations']
+            self.tolls, self.fields = layout['tolls'], layout['fields']
+        else:
+            assert not read_only, f"There is no cube in {folder}"
+            self.start_date, self.days = PRICE_CUBE_START_DATE, 0
+            self.locations, self.tolls, self.fields = [PCB, CYM], [], list(CUBE_FIELDS)
+        self._data = None
+
+    @property
+    def shape(self) -> tuple[int, int, int, int, int]:
+        return self.days, 24, len(self.locations), len(self.tolls), len(self.fields)
+
+    def __map(self) -> np.ndarray | None:
+        if self._data is None and self.days > 0 and len(self.tolls) > 0:
+            self._data = np.memmap(self.data_path, dtype=np.float64, mode='r' if self.read_only else 'r+',
+                                   shape=self.shape)
+        return self._data
+
+    def __day_index(self, day: date) -> int:
+        day = day.date() if isinstance(day, datetime) else day
+        index = (day - self.start_date).days
+        assert index >= 0, f"The cube starts at {self.start_date}, can't hold {day}"
+        return index
+
+    def __grow_days(self, days: int):
+        # Days is the leading axis, so growing it is just appending NaNs at the end of the file
+        days = ((days // PRICE_CUBE_GROWTH_DAYS) + 1) * PRICE_CUBE_GROWTH_DAYS
+        old_days, self._data = self.days, None
+        self.days = days
+        os.makedirs(self.folder, exist_ok=True)
+        with open(self.data_path, 'ab') as f:
+            f.truncate(int(np.prod(self.shape)) * np.dtype(np.float64).itemsize)
+        self.__map()[old_days:] = np.nan
+        self.__save_layout()
+
+    def __add_toll(self, toll: str):
+        # Adding a toll changes the strides of every day, so the cube has to be rewritten
+        old_data, old_shape = self.__map(), self.shape
+        self.tolls.append(toll)
+        self._data = None
+        if self.days == 0:
+            self.__save_layout()
+            return
+        tmp_path = f"{self.data_path}.tmp"
+        new_data = np.memmap(tmp_path, dtype=np.float64, mode='w+', shape=self.shape)
+        new_data[:] = np.nan
+        if old_data is not None:
+            new_data[:, :, :, :old_shape[3], :] = old_data
+        new_data.flush()
+        del new_data, old_data
+        os.replace(tmp_path, self.data_path)
+        self.__save_layout()
+
+    def write_day(self, day: date, location: str, toll: str, values: np.ndarray):
+        """
+        Write the hourly values of a day, location and toll
+
+        :param day: date. Day of the values
+        :param location: str. Location of the data [PCB (Peninsula, Canarias, Baleares) or CYM (Ceuta, Melilla)]
+        :param toll: str. Toll of the data (2.0TD, 2.0A, 2.0DHA, 2.0DHS...)
+        :param values: np.ndarray. Array of shape (24, len(fields)), in the order of self.fields
+        """
+        assert not self.read_only, f"The cube is read only"
+        assert values.shape == (24, len(self.fields)), f"Expected values of shape (24, {len(self.fields)}), got {values.shape}"
+        with self.lock:
+            if location not in self.locations:
+                raise ValueError(f"Unknown location {location}")
+            if toll not in self.tolls:
+                self.__add_toll(toll=toll)
+            index = self.__day_index(day=day)
+            if index >= self.days:
+                self.__grow_days(days=index + 1)
+            self.__map()[index, :, self.locations.index(location), self.tolls.index(toll), :] = values
+
+    def append_frame(self, df: pd.DataFrame):
+        """
+        Append the parsed data of a day (as returned by parse_workbook for a location), for all its tolls
+
+        :param df: pd.DataFrame. Data of a single day and location, with the columns of the csv files
+        """
+        location = df['location'].iloc[0]
+        day = datetime.strptime(df['date'].iloc[0], EXPECTED_DATE_FORMAT).date()
+        for toll in df['toll'].unique():
+            data_toll = fix_day_length(df=df[df['toll'] == toll].sort_values(by='hour').reset_index(drop=True))
+            values = data_toll[list(self.fields)].to_numpy(dtype=np.float64)
+            self.write_day(day=day, location=location, toll=toll, values=values)
+
+    def load(self, start_date: date, end_date: date) -> np.ndarray:
+        """
+        Get the values of a date range, as a zero-copy view of the memory-mapped cube
+
+        :param start_date: date. Start date of the range (included)
+        :param end_date: date. End date of the range (included)
+
+        :return: np.ndarray. View of shape (days, 24, locations, tolls, fields). Days that are not in the cube are
+                             NaN (if the range goes beyond the allocated days, only that part is a copy)
+        """
+        start, end = self.__day_index(day=start_date), self.__day_index(day=end_date) + 1
+        assert start < end, f"start_date must be before end_date"
+        with self.lock:
+            data = self.__map()
+            if data is not None and end <= self.days:
+                return data[start:end]
+            view = np.full((end - start, 24, len(self.locations), len(self.tolls), len(self.fields)), np.nan)
+            if data is not None and start < self.days:
+                view[:self.days - start] = data[start:]
+            return view
+
+    def series(self, start_date: date, end_date: date, location: str = PCB, toll: str = '2.0TD',
+               field: str = 'PVPC_price_kwh') -> np.ndarray:
+        """
+        Get the (days, 24) matrix of one field for a location and toll, as a strided view of the cube
+
+        :param start_date: date. Start date of the range (included)
+        :param end_date: date. End date of the range (included)
+        :param location: str. Location of the data [PCB (Peninsula, Canarias, Baleares) or CYM (Ceuta, Melilla)]
+        :param toll: str. Toll of the data (2.0TD, 2.0A, 2.0DHA, 2.0DHS...)
+        :param field: str. One of self.fields
+
+        :return: np.ndarray. Array of shape (days, 24). Missing days are NaN
+        """
+        assert toll in self.tolls, f"Toll {toll} is not in the cube. Available: {self.tolls}"
+        return self.load(start_date=start_date, end_date=end_date)[:, :, self.locations.index(location),
+                                                                   self.tolls.index(toll), self.fields.index(field)]
+
+    def save(self):
+        """
+        Flush the values to disk and persist the layout
+        """
+        assert not self.read_only, f"The cube is read only"
+        with self.lock:
+            if self._data is not None:
+                self._data.flush()
+            self.__save_layout()
+
+    def __save_layout(self):
+        # The layout must always match the data file, so it is saved after every change of shape
+        layout = {'start_date': self.start_date.strftime(EXPECTED_DATE_FORMAT), 'days': self.days,
+                  'locations': self.locations, 'tolls': self.tolls, 'fields': self.fields}
+        os.makedirs(self.folder, exist_ok=True)
+        tmp_path = f"{self.layout_path}.tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump(layout, f)
+        os.replace(tmp_path, self.layout_path)
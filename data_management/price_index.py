@@ -0,0 +1,205 @@
+"""
+This class keeps, for a location and toll, the cumulative sums and counts of the hourly prices by hour of the day and
+by period, so the average of any date range is answered in constant time (and thousands of ranges in a single
+vectorized call) instead of aggregating every day of the range
+"""
+
+import os
+from datetime import date, datetime
+from threading import Lock
+
+import numpy as np
+
+from data_management.constants import PRICE_INDEX_FOLDER, PRICE_INDEX_START_DATE, PRICE_INDEX_MAX_PERIOD, \
+    PRICE_FIELDS, EXPECTED_DATE_FORMAT
+
+
+class PriceIndex:
+    def __init__(self, location: str = 'PCB', toll: str = '2.0TD', folder: str = PRICE_INDEX_FOLDER,
+                 fields: tuple[str, ...] = PRICE_FIELDS):
+        """
+        Index persisted as <folder>/<location>--<toll>.npz. Days are counted from PRICE_INDEX_START_DATE, and days
+        without data don't count for the averages (as in the database queries)
+
+        :param location: str. Location of the data [PCB (Peninsula, Canarias, Baleares) or CYM (Ceuta, Melilla)]
+        :param toll: str. Toll of the data (2.0TD, 2.0A, 2.0DHA, 2.0-DHS...)
+        :param folder: str. Folder of the index files
+        :param fields: tuple[str, ...]. Hourly fields indexed
+        """
+        self.location, self.toll = location, toll
+        self.fields = list(fields)
+        self.path = os.path.join(folder, f"{location}--{toll}.npz")
+        self.start_date = PRICE_INDEX_START_DATE
+        self.lock = Lock()
+        # Daily values are kept to rebuild the cumulative sums when a past day changes
+        self.values = np.full((0, 24, len(self.fields)), np.nan)
+        self.periods = np.zeros((0, 24), dtype=np.int8)
+        if os.path.isfile(self.path):
+            with np.load(self.path) as content:
+                assert list(content['fields']) == self.fields, f"Index {self.path} has fields {list(content['fields'])}"
+                self.values, self.periods = content['values'], content['periods']
+        self._hour_sums = None
+        self.__rebuild(first=0)
+
+    @property
+    def days(self) -> int:
+        return len(self.values)
+
+    def add_doc(self, doc: dict):
+        """
+        Add (or replace) the BY_DAY document of a day
+
+        :param doc: dict. BY_DAY document, with 'date', 'period' and the hourly lists of the fields
+        """
+        self.add_docs(docs=[doc])
+
+    def add_docs(self, docs: list[dict]):
+        """
+        Add (or replace) the BY_DAY documents of many days. Appending days after the last one only updates the end
+        of the cumulative sums
+
+        :param docs: list[dict]. BY_DAY documents, with 'date', 'period' and the hourly lists of the fields
+        """
+        if len(docs) == 0:
+            return
+        indices = np.array([self.__day_index(day=datetime.strptime(doc['date'], EXPECTED_DATE_FORMAT).date())
+                            for doc in docs])
+        values = np.array([[doc[field] for field in self.fields] for doc in docs], dtype=np.float64).transpose(0, 2, 1)
+        periods = np.array([doc['period'] for doc in docs], dtype=np.int8)
+        assert values.shape[1] == 24, f"Expected 24 hours per day, got {values.shape[1]}"
+        assert periods.min() >= 1 and periods.max() <= PRICE_INDEX_MAX_PERIOD, \
+            f"Periods must be between 1 and {PRICE_INDEX_MAX_PERIOD}"
+        with self.lock:
+            if indices.max() >= self.days:
+                grow = indices.max() + 1 - self.days
+                self.values = np.concatenate([self.values, np.full((grow, 24, len(self.fields)), np.nan)])
+                self.periods = np.concatenate([self.periods, np.zeros((grow, 24), dtype=np.int8)])
+            self.values[indices], self.periods[indices] = values, periods
+            self.__rebuild(first=int(indices.min()))
+
+    def update(self, source, start_date: date, end_date: date):
+        """
+        Add the days of a range read from the database
+
+        :param source: StorageBackend | FirebaseQuerier. Where the BY_DAY documents are read from (a SQLite file, or
+                        Firestore through the query cache, if any)
+        :param start_date: date. Start date of the range
+        :param end_date: date. End date of the range
+        """
+        self.add_docs(docs=source.get_days_between_dates(start_date=start_date, end_date=end_date,
+                                                         location=self.location, toll=self.toll))
+
+    def avg_by_hour(self, start_date: date, end_date: date, field: str = 'PVPC_price_kwh') -> dict[int, float]:
+        """
+        Get the average of a field between 2 dates by hour, in constant time
+
+        :param start_date: date. Start date of the range (included)
+        :param end_date: date. End date of the range (included)
+        :param field: str. Indexed field
+
+        :return: dict[int, float]. Dict with the average of each hour. NaN if there is no data in the range
+        """
+        averages = self.avg_by_hour_many(start_dates=[start_date], end_dates=[end_date], field=field)[0]
+        return {hour: averages[hour] for hour in range(24)}
+
+    def avg_by_period(self, start_date: date, end_date: date, field: str = 'PVPC_price_kwh') -> dict[int, float]:
+        """
+        Get the average of a field between 2 dates by period, in constant time
+
+        :param start_date: date. Start date of the range (included)
+        :param end_date: date. End date of the range (included)
+        :param field: str. Indexed field
+
+        :return: dict[int, float]. Dict with the average of each period with data in the range
+        """
+        averages = self.avg_by_period_many(start_dates=[start_date], end_dates=[end_date], field=field)[0]
+        return {period + 1: averages[period] for period in range(PRICE_INDEX_MAX_PERIOD)
+                if not np.isnan(averages[period])}
+
+    def avg_by_hour_many(self, start_dates, end_dates, field: str = 'PVPC_price_kwh') -> np.ndarray:
+        """
+        Get the average of a field by hour for many ranges at once
+
+        :param start_dates: Sequence of dates (or np.datetime64 array). Start date of each range (included)
+        :param end_dates: Sequence of dates (or np.datetime64 array). End date of each range (included)
+        :param field: str. Indexed field
+
+        :return: np.ndarray. Array of shape (ranges, 24). NaN where there is no data
+        """
+        start, end = self.__bounds(start_dates=start_dates, end_dates=end_dates)
+        field_index = self.fields.index(field)
+        with self.lock:
+            sums = self._hour_sums[end, :, field_index] - self._hour_sums[start, :, field_index]
+            counts = self._hour_counts[end, :, field_index] - self._hour_counts[start, :, field_index]
+        with np.errstate(invalid='ignore', divide='ignore'):
+            return sums / counts
+
+    def avg_by_period_many(self, start_dates, end_dates, field: str = 'PVPC_price_kwh') -> np.ndarray:
+        """
+        Get the average of a field by period for many ranges at once
+
+        :param start_dates: Sequence of dates (or np.datetime64 array). Start date of each range (included)
+        :param end_dates: Sequence of dates (or np.datetime64 array). End date of each range (included)
+        :param field: str. Indexed field
+
+        :return: np.ndarray. Array of shape (ranges, PRICE_INDEX_MAX_PERIOD), column i being period i + 1. NaN where
+                             there is no data
+        """
+        start, end = self.__bounds(start_dates=start_dates, end_dates=end_dates)
+        field_index = self.fields.index(field)
+        with self.lock:
+            sums = self._period_sums[end, :, field_index] - self._period_sums[start, :, field_index]
+            counts = self._period_counts[end, :, field_index] - self._period_counts[start, :, field_index]
+        with np.errstate(invalid='ignore', divide='ignore'):
+            return sums / counts
+
+    def save(self):
+        """
+        Persist the daily values (atomically, so a crash never leaves a corrupt index)
+        """
+        with self.lock:
+            values, periods = self.values, self.periods
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, 'wb') as f:
+            np.savez(f, values=values, periods=periods, fields=np.array(self.fields))
+        os.replace(tmp_path, self.path)
+
+    def __day_index(self, day: date) -> int:
+        index = (day - self.start_date).days
+        assert index >= 0, f"The index starts at {self.start_date}, can't hold {day}"
+        return index
+
+    def __bounds(self, start_dates, end_dates) -> tuple[np.ndarray, np.ndarray]:
+        # Positions in the cumulative arrays, clipped to the indexed days
+        start_dates = np.asarray(start_dates, dtype='datetime64[D]')
+        end_dates = np.asarray(end_dates, dtype='datetime64[D]')
+        origin = np.datetime64(self.start_date, 'D')
+        start = np.clip((start_dates - origin).astype(np.int64), 0, self.days)
+        end = np.clip((end_dates - origin).astype(np.int64) + 1, 0, self.days)
+        return start, np.maximum(start, end)
+
+    def __rebuild(self, first: int):
+        # Cumulative arrays have one more row than days, row i holding the totals of the days before i. Only the
+        # days from first on are accumulated again
+        if self._hour_sums is None:
+            first = 0
+            self._hour_sums = np.zeros((1, 24, len(self.fields)))
+            self._hour_counts = np.zeros((1, 24, len(self.fields)), dtype=np.int64)
+            self._period_sums = np.zeros((1, PRICE_INDEX_MAX_PERIOD, len(self.fields)))
+            self._period_counts = np.zeros((1, PRICE_INDEX_MAX_PERIOD, len(self.fields)), dtype=np.int64)
+        first = min(first, len(self._hour_sums) - 1)
+        values, periods = self.values[first:], self.periods[first:]
+        present = ~np.isnan(values)
+        day_values = np.where(present, values, 0.0)
+        # One hot of the period of each hour, to sum by period. Each field counts only the hours it has a value for
+        period_masks = (periods[:, :, None, None] == np.arange(1, PRICE_INDEX_MAX_PERIOD + 1)[:, None]) & \
+                       present[:, :, None, :]
+
+        def accumulate(cumulative: np.ndarray, daily: np.ndarray) -> np.ndarray:
+            return np.concatenate([cumulative[:first + 1], cumulative[first] + np.cumsum(daily, axis=0)])
+
+        self._hour_sums = accumulate(self._hour_sums, day_values)
+        self._hour_counts = accumulate(self._hour_counts, present.astype(np.int64))
+        self._period_sums = accumulate(self._period_sums, np.einsum('dhpf,dhf->dpf', period_masks, day_values))
+        self._period_counts = accumulate(self._period_counts, period_masks.sum(axis=1))
@@ -0,0 +1,101 @@
+"""
+This class holds the hourly prices of many location/toll pairs over a date range as a single dense array laid out as
+(pair, day, hour, field), with a mask of the days that are missing, so tariffs can be compared with vectorized code
+"""
+
+from datetime import date, datetime, timedelta
+
+import numpy as np
+import pandas as pd
+
+from data_management.constants import EXPECTED_DATE_FORMAT
+
+
+class PriceMatrix:
+    def __init__(self, pairs: list[tuple[str, str]], start_date: date, end_date: date,
+                 fields: tuple[str, ...] = ('PVPC_price_kwh',)):
+        """
+        Empty matrix, every day missing
+
+        :param pairs: list[tuple[str, str]]. (location, toll) pairs, in the order of the first axis
+        :param start_date: date. Start date of the range (included)
+        :param end_date: date. End date of the range (included)
+        :param fields: tuple[str, ...]. Hourly fields, in the order of the last axis
+        """
+        start_date = start_date.date() if isinstance(start_date, datetime) else start_date
+        end_date = end_date.date() if isinstance(end_date, datetime) else end_date
+        assert start_date <= end_date, f"start_date must be before end_date"
+        self.pairs = [tuple(pair) for pair in pairs]
+        self.fields = list(fields)
+        self.start_date = start_date
+        self.dates = np.arange(np.datetime64(start_date, 'D'), np.datetime64(end_date + timedelta(days=1), 'D'))
+        self.values = np.full((len(self.pairs), len(self.dates), 24, len(self.fields)), np.nan)
+        self.missing = np.ones((len(self.pairs), len(self.dates)), dtype=bool)
+
+    def __getitem__(self, field: str) -> np.ndarray:
+        """
+        :param field: str. One of the fields of the matrix
+        :return: np.ndarray. View of shape (pair, day, hour) with the values of the field. Missing days are NaN
+        """
+        return self.values[..., self.fields.index(field)]
+
+    def pair_index(self, location: str, toll: str) -> int:
+        """
+        :return: int. Position of a location/toll pair in the first axis
+        """
+        return self.pairs.index((location, toll))
+
+    def fill(self, location: str, toll: str, docs: list[dict]):
+        """
+        Set the values of a pair from its BY_DAY documents. Documents out of the range are ignored
+
+        :param location: str. Location of the data [PCB (Peninsula, Canarias, Baleares) or CYM (Ceuta, Melilla)]
+        :param toll: str. Toll of the data (2.0TD, 2.0A, 2.0DHA, 2.0-DHS...)
+        :param docs: list[dict]. BY_DAY documents, with 'date' and the hourly lists of the fields
+        """
+        pair = self.pair_index(location=location, toll=toll)
+        for doc in docs:
+            day = (datetime.strptime(doc['date'], EXPECTED_DATE_FORMAT).date() - self.start_date).days
+            if 0 <= day < len(self.dates):
+                self.values[pair, day] = np.array([doc[field] for field in self.fields], dtype=np.float64).T
+                self.missing[pair, day] = False
+
+    @classmethod
+    def from_price_cube(cls, cube, pairs: list[tuple[str, str]], start_date: date, end_date: date,
+                        fields: tuple[str, ...] = ('PVPC_price_kwh',)) -> 'PriceMatrix':
+        """
+        Build the matrix from the local price cube, without reading the database
+
+        :param cube: PriceCube. Cube with the prices
+        :param pairs: list[tuple[str, str]]. (location, toll) pairs. Tolls that are not in the cube are all missing
+        :param start_date: date. Start date of the range (included)
+        :param end_date: date. End date of the range (included)
+        :param fields: tuple[str, ...]. Hourly fields
+
+        :return: PriceMatrix. Matrix with the values of the cube
+        """
+        matrix = cls(pairs=pairs, start_date=start_date, end_date=end_date, fields=fields)
+        data = cube.load(start_date=matrix.start_date, end_date=matrix.start_date + timedelta(days=len(matrix.dates) - 1))
+        field_indices = [cube.fields.index(field) for field in matrix.fields]
+        for pair, (location, toll) in enumerate(matrix.pairs):
+            if toll not in cube.tolls:
+                continue
+            matrix.values[pair] = data[:, :, cube.locations.index(location), cube.tolls.index(toll)][..., field_indices]
+            matrix.missing[pair] = np.isnan(matrix.values[pair]).all(axis=(1, 2))
+        return matrix
+
+    def to_frame(self) -> pd.DataFrame:
+        """
+        :return: pd.DataFrame. Long format frame with one row per pair, day and hour (missing days excluded), with
+                                the columns location, toll, date, hour and one per field
+        """
+        pairs, days = np.nonzero(~self.missing)
+        frame = pd.DataFrame({
+            'location': np.repeat([self.pairs[pair][0] for pair in pairs], 24),
+            'toll': np.repeat([self.pairs[pair][1] for pair in pairs], 24),
+            'date': np.repeat(self.dates[days], 24),
+            'hour': np.tile(np.arange(24), len(pairs))
+        })
+        for field_index, field in enumerate(self.fields):
+            frame[field] = self.values[pairs, days, :, field_index].reshape(-1)
+        return frame
@@ -2,79 +2,253 @@
 This class downloads the xls files that contain the prices of the day
 """
 
+import asyncio
 import pandas as pd
 import os
-from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from multiprocessing import get_context
 from tqdm import tqdm
 from data_management.constants import DOWNLOAD_PRICE_DAY_URL_XLS, DATA_FOLDER, EXPECTED_DATE_FORMAT, \
-    SHEET_NAMES_TO_FOLDER
+    SHEET_NAMES_TO_FOLDER, OLD_FORMAT_SHEET_NAME, PARSE_WORKERS, DOWNLOAD_MAX_IN_FLIGHT, DOWNLOAD_REQUESTS_PER_SECOND, \
+    DOWNLOAD_MAX_RETRIES, RAW_CACHE_FOLDER_NAME
+from data_management.async_downloader import AsyncDownloadEngine, DownloadResponse
+from data_management.manifest import DataManifest
+from data_management.price_cube import PriceCube
+from data_management.raw_cache import RawCache
+from utils.metrics import metrics
 from urllib import request
-import shutil
+from urllib.error import HTTPError
 from tempfile import NamedTemporaryFile
-from datetime import datetime, timedelta
+from datetime import date as date_type, datetime, timedelta
 from loguru import logger
 from threading import Lock
 
 
 class PricesDownloader:
-    def __init__(self, ):
-        self.url = DOWNLOAD_PRICE_DAY_URL_XLS
+    def __init__(self, manifest: DataManifest | None = None, parse_workers: int = PARSE_WORKERS,
+                 data_folder: str = DATA_FOLDER, url: str = DOWNLOAD_PRICE_DAY_URL_XLS, cache_raw: bool = True,
+                 price_cube: PriceCube | None = None, write_csv: bool = True):
+        """
+        :param manifest: DataManifest | None. Manifest where the csv files written are registered. If None, the
+                            one of data_folder is used
+        :param parse_workers: int. Number of processes used to parse the xls files, separated from the download
+                            threads. If 0, files are parsed in the thread that downloads them
+        :param data_folder: str. Folder where the csv files are written, as <data_folder>/<PCB|CYM>/<TOLL>/<date>.csv
+        :param url: str. Url template to download the xls of a day, with a {date} placeholder
+        :param cache_raw: bool. If True, raw downloads are kept in a RawCache inside data_folder, requests are
+                            conditional (unchanged days are not transferred nor parsed again) and reparse_range is
+                            available
+        :param price_cube: PriceCube | None. If given, every day parsed is also appended to this cube
+        :param write_csv: bool. If False, the csv files are not written (the cube must be given then)
+        """
+        self.url = url
+        self.data_folder = data_folder
         # lock for thread safety
         self.lock = Lock()
+        self.manifest = manifest if manifest is not None else DataManifest(data_folder=data_folder)
+        self.raw_cache = RawCache(folder=os.path.join(data_folder, RAW_CACHE_FOLDER_NAME)) if cache_raw else None
+        self.parse_workers = parse_workers
+        assert write_csv or price_cube is not None, f"Parsed data must be stored somewhere (csv files or price cube)"
+        self.price_cube = price_cube
+        self.write_csv = write_csv
+        # Created on the first parse, so downloaders that never parse don't start worker processes
+        self.parse_executor = None
 
-    def download_day(self, date: datetime) -> str:
+    def download_day(self, date: datetime, save_manifest: bool = True) -> str:
         """
         Download the XLS from the URL and save it in filename
 
         :param date: Date of the prices to download. Only one day can be downloaded at a time
+        :param save_manifest: bool. If True, the manifest (and raw cache index) are persisted after the download
         :return: str. Path to the downloaded file
 
         :raises AssertionError: If the file is not downloaded, or if the date is not a datetime.datetime object
         """
 
         assert isinstance(date, datetime), f"date must be a datetime.datetime object, not {type(date)}"
-        with self.lock:
-            if not os.path.isdir(DATA_FOLDER):
-                logger.warning(f"Folder {DATA_FOLDER} does not exist. Creating it")
-                os.mkdir(DATA_FOLDER)
+        self.__create_data_folder()
 
         date_str = date.strftime(EXPECTED_DATE_FORMAT)
 
         full_url = self.url.format(date=date_str)
+        headers = self.raw_cache.conditional_headers(day=date) if self.raw_cache is not None else {}
 
-        with request.urlopen(full_url) as response, NamedTemporaryFile(suffix='.xls', delete=False) as out_file:
-            shutil.copyfileobj(fsrc=response, fdst=out_file)
-            paths = self.cast_to_csv(out_file.name)
-        os.remove(out_file.name)
-        # Delete the temporary file
-        assert not os.path.isfile(out_file.name), f"File {out_file.name} was not deleted"
+        try:
+            with metrics.timer('http_request_seconds'), \
+                    request.urlopen(request.Request(full_url, headers=headers)) as response:
+                status, content, response_headers = response.status, response.read(), response.headers
+        except HTTPError as e:
+            # urllib raises on 304 Not Modified, that just means the cached content is still valid
+            if e.code != 304:
+                metrics.inc('http_failures_total')
+                raise
+            status, content, response_headers = 304, None, {}
+        metrics.inc('http_requests_total', status=status)
+        metrics.inc('http_bytes_total', len(content) if content is not None else 0)
+        paths = self.__store_download(date=date, status=status, content=content, headers=response_headers)
+        if save_manifest:
+            self.save()
         return paths
 
     def download_prices_for_date_range(self, start_date: datetime, end_date: datetime,
-                                       _batch_size: int = 8) -> tuple[str, ...]:
+                                       max_in_flight: int = DOWNLOAD_MAX_IN_FLIGHT,
+                                       requests_per_second: float = DOWNLOAD_REQUESTS_PER_SECOND,
+                                       max_retries: int = DOWNLOAD_MAX_RETRIES) -> tuple[str, ...]:
         """
-        Download the prices for a range of dates
+        Download the prices for a range of dates. Downloads run on an asyncio engine that keeps up to max_in_flight
+        requests alive over persistent connections (starting a new one as soon as any finishes), while the parsing
+        runs in the parse process pool
 
         :param start_date: datetime.datetime object. Start date of the range
         :param end_date: datetime.datetime object. End date of the range
+        :param max_in_flight: int. Maximum number of concurrent requests
+        :param requests_per_second: float. Maximum requests started per second to the ESIOS host
+        :param max_retries: int. Number of retries (with jittered backoff) of each failed request
+
+        :return: tuple[str, ...]. Paths to the csv files created
 
-        :return: None
+        :raises AssertionError: If any day could not be downloaded
         """
         assert isinstance(start_date, datetime), f"start_date must be a datetime.datetime object, not {type(start_date)}"
         assert isinstance(end_date, datetime), f"end_date must be a datetime.datetime object, not {type(end_date)}"
         assert start_date < end_date, f"start_date must be before end_date"
+        self.__create_data_folder()
 
-        # Use ThreadPoolExecutor to download the files in parallel
-        with ThreadPoolExecutor() as executor:
-            files = []
-            for i in tqdm(range(0, (end_date - start_date).days + 1, _batch_size), desc="Downloading prices"):
-                batch_size = min(_batch_size, (end_date - start_date).days - i + 1)
-                batch_files = list(executor.map(self.download_day, [start_date + timedelta(days=i + j) for j in range(batch_size)]))
-                # Flatten the list
-                batch_files = [file for sublist in batch_files for file in sublist]
-                files.extend(batch_files)
+        dates = [start_date + timedelta(days=i) for i in range((end_date - start_date).days + 1)]
+        requests = (self.request_for_day(date=date) for date in dates)
+        files = []
+        progress_bar = tqdm(total=len(dates), desc="Downloading prices")
+
+        async def on_response(date: datetime, response: DownloadResponse):
+            # Writing and parsing are blocking, keep them out of the event loop
+            paths = await asyncio.get_running_loop().run_in_executor(None, self.__store_download, date, response.status,
+                                                                     response.body, response.headers)
+            files.extend(paths)
+            progress_bar.update(1)
+
+        engine = AsyncDownloadEngine(max_in_flight=max_in_flight, requests_per_second=requests_per_second,
+                                     max_retries=max_retries)
+        stats = engine.run(requests=requests, on_response=on_response)
+        progress_bar.close()
+        self.save()
+        logger.info(f"Downloaded {len(dates) - len(stats['failed'])} days ({stats['bytes'] / 1e6:.1f} MB) with "
+                    f"{stats['requests']} requests ({stats['retries']} retries) in {stats['elapsed_seconds']:.1f}s")
+        assert len(stats['failed']) == 0, f"Could not download {sorted(date.strftime(EXPECTED_DATE_FORMAT) for date in stats['failed'])}"
         return tuple(files)
 
+    def reparse_range(self, start_date: date_type, end_date: date_type) -> tuple[str, ...]:
+        """
+        Rebuild the csv files of a range of dates from the raw cache, without network access. Useful after changing
+        the parsing logic
+
+        :param start_date: date. Start date of the range
+        :param end_date: date. End date of the range
+
+        :return: tuple[str, ...]. Paths to the csv files created. Days that are not cached are skipped
+        """
+        assert self.raw_cache is not None, f"reparse_range needs the raw cache (cache_raw=True)"
+        assert start_date <= end_date, f"start_date must be before end_date"
+        days = self.raw_cache.days_between(start_date=start_date, end_date=end_date)
+        missing = (end_date - start_date).days + 1 - len(days)
+        if missing > 0:
+            logger.warning(f"{missing} days between {start_date} and {end_date} are not in the raw cache. Skipping them")
+        # Threads only feed the parse process pool
+        with ThreadPoolExecutor(max_workers=max(1, self.parse_workers)) as executor:
+            paths = list(tqdm(executor.map(lambda day: self.__cast_content(self.raw_cache.get(day=day)), days),
+                              total=len(days), desc="Re-parsing prices"))
+        self.save()
+        return tuple(path for day_paths in paths for path in day_paths)
+
+    def save(self):
+        """
+        Persist the manifest, the raw cache index and the price cube
+        """
+        self.manifest.save()
+        if self.raw_cache is not None:
+            self.raw_cache.save()
+        if self.price_cube is not None:
+            self.price_cube.save()
+
+    def request_for_day(self, date: datetime) -> tuple[datetime, str, dict[str, str] | None]:
+        """
+        Build the request to download a day, in the format of AsyncDownloadEngine
+
+        :param date: datetime. Day to download
+
+        :return: tuple[datetime, str, dict[str, str] | None]. (date, url, conditional headers)
+        """
+        headers = self.raw_cache.conditional_headers(day=date) if self.raw_cache is not None else None
+        return date, self.url.format(date=date.strftime(EXPECTED_DATE_FORMAT)), headers
+
+    def cache_download(self, date: datetime, status: int, content: bytes | None, headers) -> tuple[bytes, bool]:
+        """
+        Store a downloaded xls in the raw cache, or recover it from there if the server answered 304 Not Modified
+
+        :param date: datetime. Day downloaded
+        :param status: int. HTTP status of the response
+        :param content: bytes | None. Content of the response
+        :param headers: Case insensitive mapping with the headers of the response
+
+        :return: tuple[bytes, bool]. Content of the xls, and whether it changed since the last download
+        """
+        if self.raw_cache is None:
+            return content, True
+        if status == 304:
+            metrics.inc('raw_cache_total', result='not_modified')
+            return self.raw_cache.get(day=date), False
+        changed = self.raw_cache.put(day=date, content=content, etag=headers.get('ETag'),
+                                     last_modified=headers.get('Last-Modified'))
+        metrics.inc('raw_cache_total', result='changed' if changed else 'unchanged')
+        return content, changed
+
+    def parse_content(self, content: bytes) -> dict[str, pd.DataFrame]:
+        """
+        Parse the content of a downloaded xls in the parse process pool, without writing any csv
+
+        :param content: bytes. Content of the xls
+
+        :return: dict[str, pd.DataFrame]. Relevant columns of the prices of each location, as parse_workbook
+        """
+        with NamedTemporaryFile(suffix='.xls', delete=False) as out_file:
+            out_file.write(content)
+        try:
+            return self.__parse(xls_path=out_file.name)
+        finally:
+            os.remove(out_file.name)
+
+    def __parse(self, xls_path: str) -> dict[str, pd.DataFrame]:
+        # Includes the wait for a free worker of the parse pool
+        with metrics.timer('xls_parse_seconds'):
+            if self.parse_workers == 0:
+                return parse_workbook(xls_path=xls_path)
+            # Parsing is CPU bound, run it outside of the GIL of the download threads
+            return self.__get_parse_executor().submit(parse_workbook, xls_path).result()
+
+    def __get_parse_executor(self) -> ProcessPoolExecutor:
+        with self.lock:
+            if self.parse_executor is None:
+                # Spawn instead of fork, as the pool is created from a process that already runs threads
+                self.parse_executor = ProcessPoolExecutor(max_workers=self.parse_workers,
+                                                          mp_context=get_context('spawn'))
+            return self.parse_executor
+
+    def __store_download(self, date: datetime, status: int, content: bytes | None, headers) -> list[str]:
+        content, changed = self.cache_download(date=date, status=status, content=content, headers=headers)
+        existing_files = self.manifest.files_for_date(day=date)
+        # Unchanged days that were already converted don't need to be parsed again
+        if not changed and len(existing_files) > 0 and self.write_csv:
+            return [path for tolls in existing_files.values() for path in tolls.values()]
+        return self.__cast_content(content)
+
+    def __create_data_folder(self):
+        with self.lock:
+            if not os.path.isdir(self.data_folder):
+                logger.warning(f"Folder {self.data_folder} does not exist. Creating it")
+                os.mkdir(self.data_folder)
+
+    def __cast_content(self, content: bytes) -> list[str]:
+        return self.store(data_by_location=self.parse_content(content=content))
+
 
     def cast_to_csv(self, xls_path: str) -> list[str]:
         """
@@ -84,36 +258,38 @@ class PricesDownloader:
         :return: list[str]. List of paths to the csv files created
         """
         assert os.path.isfile(xls_path), f"File {xls_path} does not exist"
-        file_dirs = {}
-        for sheet_name, location_folder_path in SHEET_NAMES_TO_FOLDER.items():
+        return self.store(data_by_location=self.__parse(xls_path=xls_path))
+
+    def store(self, data_by_location: dict[str, pd.DataFrame], write_csv: bool | None = None) -> list[str]:
+        """
+        Store the data parsed by parse_workbook in the csv files and/or the price cube
+
+        :param data_by_location: dict[str, pd.DataFrame]. Parsed data of each location, as returned by parse_workbook
+        :param write_csv: bool | None. If given, overrides the write_csv of the downloader
+        :return: list[str]. List of paths to the csv files created (empty if no csv is written)
+        """
+        if self.price_cube is not None:
+            for data in data_by_location.values():
+                self.price_cube.append_frame(df=data)
+        write_csv = self.write_csv if write_csv is None else write_csv
+        return self.write_csvs(data_by_location=data_by_location) if write_csv else []
+
+    def write_csvs(self, data_by_location: dict[str, pd.DataFrame]) -> list[str]:
+        """
+        Save the data parsed by parse_workbook as one csv file per location and toll
+
+        :param data_by_location: dict[str, pd.DataFrame]. Parsed data of each location, as returned by parse_workbook
+        :return: list[str]. List of paths to the csv files created
+        """
+        location_folders = {os.path.basename(folder_path): os.path.join(self.data_folder, os.path.basename(folder_path))
+                            for folder_path in SHEET_NAMES_TO_FOLDER.values()}
+        file_dirs = []
+        for location, data in data_by_location.items():
+            location_folder_path = location_folders[location]
             with self.lock:
                 if not os.path.isdir(location_folder_path):
                     logger.warning(f"Folder {location_folder_path} does not exist. Creating it")
                     os.mkdir(location_folder_path)
-            try:
-                data = pd.read_excel(xls_path, sheet_name=sheet_name)
-            except ValueError as e:
-                # Old versions came this way
-                sheet_name = "Tabla de Datos"
-                data = pd.read_excel(xls_path, sheet_name=sheet_name)
-            location = os.path.basename(location_folder_path)
-            # Clean data because it comes as comes
-            data = data.dropna(axis=0, how='all').dropna(axis=1, how='all')
-            data = data.iloc[3:]  # 3 First rows are just headers
-            # Keep only the relevant columns (0, 1, 2, 3, 4, 5 & 6)
-            columns_names = ['date', 'hour', 'toll', 'period', 'PVPC_price_kwh', 'TEU_charges_kwh', 'TCU_production_price_kwh']
-            data = data.iloc[:, :len(columns_names)]
-            data.columns = columns_names
-            # Substract one hour to the hour column (from 1:00 to 24:00 to 0:00 to 23:00)
-            data['hour'] = data['hour'] - 1
-            # Just in case sort by Hour
-            data = data.sort_values(by='hour')
-            # Cast 3 last columns from MGh to kWh (1 MWh = 1000 kWh)
-            data.iloc[:, -3:] = data.iloc[:, -3:] / 1000
-
-            # Format date from 2020-01-01 00:00:00 to 2020-01-01
-            data['date'] = data['date'].apply(lambda x: x.strftime(EXPECTED_DATE_FORMAT))
-            data['location'] = location
             # Save one file per toll
             for toll in data['toll'].unique():
                 data_toll = data[data['toll'] == toll]
@@ -124,10 +300,63 @@ class PricesDownloader:
                         os.makedirs(os.path.dirname(csv_path))
                 # Just in case sort by Hour
                 data_toll = data_toll.sort_values(by='hour')
-                data_toll.to_csv(csv_path, index=False)
-                file_dirs[sheet_name] = csv_path
+                with metrics.timer('csv_write_seconds'):
+                    data_toll.to_csv(csv_path, index=False)
+                if metrics.enabled:
+                    metrics.inc('csv_bytes_written_total', os.path.getsize(csv_path))
+                self.manifest.add(date_str=data['date'].iloc[0], location=location, toll=toll, csv_path=csv_path)
+                file_dirs.append(csv_path)
                 assert os.path.isfile(csv_path), f"File {csv_path} does not exist"
 
-        return list(file_dirs.values())
+        return file_dirs
+
+    def close(self):
+        """
+        Shut down the parsing process pool, if it was started. The downloader can still be used after closing it
+        """
+        with self.lock:
+            parse_executor, self.parse_executor = self.parse_executor, None
+        if parse_executor is not None:
+            parse_executor.shutdown(wait=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+
+def parse_workbook(xls_path: str) -> dict[str, pd.DataFrame]:
+    """
+    Parse every sheet of a downloaded xls file in a single pass. It is a module level function so it can be sent to
+    a process pool
 
+    :param xls_path: str. Path to the xls file downloaded
+    :return: dict[str, pd.DataFrame]. Relevant columns of the prices of each location (PCB, CYM)
+    """
+    # Read all the sheets at once, instead of opening the workbook once per sheet
+    sheets = pd.read_excel(xls_path, sheet_name=None)
+    data_by_location = {}
+    for sheet_name, location_folder_path in SHEET_NAMES_TO_FOLDER.items():
+        # Old versions came with a single sheet for all the locations
+        data = sheets[sheet_name] if sheet_name in sheets else sheets[OLD_FORMAT_SHEET_NAME]
+        location = os.path.basename(location_folder_path)
+        # Clean data because it comes as comes
+        data = data.dropna(axis=0, how='all').dropna(axis=1, how='all')
+        data = data.iloc[3:]  # 3 First rows are just headers
+        # Keep only the relevant columns (0, 1, 2, 3, 4, 5 & 6)
+        columns_names = ['date', 'hour', 'toll', 'period', 'PVPC_price_kwh', 'TEU_charges_kwh', 'TCU_production_price_kwh']
+        data = data.iloc[:, :len(columns_names)]
+        data.columns = columns_names
+        # Substract one hour to the hour column (from 1:00 to 24:00 to 0:00 to 23:00)
+        data['hour'] = data['hour'] - 1
+        # Just in case sort by Hour
+        data = data.sort_values(by='hour')
+        # Cast 3 last columns from MGh to kWh (1 MWh = 1000 kWh)
+        data.iloc[:, -3:] = data.iloc[:, -3:] / 1000
 
+        # Format date from 2020-01-01 00:00:00 to 2020-01-01
+        data['date'] = pd.to_datetime(data['date']).dt.strftime(EXPECTED_DATE_FORMAT)
+        data['location'] = location
+        data_by_location[location] = data
+    return data_by_location
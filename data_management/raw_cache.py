@@ -0,0 +1,119 @@
+"""
+This class keeps a local, content-addressed and compressed copy of every raw xls downloaded, keyed by date, so csv
+files can be rebuilt without network access and unchanged days are never transferred again
+"""
+
+import gzip
+import hashlib
+import json
+import os
+from datetime import date, timedelta
+from threading import Lock
+
+from data_management.constants import RAW_CACHE_FOLDER, EXPECTED_DATE_FORMAT
+
+
+class RawCache:
+    def __init__(self, folder: str = RAW_CACHE_FOLDER):
+        """
+        Cache organized as <folder>/objects/<sha256[:2]>/<sha256>.gz, with an index.json mapping each date to the
+        sha256 of its content and the ETag/Last-Modified headers it was served with
+
+        :param folder: str. Folder of the cache
+        """
+        self.folder = folder
+        self.index_path = os.path.join(folder, 'index.json')
+        self.lock = Lock()
+        # Index will have the format {<date>: {'sha256': str, 'etag': str | None, 'last_modified': str | None}}
+        self._index = {}
+        if os.path.isfile(self.index_path):
+            with open(self.index_path, 'r') as f:
+                self._index = json.load(f)
+
+    def __object_path(self, sha256: str) -> str:
+        return os.path.join(self.folder, 'objects', sha256[:2], f"{sha256}.gz")
+
+    def conditional_headers(self, day: date) -> dict[str, str]:
+        """
+        Get the headers that make the server answer 304 Not Modified if the cached content of a day is still valid
+
+        :param day: date. Day to download
+
+        :return: dict[str, str]. If-None-Match and/or If-Modified-Since headers. Empty if the day is not cached
+        """
+        with self.lock:
+            entry = self._index.get(day.strftime(EXPECTED_DATE_FORMAT))
+        if entry is None or not os.path.isfile(self.__object_path(sha256=entry['sha256'])):
+            return {}
+        headers = {}
+        if entry.get('etag') is not None:
+            headers['If-None-Match'] = entry['etag']
+        if entry.get('last_modified') is not None:
+            headers['If-Modified-Since'] = entry['last_modified']
+        return headers
+
+    def put(self, day: date, content: bytes, etag: str | None = None, last_modified: str | None = None) -> bool:
+        """
+        Store the content downloaded for a day. It is not indexed on disk until save() is called
+
+        :param day: date. Day of the content
+        :param content: bytes. Raw xls content
+        :param etag: str | None. ETag header of the response
+        :param last_modified: str | None. Last-Modified header of the response
+
+        :return: bool. True if the content is different from the one cached for that day (or it was not cached)
+        """
+        sha256 = hashlib.sha256(content).hexdigest()
+        object_path = self.__object_path(sha256=sha256)
+        if not os.path.isfile(object_path):
+            os.makedirs(os.path.dirname(object_path), exist_ok=True)
+            tmp_path = f"{object_path}.{os.getpid()}.tmp"
+            with gzip.open(tmp_path, 'wb') as f:
+                f.write(content)
+            os.replace(tmp_path, object_path)
+        date_str = day.strftime(EXPECTED_DATE_FORMAT)
+        with self.lock:
+            previous = self._index.get(date_str)
+            self._index[date_str] = {'sha256': sha256, 'etag': etag, 'last_modified': last_modified}
+        return previous is None or previous['sha256'] != sha256
+
+    def get(self, day: date) -> bytes | None:
+        """
+        Get the cached content of a day
+
+        :param day: date. Day of the content
+
+        :return: bytes | None. Raw xls content, or None if the day is not cached
+        """
+        with self.lock:
+            entry = self._index.get(day.strftime(EXPECTED_DATE_FORMAT))
+        if entry is None or not os.path.isfile(self.__object_path(sha256=entry['sha256'])):
+            return None
+        with gzip.open(self.__object_path(sha256=entry['sha256']), 'rb') as f:
+            return f.read()
+
+    def days_between(self, start_date: date, end_date: date) -> list[date]:
+        """
+        Get the cached days of a range
+
+        :param start_date: date. Start date of the range (included)
+        :param end_date: date. End date of the range (included)
+
+        :return: list[date]. Sorted days of the range that are cached
+        """
+        with self.lock:
+            cached = set(self._index)
+        days = [start_date + timedelta(days=i) for i in range((end_date - start_date).days + 1)]
+        return [day for day in days if day.strftime(EXPECTED_DATE_FORMAT) in cached]
+
+    def save(self):
+        """
+        Persist the index to disk (atomically, so a crash never leaves a corrupt index)
+        """
+        with self.lock:
+            content = json.dumps(self._index, sort_keys=True)
+        os.makedirs(self.folder, exist_ok=True)
+        tmp_path = f"{self.index_path}.tmp"
+        with open(tmp_path, 'w') as f:
+            f.write(content)
+        os.replace(tmp_path, self.index_path)
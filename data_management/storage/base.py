@@ -0,0 +1,165 @@
+"""
+Common interface of the places the prices are stored in (Firestore, a local SQLite file...). Backends store the
+BY_DAY documents of every location/toll and answer the same queries, so the analysis code doesn't depend on where
+the data lives, and a backend can be mirrored into another one with replicate
+"""
+
+from abc import ABC, abstractmethod
+from datetime import date, datetime, timedelta
+
+from loguru import logger
+
+from data_management.constants import REPLICATE_CHUNK_DAYS
+from data_management.firebase.aggregation import PriceAccumulator
+from data_management.price_matrix import PriceMatrix
+
+
+class StorageBackend(ABC):
+    """
+    Backends implement write_days, get_days_between_dates, aggregate_between_dates, first_date and last_date. The
+    rest of the queries are built on top of them
+    """
+
+    @abstractmethod
+    def write_days(self, docs: list[dict]) -> int:
+        """
+        Write (or replace) the BY_DAY documents of some days
+
+        :param docs: list[dict]. BY_DAY documents, in the compact or the original format
+
+        :return: int. Number of days written
+        """
+
+    @abstractmethod
+    def get_days_between_dates(self, start_date: date, end_date: date, location: str = 'PCB',
+                               toll: str = '2.0TD') -> list[dict]:
+        """
+        Get the BY_DAY documents between 2 dates
+
+        :param start_date: date. Start date of the range
+        :param end_date: date. End date of the range
+        :param location: str. Location of the data [PCB (Peninsula, Canarias, Baleares) or CYM (Ceuta, Melilla)]
+        :param toll: str. Toll of the data (2.0TD, 2.0A, 2.0DHA, 2.0-DHS...)
+
+        :return: list[dict]. Documents of the days that exist, sorted by date, in the original format (hourly fields
+                            may be numpy arrays)
+        """
+
+    @abstractmethod
+    def aggregate_between_dates(self, start_date: date, end_date: date, location: str = 'PCB', toll: str = '2.0TD',
+                                field: str = 'PVPC_price_kwh') -> PriceAccumulator:
+        """
+        Aggregate an hourly field between 2 dates, by hour and by period
+
+        :param start_date: date. Start date of the range
+        :param end_date: date. End date of the range
+        :param location: str. Location of the data [PCB (Peninsula, Canarias, Baleares) or CYM (Ceuta, Melilla)]
+        :param toll: str. Toll of the data (2.0TD, 2.0A, 2.0DHA, 2.0-DHS...)
+        :param field: str. Hourly field to aggregate (PVPC_price_kwh, TEU_charges_kwh, TCU_production_price_kwh)
+
+        :return: PriceAccumulator. Sums, counts, minimums and maximums of the field by hour and by period
+        """
+
+    @abstractmethod
+    def first_date(self, location: str = 'PCB', toll: str = '2.0TD') -> date | None:
+        """
+        :param location: str. Location of the data [PCB (Peninsula, Canarias, Baleares) or CYM (Ceuta, Melilla)]
+        :param toll: str. Toll of the data (2.0TD, 2.0A, 2.0DHA, 2.0-DHS...)
+        :return: date | None. First day stored of a location/toll. None if there is none
+        """
+
+    @abstractmethod
+    def last_date(self, location: str = 'PCB', toll: str = '2.0TD') -> date | None:
+        """
+        :param location: str. Location of the data [PCB (Peninsula, Canarias, Baleares) or CYM (Ceuta, Melilla)]
+        :param toll: str. Toll of the data (2.0TD, 2.0A, 2.0DHA, 2.0-DHS...)
+        :return: date | None. Last day stored of a location/toll. None if there is none
+        """
+
+    def avg_price_between_dates_by_period(self, start_date: date, end_date: date, location: str = 'PCB',
+                                          toll: str = '2.0TD') -> dict[int, float]:
+        """
+        Get the average price between 2 dates by period
+
+        :param start_date: date. Start date of the range
+        :param end_date: date. End date of the range
+        :param location: str. Location of the data [PCB (Peninsula, Canarias, Baleares) or CYM (Ceuta, Melilla)]
+        :param toll: str. Toll of the data (2.0TD, 2.0A, 2.0DHA, 2.0-DHS...)
+
+        :return: dict[int, float]. Dict with the average price by period
+        """
+        return self.aggregate_between_dates(start_date=start_date, end_date=end_date, location=location,
+                                            toll=toll).period_means()
+
+    def avg_price_between_dates_by_hour(self, start_date: date, end_date: date, location: str = 'PCB',
+                                        toll: str = '2.0TD') -> dict[int, float]:
+        """
+        Get the average price between 2 dates by hour
+
+        :param start_date: date. Start date of the range
+        :param end_date: date. End date of the range
+        :param location: str. Location of the data [PCB (Peninsula, Canarias, Baleares) or CYM (Ceuta, Melilla)]
+        :param toll: str. Toll of the data (2.0TD, 2.0A, 2.0DHA, 2.0-DHS...)
+
+        :return: dict[int, float]. Dict with the average price by hour
+        """
+        return self.aggregate_between_dates(start_date=start_date, end_date=end_date, location=location,
+                                            toll=toll).hourly_means()
+
+    def get_price_matrix(self, start_date: date, end_date: date, pairs: list[tuple[str, str]],
+                         fields: tuple[str, ...] = ('PVPC_price_kwh',)) -> PriceMatrix:
+        """
+        Get the hourly prices of many location/toll pairs between 2 dates as a single dense matrix
+
+        :param start_date: date. Start date of the range
+        :param end_date: date. End date of the range
+        :param pairs: list[tuple[str, str]]. (location, toll) pairs, as [('PCB', '2.0TD'), ('CYM', '2.0TD')...]
+        :param fields: tuple[str, ...]. Hourly fields (PVPC_price_kwh, TEU_charges_kwh, TCU_production_price_kwh)
+
+        :return: PriceMatrix. Matrix of shape (pair, day, hour) for each field, with the mask of missing days
+        """
+        matrix = PriceMatrix(pairs=pairs, start_date=start_date, end_date=end_date, fields=fields)
+        for location, toll in matrix.pairs:
+            matrix.fill(location=location, toll=toll,
+                        docs=self.get_days_between_dates(start_date=matrix.start_date, end_date=end_date,
+                                                         location=location, toll=toll))
+        return matrix
+
+
+def replicate(source: StorageBackend, target: StorageBackend, location_tolls: list[tuple[str, str]],
+              start_date: date | None = None, end_date: date | None = None,
+              chunk_days: int = REPLICATE_CHUNK_DAYS) -> int:
+    """
+    Mirror the BY_DAY documents of a backend into another one (Firestore into the local SQLite file, for example)
+
+    :param source: StorageBackend. Backend to read from
+    :param target: StorageBackend. Backend to write to. Days that already exist are replaced
+    :param location_tolls: list[tuple[str, str]]. (location, toll) pairs to replicate
+    :param start_date: date | None. Start date of the range. If None, the day after the last one in the target (or
+                        the first one in the source, if the target has none), so only new days are copied
+    :param end_date: date | None. End date of the range. If None, the last day in the source
+    :param chunk_days: int. Days read and written at once, to bound the memory used
+
+    :return: int. Number of days replicated
+    """
+    replicated = 0
+    for location, toll in location_tolls:
+        last_source_date = source.last_date(location=location, toll=toll)
+        if last_source_date is None:
+            continue
+        first = start_date
+        if first is None:
+            last_target_date = target.last_date(location=location, toll=toll)
+            first = last_target_date + timedelta(days=1) if last_target_date is not None else \
+                source.first_date(location=location, toll=toll)
+        last = end_date if end_date is not None else last_source_date
+        first = first.date() if isinstance(first, datetime) else first
+        last = last.date() if isinstance(last, datetime) else last
+        while first <= last:
+            chunk_end = min(first + timedelta(days=chunk_days - 1), last)
+            docs = source.get_days_between_dates(start_date=first, end_date=chunk_end, location=location, toll=toll)
+            if len(docs) > 0:
+                replicated += target.write_days(docs=docs)
+            first = chunk_end + timedelta(days=1)
+        logger.info(f"Replicated {location}/{toll} up to {last}")
+    return replicated
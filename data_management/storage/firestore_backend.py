@@ -0,0 +1,83 @@
+"""
+StorageBackend over Firestore. Writes go through FirebaseManager (hourly and daily documents, rollups) and queries
+through FirebaseQuerier, so it behaves exactly as the rest of the Firestore code
+"""
+
+from datetime import date, datetime
+
+import pandas as pd
+
+from data_management.constants import BY_DAY, PRICE_FIELDS, EXPECTED_DATE_FORMAT
+from data_management.firebase.aggregation import PriceAccumulator
+from data_management.firebase.batch_writer import BatchWriter
+from data_management.firebase.client_pool import get_client
+from data_management.firebase.encoding import decode_day
+from data_management.firebase.firebase_manager import FirebaseManager
+from data_management.firebase.firebase_querier import FirebaseQuerier
+from data_management.firebase.query_cache import default_query_cache
+from data_management.storage.base import StorageBackend
+from utils.utils import get_collection
+
+
+class FirestoreBackend(StorageBackend):
+    def __init__(self, client=None, manager: FirebaseManager | None = None, querier: FirebaseQuerier | None = None,
+                 use_cache: bool = False):
+        """
+        :param client: Firestore client to use. If None, the shared client of the process (see client_pool)
+        :param manager: FirebaseManager | None. Manager used to write. If None, one over the client (invalidating
+                        the default query cache, if the client is the shared one)
+        :param querier: FirebaseQuerier | None. Querier used to read. If None, one over the client
+        :param use_cache: bool. If True (and the client is the shared one), the querier created reads through the
+                        default query cache. False by default, so replication always reads the current data
+        """
+        self._shared_client = client is None
+        self.client = client if client is not None else get_client()
+        self._manager = manager
+        self.querier = querier if querier is not None else \
+            FirebaseQuerier(client=self.client, use_cache=use_cache,
+                            cache=default_query_cache() if use_cache and self._shared_client else None)
+
+    @property
+    def manager(self) -> FirebaseManager:
+        # Only created when writing, it loads the manifest of the data folder
+        if self._manager is None:
+            self._manager = FirebaseManager(client=self.client,
+                                            query_cache=default_query_cache() if self._shared_client else None)
+        return self._manager
+
+    def write_days(self, docs: list[dict]) -> int:
+        with BatchWriter(client=self.client) as writer:
+            for doc in docs:
+                doc = decode_day(doc=doc)
+                df = pd.DataFrame({'date': doc['date'], 'hour': range(24), 'toll': doc['toll'],
+                                   'period': list(doc['period']),
+                                   **{field: list(doc[field]) for field in PRICE_FIELDS}, 'location': doc['location']})
+                posted = self.manager.post_frame(df=df, location=doc['location'], toll=doc['toll'], skip_if_exist=False,
+                                                 writer=writer)
+                assert posted, f"Data for {doc['date']} {doc['location']}/{doc['toll']} was not posted successfully"
+        self.manager.flush()
+        return len(docs)
+
+    def get_days_between_dates(self, start_date: date, end_date: date, location: str = 'PCB',
+                               toll: str = '2.0TD') -> list[dict]:
+        return self.querier.get_days_between_dates(start_date=start_date, end_date=end_date, location=location,
+                                                   toll=toll)
+
+    def aggregate_between_dates(self, start_date: date, end_date: date, location: str = 'PCB', toll: str = '2.0TD',
+                                field: str = 'PVPC_price_kwh') -> PriceAccumulator:
+        return self.querier.aggregate_between_dates(start_date=start_date, end_date=end_date, location=location,
+                                                    toll=toll, field=field)
+
+    def first_date(self, location: str = 'PCB', toll: str = '2.0TD') -> date | None:
+        return self.__edge_date(location=location, toll=toll, direction='ASCENDING')
+
+    def last_date(self, location: str = 'PCB', toll: str = '2.0TD') -> date | None:
+        return self.__edge_date(location=location, toll=toll, direction='DESCENDING')
+
+    def __edge_date(self, location: str, toll: str, direction: str) -> date | None:
+        # Date of the first document of BY_DAY in the given order, reading only its date
+        collection_ref = get_collection(client=self.client, location=location, toll=toll, aggregation=BY_DAY)
+        query = collection_ref.order_by('datetime_spain', direction=direction).limit(1).select(['date']).stream()
+        for doc in query:
+            return datetime.strptime(doc.to_dict()['date'], EXPECTED_DATE_FORMAT).date()
+        return None
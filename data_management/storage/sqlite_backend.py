@@ -0,0 +1,193 @@
+"""
+Local StorageBackend over an embedded SQLite file, so the prices can be queried offline. Hourly rows and daily
+vectors are kept in 2 tables keyed by (location, toll, datetime_spain), and aggregations run as SQL queries over
+the primary key range instead of scanning documents over the network
+"""
+
+import os
+import sqlite3
+from datetime import date, datetime, timedelta
+from threading import Lock
+
+import numpy as np
+
+from data_management.constants import SQLITE_PATH, PRICE_FIELDS, EXPECTED_DATE_FORMAT
+from data_management.firebase.aggregation import PriceAccumulator
+from data_management.firebase.encoding import decode_day, day_fingerprint, period_pattern, FINGERPRINT_FIELD
+from data_management.storage.base import StorageBackend
+
+_DATETIME_FORMAT = '%Y-%m-%d %H:%M:%S'
+
+_SCHEMA = f"""
+CREATE TABLE IF NOT EXISTS hours (
+    location TEXT NOT NULL,
+    toll TEXT NOT NULL,
+    datetime_spain TEXT NOT NULL,
+    date TEXT NOT NULL,
+    hour INTEGER NOT NULL,
+    period INTEGER NOT NULL,
+    {', '.join(f'{field} REAL' for field in PRICE_FIELDS)},
+    PRIMARY KEY (location, toll, datetime_spain)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS days (
+    location TEXT NOT NULL,
+    toll TEXT NOT NULL,
+    datetime_spain TEXT NOT NULL,
+    date TEXT NOT NULL,
+    period_pattern TEXT NOT NULL,
+    {', '.join(f'{field} BLOB NOT NULL' for field in PRICE_FIELDS)},
+    fingerprint TEXT NOT NULL,
+    PRIMARY KEY (location, toll, datetime_spain)
+) WITHOUT ROWID;
+"""
+
+
+class SQLiteBackend(StorageBackend):
+    def __init__(self, path: str = SQLITE_PATH):
+        """
+        :param path: str. Path to the SQLite file. Created if it doesn't exist (':memory:' for a temporary one)
+        """
+        self.path = path
+        if path != ':memory:':
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        # A single connection shared by the threads, serialized by the lock
+        self.lock = Lock()
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        with self.lock, self.connection:
+            if path != ':memory:':
+                self.connection.execute('PRAGMA journal_mode=WAL')
+            self.connection.executescript(_SCHEMA)
+
+    def write_days(self, docs: list[dict]) -> int:
+        """
+        Write (or replace) the BY_DAY documents of some days in a single transaction. Each day is stored as its
+        vectors (float64 bytes, as the compact format) and as 24 hourly rows
+
+        :param docs: list[dict]. BY_DAY documents, in the compact or the original format
+
+        :return: int. Number of days written
+        """
+        day_rows, hour_rows = [], []
+        for doc in docs:
+            doc = decode_day(doc=doc)
+            day_start = datetime.strptime(doc['date'], EXPECTED_DATE_FORMAT)
+            values = np.array([doc[field] for field in PRICE_FIELDS], dtype='<f8')
+            periods = [int(period) for period in doc['period']]
+            assert values.shape == (len(PRICE_FIELDS), 24), f"Expected 24 hours per day, got {values.shape[1]}"
+            day_rows.append((doc['location'], doc['toll'], day_start.strftime(_DATETIME_FORMAT), doc['date'],
+                             ''.join(str(period) for period in periods), *(row.tobytes() for row in values),
+                             doc.get(FINGERPRINT_FIELD) or day_fingerprint(doc=doc)))
+            # Hours are the positions of the day vectors, as in the BY_DAY aggregations
+            hour_rows.extend((doc['location'], doc['toll'],
+                              (day_start + timedelta(hours=hour)).strftime(_DATETIME_FORMAT), doc['date'], hour,
+                              periods[hour], *values[:, hour].tolist()) for hour in range(24))
+        placeholders = ', '.join('?' * (5 + len(PRICE_FIELDS)))
+        with self.lock, self.connection:
+            self.connection.executemany(f"INSERT OR REPLACE INTO days VALUES ({placeholders}, ?)", day_rows)
+            self.connection.executemany(f"INSERT OR REPLACE INTO hours VALUES ({placeholders}, ?)", hour_rows)
+        return len(day_rows)
+
+    def get_days_between_dates(self, start_date: date, end_date: date, location: str = 'PCB',
+                               toll: str = '2.0TD') -> list[dict]:
+        """
+        Get the BY_DAY documents between 2 dates
+
+        :param start_date: date. Start date of the range
+        :param end_date: date. End date of the range
+        :param location: str. Location of the data [PCB (Peninsula, Canarias, Baleares) or CYM (Ceuta, Melilla)]
+        :param toll: str. Toll of the data (2.0TD, 2.0A, 2.0DHA, 2.0-DHS...)
+
+        :return: list[dict]. Documents of the days that exist, sorted by date. Hourly fields and 'period' are read
+                            only numpy arrays, as the decoded compact documents
+        """
+        with self.lock:
+            rows = self.connection.execute(
+                f"SELECT datetime_spain, date, period_pattern, {', '.join(PRICE_FIELDS)}, fingerprint FROM days "
+                f"WHERE location = ? AND toll = ? AND datetime_spain >= ? AND datetime_spain < ? "
+                f"ORDER BY datetime_spain", (location, toll, *self.__bounds(start_date=start_date, end_date=end_date))
+            ).fetchall()
+        docs = []
+        for datetime_spain, date_str, pattern, *values, fingerprint in rows:
+            doc = {'datetime_spain': datetime.strptime(datetime_spain, _DATETIME_FORMAT), 'date': date_str,
+                   'location': location, 'toll': toll, 'period': period_pattern(pattern=pattern),
+                   FINGERPRINT_FIELD: fingerprint}
+            for field, value in zip(PRICE_FIELDS, values[:len(PRICE_FIELDS)]):
+                doc[field] = np.frombuffer(value, dtype='<f8')
+            docs.append(doc)
+        return docs
+
+    def aggregate_between_dates(self, start_date: date, end_date: date, location: str = 'PCB', toll: str = '2.0TD',
+                                field: str = 'PVPC_price_kwh') -> PriceAccumulator:
+        """
+        Aggregate an hourly field between 2 dates, by hour and by period, with GROUP BY queries over the hourly rows
+
+        :param start_date: date. Start date of the range
+        :param end_date: date. End date of the range
+        :param location: str. Location of the data [PCB (Peninsula, Canarias, Baleares) or CYM (Ceuta, Melilla)]
+        :param toll: str. Toll of the data (2.0TD, 2.0A, 2.0DHA, 2.0-DHS...)
+        :param field: str. Hourly field to aggregate (PVPC_price_kwh, TEU_charges_kwh, TCU_production_price_kwh)
+
+        :return: PriceAccumulator. Sums, counts, minimums and maximums of the field by hour and by period
+        """
+        # Field names can't be query parameters, only known ones are accepted
+        assert field in PRICE_FIELDS, f"field must be one of {PRICE_FIELDS}, not {field}"
+        parameters = (location, toll, *self.__bounds(start_date=start_date, end_date=end_date))
+        where = "WHERE location = ? AND toll = ? AND datetime_spain >= ? AND datetime_spain < ?"
+        with self.lock:
+            by_hour = self.connection.execute(
+                f"SELECT hour, SUM({field}), COUNT({field}), MIN({field}), MAX({field}) FROM hours {where} "
+                f"GROUP BY hour", parameters).fetchall()
+            # In the order in which the periods first appear, as PriceAccumulator does
+            by_period = self.connection.execute(
+                f"SELECT period, SUM({field}), COUNT({field}), MIN({field}), MAX({field}) FROM hours {where} "
+                f"GROUP BY period ORDER BY MIN(datetime_spain)", parameters).fetchall()
+            days, first_pattern = self.connection.execute(
+                f"SELECT COUNT(*), (SELECT period_pattern FROM days {where} ORDER BY datetime_spain LIMIT 1) "
+                f"FROM days {where}", parameters * 2).fetchone()
+
+        accumulator = PriceAccumulator(field=field)
+        accumulator.days = days
+        for hour, price_sum, count, price_min, price_max in by_hour:
+            accumulator.hour_sums[hour], accumulator.hour_counts[hour] = price_sum, count
+            accumulator.hour_mins[hour], accumulator.hour_maxs[hour] = price_min, price_max
+        for period, price_sum, count, price_min, price_max in by_period:
+            accumulator.period_sums[period], accumulator.period_counts[period] = price_sum, count
+            accumulator.period_mins[period], accumulator.period_maxs[period] = price_min, price_max
+        if first_pattern is not None:
+            accumulator.periods_by_hour = [int(period) for period in first_pattern]
+        return accumulator
+
+    def first_date(self, location: str = 'PCB', toll: str = '2.0TD') -> date | None:
+        with self.lock:
+            first, = self.connection.execute("SELECT MIN(date) FROM days WHERE location = ? AND toll = ?",
+                                             (location, toll)).fetchone()
+        return datetime.strptime(first, EXPECTED_DATE_FORMAT).date() if first is not None else None
+
+    def last_date(self, location: str = 'PCB', toll: str = '2.0TD') -> date | None:
+        with self.lock:
+            last, = self.connection.execute("SELECT MAX(date) FROM days WHERE location = ? AND toll = ?",
+                                            (location, toll)).fetchone()
+        return datetime.strptime(last, EXPECTED_DATE_FORMAT).date() if last is not None else None
+
+    def location_tolls(self) -> list[tuple[str, str]]:
+        """
+        :return: list[tuple[str, str]]. Sorted list of the (location, toll) pairs stored
+        """
+        with self.lock:
+            return [tuple(row) for row in self.connection.execute(
+                "SELECT DISTINCT location, toll FROM days ORDER BY location, toll").fetchall()]
+
+    def close(self):
+        """
+        Close the connection to the file
+        """
+        with self.lock:
+            self.connection.close()
+
+    @staticmethod
+    def __bounds(start_date: date, end_date: date) -> tuple[str, str]:
+        # [start of the first day, start of the day after the last one), as datetime_spain strings
+        start_date = start_date.date() if isinstance(start_date, datetime) else start_date
+        end_date = end_date.date() if isinstance(end_date, datetime) else end_date
+        return (datetime.combine(start_date, datetime.min.time()).strftime(_DATETIME_FORMAT),
+                datetime.combine(end_date + timedelta(days=1), datetime.min.time()).strftime(_DATETIME_FORMAT))
@@ -0,0 +1,168 @@
+"""
+This class runs the incremental sync of the prices: it keeps a watermark with the last day ingested of each
+location/toll, and only downloads, parses and posts the days after the newest one (plus a look-back window, to pick
+up the revisions of ESIOS). Location/tolls that ESIOS stopped publishing are retired, so they never drag the sync
+back to their last day. Safe to run on a cron schedule: overlapping runs are prevented with a lock file, and the
+watermarks only move forward once the whole range was posted
+"""
+
+import json
+import os
+import time
+from datetime import date, datetime, timedelta
+
+from loguru import logger
+
+from data_management.constants import SYNC_STATE_PATH, SYNC_LOCK_PATH, SYNC_LOOKBACK_DAYS, SYNC_INITIAL_DATE, \
+    SYNC_LOCK_STALE_SECONDS, EXPECTED_DATE_FORMAT
+from data_management.pipeline import IngestPipeline
+
+
+class IncrementalSync:
+    def __init__(self, pipeline: IngestPipeline, state_path: str = SYNC_STATE_PATH, lock_path: str = SYNC_LOCK_PATH,
+                 lookback_days: int = SYNC_LOOKBACK_DAYS, initial_date: date = SYNC_INITIAL_DATE,
+                 lock_stale_seconds: float = SYNC_LOCK_STALE_SECONDS):
+        """
+        :param pipeline: IngestPipeline. Pipeline used to download, parse and post the days
+        :param state_path: str. Path to the json file where the watermarks are persisted
+        :param lock_path: str. Path to the lock file held while a sync is running
+        :param lookback_days: int. Days before the newest watermark that are synced again. Unchanged days are
+                                neither transferred (conditional requests) nor written (fingerprints), only checked.
+                                Location/tolls without days for longer than this are retired
+        :param initial_date: date. First day synced when there is no watermark yet
+        :param lock_stale_seconds: float. A lock older than this (or from a process that is not alive) is
+                                considered left behind by a crashed run, and is taken over
+        """
+        assert lookback_days >= 0, f"lookback_days can't be negative"
+        self.pipeline = pipeline
+        self.state_path = state_path
+        self.lock_path = lock_path
+        self.lookback_days = lookback_days
+        self.initial_date = initial_date
+        self.lock_stale_seconds = lock_stale_seconds
+        # Watermarks will have the format {<location>/<toll>: <last day ingested as EXPECTED_DATE_FORMAT>}
+        self.watermarks = {}
+        # Location/tolls that stopped being published, with the same format. They don't move the start of the sync
+        self.retired = {}
+        self.load()
+
+    def load(self):
+        """
+        Load the watermarks from disk, if they were persisted
+        """
+        if os.path.isfile(self.state_path):
+            with open(self.state_path, 'r') as f:
+                state = json.load(f)
+            self.watermarks, self.retired = state['watermarks'], state.get('retired', {})
+
+    def save(self):
+        """
+        Persist the watermarks (atomically, so a crash never leaves a corrupt state)
+        """
+        content = json.dumps({'watermarks': self.watermarks, 'retired': self.retired,
+                              'updated_at': datetime.now().isoformat()}, sort_keys=True)
+        os.makedirs(os.path.dirname(os.path.abspath(self.state_path)), exist_ok=True)
+        tmp_path = f"{self.state_path}.tmp"
+        with open(tmp_path, 'w') as f:
+            f.write(content)
+        os.replace(tmp_path, self.state_path)
+
+    def start_date(self) -> date:
+        """
+        :return: date. First day of the next sync: the day after the newest watermark, minus the look-back window
+        """
+        if len(self.watermarks) == 0:
+            return self.initial_date
+        newest = max(datetime.strptime(day, EXPECTED_DATE_FORMAT).date() for day in self.watermarks.values())
+        return max(self.initial_date, newest + timedelta(days=1 - self.lookback_days))
+
+    def run(self, end_date: date | None = None) -> dict[str, dict] | None:
+        """
+        Sync the days from start_date() to end_date, and move the watermarks forward
+
+        :param end_date: date | None. Last day to sync. If None, today
+
+        :return: dict[str, dict] | None. Stats of the pipeline, or None if another sync is running or there was
+                                        nothing to sync
+        """
+        if not self.__acquire_lock():
+            logger.warning(f"Another sync holds {self.lock_path}. Skipping")
+            return None
+        try:
+            self.load()
+            end_date = end_date if end_date is not None else date.today()
+            start_date = self.start_date()
+            if start_date > end_date:
+                logger.info(f"Nothing to sync, watermarks are at {self.watermarks}")
+                return None
+            logger.info(f"Syncing from {start_date} to {end_date}")
+            # Existing days are only written again if they changed
+            stats = self.pipeline.run(start_date=datetime.combine(start_date, datetime.min.time()),
+                                      end_date=datetime.combine(end_date, datetime.min.time()),
+                                      skip_if_exist=False, skip_unchanged=True)
+            # Only reached if the whole range was posted. Watermarks never move backwards
+            for location_toll, day in stats['last_days'].items():
+                # Published again, so it is not retired anymore
+                previous = self.retired.pop(location_toll, None) or self.watermarks.get(location_toll, day)
+                self.watermarks[location_toll] = max(day, previous)
+            self.__retire_stale()
+            self.save()
+            return stats
+        finally:
+            self.__release_lock()
+
+    def __retire_stale(self):
+        # Location/tolls left out of the look-back window of the newest one won't be synced again
+        if len(self.watermarks) == 0:
+            return
+        newest = max(self.watermarks.values())
+        oldest_kept = (datetime.strptime(newest, EXPECTED_DATE_FORMAT).date() -
+                       timedelta(days=self.lookback_days)).strftime(EXPECTED_DATE_FORMAT)
+        for location_toll, day in sorted(self.watermarks.items()):
+            if day < oldest_kept:
+                logger.warning(f"{location_toll} has no days after {day}, while others reach {newest}. Retiring it")
+                self.retired[location_toll] = self.watermarks.pop(location_toll)
+
+    def __acquire_lock(self) -> bool:
+        os.makedirs(os.path.dirname(os.path.abspath(self.lock_path)), exist_ok=True)
+        for _ in range(2):
+            try:
+                # Atomic creation, fails if the lock is already held
+                fd = os.open(self.lock_path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+            except FileExistsError:
+                if not self.__lock_is_stale():
+                    return False
+                logger.warning(f"Taking over the stale lock {self.lock_path}")
+                try:
+                    os.remove(self.lock_path)
+                except FileNotFoundError:
+                    pass
+                continue
+            with os.fdopen(fd, 'w') as f:
+                f.write(str(os.getpid()))
+            return True
+        return False
+
+    def __lock_is_stale(self) -> bool:
+        try:
+            age = time.time() - os.path.getmtime(self.lock_path)
+            with open(self.lock_path, 'r') as f:
+                pid = int(f.read().strip() or 0)
+        except (FileNotFoundError, ValueError):
+            return True
+        if age > self.lock_stale_seconds:
+            return True
+        try:
+            # Signal 0 only checks that the process exists
+            os.kill(pid, 0)
+        except ProcessLookupError:
+            return True
+        except (PermissionError, OSError):
+            return False
+        return False
+
+    def __release_lock(self):
+        try:
+            os.remove(self.lock_path)
+        except FileNotFoundError:
+            pass
@@ -1,27 +1,254 @@
+"""
+Command line interface. Every subcommand imports its own dependencies when it runs, so starting the CLI (or asking
+for --help) doesn't load pandas, numpy, the Firestore client or matplotlib.
+
+    python main.py download --start 2024-01-01 --end 2024-01-31
+    python main.py ingest --start 2024-01-01 --end 2024-01-31 [--skip-unchanged]
+    python main.py sync
+    python main.py replicate
+    python main.py query avg-by-hour --start 2023-06-01 --end 2023-06-30 [--format csv] [--plot hours.png]
+
+Results are written as json (or csv) to stdout or to --output. Logs and progress bars go to stderr.
+"""
+
+import argparse
+import csv
+import json
+import math
+import sys
 from datetime import datetime
 
-from data_management.firebase.firebase_manager import FirebaseManager
-from data_management.firebase.firebase_querier import FirebaseQuerier
-from data_management.prices_downloader import PricesDownloader
+from data_management.constants import EXPECTED_DATE_FORMAT, PRICE_FIELDS, SQLITE_PATH, PCB
 
-if __name__ == '__main__':
+QUERIES = ('avg-by-hour', 'avg-by-period', 'days')
+BACKENDS = ('firestore', 'sqlite')
+PROFILE_STAGES = ('download', 'parse', 'publish')
+
+
+def _date(value: str) -> datetime:
+    try:
+        return datetime.strptime(value, EXPECTED_DATE_FORMAT)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"Dates must be given as YYYY-MM-DD, not {value}")
+
+
+def _location_toll(value: str) -> tuple[str, str]:
+    location, separator, toll = value.partition('/')
+    if separator == '' or location == '' or toll == '':
+        raise argparse.ArgumentTypeError(f"Location/toll pairs must be given as <location>/<toll>, not {value}")
+    return location, toll
+
+
+def download(args: argparse.Namespace) -> dict:
+    from data_management.prices_downloader import PricesDownloader
+
+    with PricesDownloader() as downloader:
+        # A range must span at least 2 days
+        files = downloader.download_day(date=args.start) if args.start == args.end else \
+            downloader.download_prices_for_date_range(start_date=args.start, end_date=args.end)
+    return {'files': len(files)}
+
+
+def ingest(args: argparse.Namespace) -> dict:
+    from data_management.firebase.firebase_manager import FirebaseManager
+    from data_management.pipeline import IngestPipeline
+    from data_management.prices_downloader import PricesDownloader
+
+    with PricesDownloader() as downloader:
+        return IngestPipeline(downloader=downloader, firebase_manager=FirebaseManager(),
+                              write_csv=not args.no_csv).run(start_date=args.start, end_date=args.end,
+                                                             skip_if_exist=not (args.overwrite or args.skip_unchanged),
+                                                             skip_unchanged=args.skip_unchanged)
+
+
+def sync(args: argparse.Namespace) -> dict | None:
+    from data_management.firebase.firebase_manager import FirebaseManager
+    from data_management.pipeline import IngestPipeline
+    from data_management.prices_downloader import PricesDownloader
+    from data_management.sync import IncrementalSync
+
+    # Download, parse and post only the days after the last sync (and the look-back window, for revisions)
+    with PricesDownloader() as downloader:
+        return IncrementalSync(pipeline=IngestPipeline(downloader=downloader, firebase_manager=FirebaseManager(),
+                                                       write_csv=not args.no_csv)).run(
+            end_date=args.end.date() if args.end is not None else None)
+
+
+def replicate(args: argparse.Namespace) -> dict:
+    from data_management.storage.base import replicate as replicate_backend
+    from data_management.storage.firestore_backend import FirestoreBackend
+    from data_management.storage.sqlite_backend import SQLiteBackend
+
+    target = SQLiteBackend(path=args.sqlite_path)
+    try:
+        days = replicate_backend(source=FirestoreBackend(), target=target, location_tolls=args.pairs,
+                                 start_date=args.start, end_date=args.end)
+    finally:
+        target.close()
+    return {'days': days}
+
+
+def query(args: argparse.Namespace) -> dict | list[dict]:
+    if args.backend == 'sqlite':
+        from data_management.storage.sqlite_backend import SQLiteBackend
+        backend = SQLiteBackend(path=args.sqlite_path)
+    else:
+        from data_management.storage.firestore_backend import FirestoreBackend
+        backend = FirestoreBackend(use_cache=not args.no_cache)
+
+    if args.query == 'days':
+        docs = backend.get_days_between_dates(start_date=args.start, end_date=args.end, location=args.location,
+                                              toll=args.toll)
+        # One row per hour, as the csv files
+        return [{'date': doc['date'], 'hour': hour, 'period': int(doc['period'][hour]),
+                 **{field: float(doc[field][hour]) for field in PRICE_FIELDS}}
+                for doc in docs for hour in range(len(doc['period']))]
+
+    accumulator = backend.aggregate_between_dates(start_date=args.start, end_date=args.end, location=args.location,
+                                                  toll=args.toll, field=args.field)
+    if args.query == 'avg-by-period':
+        return {int(period): float(price) for period, price in accumulator.period_means().items()}
+    prices_by_hour = {int(hour): float(price) for hour, price in accumulator.hourly_means().items()}
+    if args.plot is not None:
+        from utils.plots import plot_avg_price_by_hour
+        plot_avg_price_by_hour(prices_by_hour=prices_by_hour, periods_by_hour=accumulator.periods_by_hour,
+                               plot_path=args.plot)
+    return prices_by_hour
 
+
+def _without_nan(value):
+    # Hours and periods without data average to NaN, which is not valid json
+    if isinstance(value, dict):
+        return {key: _without_nan(inner) for key, inner in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [_without_nan(inner) for inner in value]
+    return None if isinstance(value, float) and math.isnan(value) else value
+
+
+def write_result(result, output_format: str, key_name: str, value_name: str, file):
+    """
+    Write the result of a subcommand. NaN values (hours or periods without data) are written as null in json and
+    as empty cells in csv
+
+    :param result: dict | list[dict] | None. Result to write. Dicts of scalars are written as 2 columns in csv
+    :param output_format: str. 'json' or 'csv'
+    :param key_name: str. Header of the keys column, for dicts of scalars written as csv
+    :param value_name: str. Header of the values column, for dicts of scalars written as csv
+    :param file: File object to write to
+    """
+    result = _without_nan(result)
+    if output_format == 'json' or result is None:
+        json.dump(result, file, indent=2, default=str, allow_nan=False)
+        file.write('\n')
+        return
+    if isinstance(result, dict):
+        rows = []
+        for key, value in result.items():
+            # Nested stats don't fit in a table, they are flattened as <section>.<name>
+            if isinstance(value, dict):
+                rows.extend({key_name: f"{key}.{name}", value_name: inner} for name, inner in value.items())
+            else:
+                rows.append({key_name: key, value_name: value})
+        result = rows
+    writer = csv.DictWriter(file, fieldnames=list(result[0].keys()) if len(result) > 0 else [key_name, value_name],
+                            lineterminator='\n')
+    writer.writeheader()
+    writer.writerows(result)
+
+
+def build_parser() -> argparse.ArgumentParser:
     """
-    prices_downloader = PricesDownloader()
-    date = datetime.now()
-    date = datetime(year=2022, month=1, day=1)
-    past_date = datetime(year=2020, month=1, day=1) #date - timedelta(days=10)
-    paths = prices_downloader.download_prices_for_date_range(start_date=past_date, end_date=date)
+    :return: argparse.ArgumentParser. Parser of the command line, with one subparser per subcommand
     """
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--format', choices=('json', 'csv'), default='json', help="Format of the result")
+    parser.add_argument('--output', default=None, help="File to write the result to. Default: stdout")
+    parser.add_argument('--metrics', default=None,
+                        help="Collect metrics and write them to this file (json if it ends in .json, else Prometheus)")
+    parser.add_argument('--profile-stage', choices=PROFILE_STAGES, default=None,
+                        help="Profile a pipeline stage with cProfile (written to the profiles folder)")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    download_parser = subparsers.add_parser('download', help="Download and parse the ESIOS files of a date range")
+    download_parser.set_defaults(function=download)
+
+    ingest_parser = subparsers.add_parser('ingest', help="Download, parse and post a date range to Firestore")
+    ingest_parser.add_argument('--no-csv', action='store_true', help="Don't write the csv files")
+    write_mode = ingest_parser.add_mutually_exclusive_group()
+    write_mode.add_argument('--overwrite', action='store_true', help="Write again the days that already exist")
+    write_mode.add_argument('--skip-unchanged', action='store_true',
+                            help="Write again only the existing days whose content changed")
+    ingest_parser.set_defaults(function=ingest)
+
+    sync_parser = subparsers.add_parser('sync', help="Ingest the days after the last sync (and the look-back window)")
+    sync_parser.add_argument('--no-csv', action='store_true', help="Don't write the csv files")
+    sync_parser.set_defaults(function=sync)
+
+    replicate_parser = subparsers.add_parser('replicate', help="Copy the Firestore days to the local SQLite file")
+    replicate_parser.add_argument('--pairs', type=_location_toll, nargs='+', default=[(PCB, '2.0TD')],
+                                  help="Location/toll pairs to copy, as PCB/2.0TD")
+    replicate_parser.add_argument('--sqlite-path', default=SQLITE_PATH, help="SQLite file")
+    replicate_parser.set_defaults(function=replicate)
 
-    date = datetime.now()
-    past_date = datetime(year=2020, month=1, day=1) #date - timedelta(days=10)
-    firebase_manager = FirebaseManager()
-    firebase_manager.post_for_date_range(start_date=past_date, end_date=date)
+    query_parser = subparsers.add_parser('query', help="Query the stored prices")
+    query_parser.add_argument('query', choices=QUERIES, help="Average price by hour or period, or the hourly prices")
+    query_parser.add_argument('--location', default=PCB, help="Location (PCB or CYM)")
+    query_parser.add_argument('--toll', default='2.0TD', help="Toll (2.0TD, 2.0A, 2.0DHA...)")
+    query_parser.add_argument('--field', choices=PRICE_FIELDS, default='PVPC_price_kwh', help="Price to average")
+    query_parser.add_argument('--backend', choices=BACKENDS, default='firestore', help="Where the prices are read")
+    query_parser.add_argument('--sqlite-path', default=SQLITE_PATH, help="SQLite file of the sqlite backend")
+    query_parser.add_argument('--no-cache', action='store_true', help="Don't use the query cache of Firestore")
+    query_parser.add_argument('--plot', default=None,
+                              help="Write the plot of avg-by-hour to this file (png, svg, pdf...), without a display")
+    query_parser.set_defaults(function=query)
 
+    # Date ranges: mandatory to download, ingest and query. Sync and replicate find their own start
+    for subparser, required in ((download_parser, True), (ingest_parser, True), (query_parser, True),
+                                (sync_parser, False), (replicate_parser, False)):
+        if subparser is not sync_parser:
+            subparser.add_argument('--start', type=_date, required=required, help="First day, as YYYY-MM-DD")
+        subparser.add_argument('--end', type=_date, required=required,
+                               help="Last day, as YYYY-MM-DD" + ("" if required else ". Default: the last available"))
+    return parser
 
-    date = datetime.now()
-    past_date = datetime(year=2023, month=6, day=1) #date - timedelta(days=10)
-    firebase_querier = FirebaseQuerier()
-    data = firebase_querier.avg_price_between_dates_by_hour(start_date=past_date, end_date=date)
-    print(data)
+
+def main(argv: list[str] | None = None) -> int:
+    """
+    Run the CLI
+
+    :param argv: list[str] | None. Arguments. If None, the ones of the process
+
+    :return: int. Exit code
+    """
+    args = build_parser().parse_args(argv)
+    if getattr(args, 'start', None) is not None and args.end is not None and args.start > args.end:
+        raise SystemExit(f"--start must be before --end")
+    collect_metrics = args.metrics is not None or args.profile_stage is not None
+    if collect_metrics:
+        from utils.metrics import metrics
+        metrics.enable(profile_stage=args.profile_stage)
+
+    result = args.function(args)
+
+    # Averages are written as <hour|period>,<field> columns in csv
+    key_name = {'avg-by-hour': 'hour', 'avg-by-period': 'period'}.get(getattr(args, 'query', None), 'name')
+    value_name = args.field if key_name != 'name' else 'value'
+    if args.output is None:
+        write_result(result=result, output_format=args.format, key_name=key_name, value_name=value_name,
+                     file=sys.stdout)
+    else:
+        with open(args.output, 'w', newline='') as file:
+            write_result(result=result, output_format=args.format, key_name=key_name, value_name=value_name,
+                         file=file)
+
+    if collect_metrics:
+        if args.metrics is not None and args.metrics.endswith('.json'):
+            metrics.write_json(path=args.metrics)
+        elif args.metrics is not None:
+            metrics.write_prometheus(path=args.metrics)
+        metrics.write_profile()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,91 @@
+from datetime import date, timedelta
+
+import pytest
+
+np = pytest.importorskip('numpy')
+pd = pytest.importorskip('pandas')
+pytest.importorskip('firebase_admin')
+
+from benchmarks.memory_client import MemoryClient
+from data_management.constants import PRICE_FIELDS
+from data_management.firebase.aggregation import PriceAccumulator
+from data_management.firebase.firebase_manager import FirebaseManager
+from data_management.firebase.firebase_querier import FirebaseQuerier
+from data_management.firebase.query_cache import QueryCache
+from data_management.manifest import DataManifest
+from data_management.storage.sqlite_backend import SQLiteBackend
+
+# 70 days starting with 2 whole months, on a weekday (periods 3, 2, 1 in the order they appear)
+START_DATE, DAYS = date(2023, 2, 1), 70
+END_DATE = START_DATE + timedelta(days=DAYS - 1)
+WEEKDAY_PERIODS, WEEKEND_PERIODS = [3] * 8 + [2] * 4 + [1] * 4 + [2] * 4 + [1] * 4, [3] * 24
+# Running sums add the days in a different order than np.mean, so the last bits of the averages can differ
+TOLERANCE = 1e-12
+
+
+def day_doc(day: date, rng) -> dict:
+    return {'date': day.strftime('%Y-%m-%d'), 'location': 'PCB', 'toll': '2.0TD',
+            'period': WEEKDAY_PERIODS if day.weekday() < 5 else WEEKEND_PERIODS,
+            **{field: list(np.round(rng.uniform(0.01, 0.3, size=24), 4)) for field in PRICE_FIELDS}}
+
+
+@pytest.fixture(scope='module')
+def stored(tmp_path_factory):
+    rng = np.random.default_rng(seed=0)
+    docs = [day_doc(day=START_DATE + timedelta(days=i), rng=rng) for i in range(DAYS)]
+    client = MemoryClient()
+    manager = FirebaseManager(client=client, manifest=DataManifest(data_folder=str(tmp_path_factory.mktemp('data'))))
+    for doc in docs:
+        df = pd.DataFrame({'date': doc['date'], 'hour': range(24), 'toll': '2.0TD', 'period': doc['period'],
+                           **{field: doc[field] for field in PRICE_FIELDS}, 'location': 'PCB'})
+        assert manager.post_frame(df=df, location='PCB', toll='2.0TD', skip_if_exist=False)
+    manager.flush()
+    sqlite = SQLiteBackend(path=':memory:')
+    sqlite.write_days(docs=docs)
+    return docs, client, sqlite
+
+
+def expected_by_period(docs: list[dict]) -> dict[int, float]:
+    prices, periods = np.array([doc['PVPC_price_kwh'] for doc in docs]), np.array([doc['period'] for doc in docs])
+    return {period: np.mean(prices[periods == period]) for period in (3, 2, 1)}
+
+
+def test_periods_keep_the_order_they_are_first_seen(stored, tmp_path):
+    docs, client, sqlite = stored
+    raw = FirebaseQuerier(client=client, use_cache=False, use_rollups=False)
+    rollups = FirebaseQuerier(client=client, use_cache=False, use_rollups=True)
+    cached = FirebaseQuerier(client=client, cache=QueryCache(path=str(tmp_path / 'cache.json')))
+    results = [raw.avg_price_between_dates_by_period(start_date=START_DATE, end_date=END_DATE),
+               rollups.avg_price_between_dates_by_period(start_date=START_DATE, end_date=END_DATE),
+               cached.avg_price_between_dates_by_period(start_date=START_DATE, end_date=END_DATE),
+               cached.avg_price_between_dates_by_period(start_date=START_DATE, end_date=END_DATE),
+               sqlite.avg_price_between_dates_by_period(start_date=START_DATE, end_date=END_DATE)]
+    for result in results:
+        assert list(result) == [3, 2, 1]
+        assert result == pytest.approx(expected_by_period(docs=docs), rel=TOLERANCE)
+
+
+def test_hourly_means_match_np_mean(stored):
+    docs, client, sqlite = stored
+    expected = {hour: np.mean([doc['PVPC_price_kwh'][hour] for doc in docs]) for hour in range(24)}
+    for use_rollups in (False, True):
+        querier = FirebaseQuerier(client=client, use_cache=False, use_rollups=use_rollups)
+        assert querier.avg_price_between_dates_by_hour(start_date=START_DATE, end_date=END_DATE) == \
+               pytest.approx(expected, rel=TOLERANCE)
+    assert sqlite.avg_price_between_dates_by_hour(start_date=START_DATE, end_date=END_DATE) == \
+           pytest.approx(expected, rel=TOLERANCE)
+
+
+def test_statistics_round_trip_keeps_the_period_order():
+    rng = np.random.default_rng(seed=1)
+    accumulator = PriceAccumulator().add_all(docs=[day_doc(day=date(2023, 1, 14), rng=rng),
+                                                   day_doc(day=date(2023, 1, 16), rng=rng)])
+    statistics = accumulator.to_dict()
+    restored = PriceAccumulator.from_dict(statistics=statistics)
+    assert list(restored.period_means()) == list(accumulator.period_means()) == [3, 2, 1]
+    assert restored.to_dict() == statistics
+
+    # Rollups written without period_order follow the first day, then the rest of periods
+    del statistics['period_order']
+    statistics['period_sum'] = dict(sorted(statistics['period_sum'].items()))
+    assert list(PriceAccumulator.from_dict(statistics=statistics).period_means()) == [3, 1, 2]
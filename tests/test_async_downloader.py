@@ -0,0 +1,63 @@
+from datetime import date, timedelta
+
+import pytest
+
+pytest.importorskip('aiohttp')
+pytest.importorskip('openpyxl')
+
+from benchmarks.esios_stand_in import EsiosStandIn
+from data_management.async_downloader import AsyncDownloadEngine
+from data_management.constants import EXPECTED_DATE_FORMAT
+
+START_DATE = date(2023, 1, 1)
+DAYS = 12
+MAX_IN_FLIGHT = 3
+MAX_RETRIES = 2
+
+
+def download(stand_in: EsiosStandIn) -> tuple[dict, dict]:
+    engine = AsyncDownloadEngine(max_in_flight=MAX_IN_FLIGHT, requests_per_second=0, max_retries=MAX_RETRIES,
+                                 backoff_seconds=0.01, timeout_seconds=10)
+    date_strs = [(START_DATE + timedelta(days=i)).strftime(EXPECTED_DATE_FORMAT) for i in range(DAYS)]
+    responses = {}
+
+    def on_response(date_str: str, response):
+        assert date_str not in responses, f"{date_str} answered twice"
+        responses[date_str] = response
+
+    stats = engine.run(requests=((date_str, stand_in.url.format(date=date_str), None) for date_str in date_strs),
+                       on_response=on_response)
+    return responses, stats
+
+
+def test_every_day_is_downloaded_within_the_window():
+    with EsiosStandIn(latency_seconds=0.05) as stand_in:
+        responses, stats = download(stand_in=stand_in)
+
+    assert len(responses) == DAYS and stats['failed'] == []
+    assert all(response.status == 200 and len(response.body) > 0 for response in responses.values())
+    assert stand_in.max_in_flight <= MAX_IN_FLIGHT
+    assert stats['requests'] == DAYS and stats['retries'] == 0
+
+
+def test_throttled_and_server_errors_are_retried():
+    statuses = {'2023-01-02': [429], '2023-01-05': [503, 500], '2023-01-09': [502]}
+    with EsiosStandIn(latency_seconds=0.02, statuses=statuses) as stand_in:
+        responses, stats = download(stand_in=stand_in)
+
+    assert len(responses) == DAYS and stats['failed'] == []
+    assert stats['retries'] == 4
+    assert stand_in.requests_by_date['2023-01-05'] == 3
+    assert stand_in.max_in_flight <= MAX_IN_FLIGHT
+
+
+def test_permanent_failures_are_reported():
+    # Retryable statuses beyond the retries, and a status that is never retried
+    statuses = {'2023-01-03': [503] * (MAX_RETRIES + 1), '2023-01-07': [404]}
+    with EsiosStandIn(statuses=statuses) as stand_in:
+        responses, stats = download(stand_in=stand_in)
+
+    assert sorted(stats['failed']) == ['2023-01-03', '2023-01-07']
+    assert len(responses) == DAYS - 2 and '2023-01-03' not in responses
+    assert stand_in.requests_by_date['2023-01-03'] == MAX_RETRIES + 1
+    assert stand_in.requests_by_date['2023-01-07'] == 1
@@ -0,0 +1,125 @@
+from datetime import date, timedelta
+
+import pytest
+
+np = pytest.importorskip('numpy')
+pytest.importorskip('pandas')
+
+from analysis.backtesting import BillBacktester
+from data_management.constants import PRICE_FIELDS
+from data_management.price_cube import PriceCube
+from data_management.price_matrix import PriceMatrix
+
+# A range across 2 months, with a day missing for the second pair
+START_DATE, DAYS = date(2023, 1, 29), 6
+PAIRS = [('PCB', '2.0TD'), ('CYM', '2.0TD')]
+MISSING_DAY = 2
+PROFILES = 5
+
+
+def price_docs(seed: int, skip: int | None = None) -> list[dict]:
+    rng = np.random.default_rng(seed=seed)
+    return [{'date': (START_DATE + timedelta(days=day)).strftime('%Y-%m-%d'),
+             **{field: list(rng.uniform(0.01, 0.3, size=24)) for field in PRICE_FIELDS}}
+            for day in range(DAYS) if day != skip]
+
+
+def price_matrix() -> PriceMatrix:
+    matrix = PriceMatrix(pairs=PAIRS, start_date=START_DATE, end_date=START_DATE + timedelta(days=DAYS - 1),
+                         fields=PRICE_FIELDS)
+    matrix.fill(location='PCB', toll='2.0TD', docs=price_docs(seed=0))
+    matrix.fill(location='CYM', toll='2.0TD', docs=price_docs(seed=1, skip=MISSING_DAY))
+    return matrix
+
+
+def brute_force(prices: PriceMatrix, consumption: np.ndarray) -> dict[str, np.ndarray]:
+    # Bill hour by hour, grouped by the month of each day
+    months = sorted({day.astype('datetime64[M]') for day in prices.dates})
+    bills = {name: np.zeros((len(consumption), len(prices.pairs), len(months)))
+             for name in ('energy', 'teu', 'tcu', 'covered_kwh')}
+    kwh = np.zeros((len(consumption), len(months)))
+    for profile in range(len(consumption)):
+        for day, day_date in enumerate(prices.dates):
+            month = months.index(day_date.astype('datetime64[M]'))
+            for hour in range(24):
+                kwh_hour = consumption[profile, day, hour]
+                kwh[profile, month] += kwh_hour
+                for pair in range(len(prices.pairs)):
+                    if prices.missing[pair, day]:
+                        continue
+                    bills['energy'][profile, pair, month] += kwh_hour * prices['PVPC_price_kwh'][pair, day, hour]
+                    bills['teu'][profile, pair, month] += kwh_hour * prices['TEU_charges_kwh'][pair, day, hour]
+                    bills['tcu'][profile, pair, month] += kwh_hour * prices['TCU_production_price_kwh'][pair, day, hour]
+                    bills['covered_kwh'][profile, pair, month] += kwh_hour
+    return {**bills, 'kwh': kwh, 'months': np.array(months).astype('datetime64[D]')}
+
+
+@pytest.mark.parametrize('chunk_size', [1, 2, 100])
+def test_bills_match_an_hourly_loop(chunk_size: int):
+    prices = price_matrix()
+    consumption = np.random.default_rng(seed=2).uniform(0, 2, size=(PROFILES, DAYS, 24))
+    expected = brute_force(prices=prices, consumption=consumption)
+    backtester = BillBacktester(prices=prices)
+
+    result = backtester.run(consumption=consumption, chunk_size=chunk_size)
+    for name in ('energy', 'teu', 'tcu', 'covered_kwh'):
+        assert getattr(result, name) == pytest.approx(expected[name].sum(axis=2))
+    assert result.kwh == pytest.approx(expected['kwh'].sum(axis=1))
+    assert list(result.missing_days) == [0, 1]
+    # The day without prices is not billed
+    assert (result.covered_kwh[:, 1] < result.kwh).all() and result.covered_kwh[:, 0] == pytest.approx(result.kwh)
+
+    by_month = backtester.run(consumption=consumption.reshape(PROFILES, -1), by_month=True, chunk_size=chunk_size)
+    assert list(by_month.months) == list(expected['months'])
+    for name in ('energy', 'teu', 'tcu', 'covered_kwh', 'kwh'):
+        assert getattr(by_month, name) == pytest.approx(expected[name])
+
+
+def test_cheapest_pairs_and_frame():
+    prices = price_matrix()
+    consumption = np.random.default_rng(seed=3).uniform(0, 2, size=(PROFILES, DAYS * 24))
+    expected = brute_force(prices=prices, consumption=consumption.reshape(PROFILES, DAYS, 24))
+    totals = expected['energy'].sum(axis=2)
+    backtester = BillBacktester(prices=prices)
+
+    for by_month in (False, True):
+        result = backtester.run(consumption=consumption, by_month=by_month)
+        assert result.cheapest_pairs() == [PAIRS[pair] for pair in np.argmin(totals, axis=1)]
+
+    frame = backtester.run(consumption=consumption, by_month=True).to_frame()
+    assert len(frame) == PROFILES * len(PAIRS) * 2
+    row = frame[(frame['profile'] == 1) & (frame['location'] == 'CYM') &
+                (frame['month'] == np.datetime64('2023-02-01'))].iloc[0]
+    assert row['energy'] == pytest.approx(expected['energy'][1, 1, 1])
+    assert row['kwh'] == pytest.approx(expected['kwh'][1, 1])
+    frame = backtester.run(consumption=consumption).to_frame()
+    assert list(frame.columns) == ['profile', 'location', 'toll', 'kwh', 'covered_kwh', 'energy', 'teu', 'tcu']
+    assert frame['tcu'].to_numpy() == pytest.approx(expected['tcu'].sum(axis=2).reshape(-1))
+
+
+def test_backtester_sources(tmp_path):
+    expected = price_matrix()
+
+    class MatrixBackend:
+        def get_price_matrix(self, start_date: date, end_date: date, pairs: list[tuple[str, str]],
+                             fields: tuple[str, ...]) -> PriceMatrix:
+            assert (start_date, end_date, pairs, tuple(fields)) == \
+                   (START_DATE, START_DATE + timedelta(days=DAYS - 1), PAIRS, PRICE_FIELDS)
+            return expected
+
+    backtester = BillBacktester.from_backend(backend=MatrixBackend(), start_date=START_DATE,
+                                             end_date=START_DATE + timedelta(days=DAYS - 1), pairs=PAIRS)
+    assert backtester.prices is expected
+
+    cube = PriceCube(folder=str(tmp_path))
+    for (location, toll), seed, skip in zip(PAIRS, (0, 1), (None, MISSING_DAY)):
+        for doc in price_docs(seed=seed, skip=skip):
+            values = np.column_stack([doc[field] for field in PRICE_FIELDS] + [np.ones(24)])
+            cube.write_day(day=date.fromisoformat(doc['date']), location=location, toll=toll, values=values)
+    cube.save()
+    backtester = BillBacktester.from_price_cube(cube=cube, start_date=START_DATE,
+                                                end_date=START_DATE + timedelta(days=DAYS - 1), pairs=PAIRS)
+    assert (backtester.prices.missing == expected.missing).all()
+    consumption = np.ones((1, DAYS * 24))
+    assert backtester.run(consumption=consumption).energy == \
+           pytest.approx(BillBacktester(prices=expected).run(consumption=consumption).energy)
@@ -0,0 +1,143 @@
+import time
+from threading import Lock
+
+import pytest
+
+pytest.importorskip('firebase_admin')
+
+from google.api_core.exceptions import ServiceUnavailable, InvalidArgument
+
+from benchmarks.memory_client import MemoryClient
+from data_management.firebase import batch_writer
+from data_management.firebase.batch_writer import BatchWriter
+
+
+class RecordingClient(MemoryClient):
+    def __init__(self, failing_commits: set[int] = frozenset(), error: type = ServiceUnavailable,
+                 commit_seconds: float = 0.0):
+        """
+        MemoryClient that records the documents of every committed batch and the commits running at the same time.
+        The commits with the given numbers (counting from 1) fail with error
+        """
+        super().__init__()
+        self.failing_commits, self.error, self.commit_seconds = failing_commits, error, commit_seconds
+        self.commits, self.committed_batches = 0, []
+        self.in_flight, self.max_in_flight = 0, 0
+        self._record_lock = Lock()
+
+    def batch(self):
+        batch = super().batch()
+        commit = batch.commit
+
+        def recording_commit() -> list:
+            with self._record_lock:
+                self.commits += 1
+                number = self.commits
+                self.in_flight += 1
+                self.max_in_flight = max(self.max_in_flight, self.in_flight)
+            try:
+                if self.commit_seconds > 0:
+                    time.sleep(self.commit_seconds)
+                if number in self.failing_commits:
+                    raise self.error(f"Commit {number} failed")
+                paths = [reference.path for _, reference, _, _ in batch._writes]
+                writes = commit()
+                with self._record_lock:
+                    self.committed_batches.append(paths)
+                return writes
+            finally:
+                with self._record_lock:
+                    self.in_flight -= 1
+
+        batch.commit = recording_commit
+        return batch
+
+
+def stored(client: MemoryClient) -> dict[str, dict]:
+    return client._documents('docs')
+
+
+def test_writes_are_committed_in_full_batches():
+    client = RecordingClient()
+    with BatchWriter(client=client) as writer:
+        for i in range(1201):
+            writer.set(doc_ref=client.collection('docs').document(f"{i:04d}"), data={'i': i})
+        writer.delete(doc_ref=client.collection('docs').document('0000'))
+        stats = writer.flush()
+    assert sorted(len(batch) for batch in client.committed_batches) == [202, 500, 500]
+    assert len(stored(client=client)) == 1200 and '0000' not in stored(client=client)
+    assert (stats['writes'], stats['batches'], stats['retries']) == (1202, 3, 0)
+    assert stats['elapsed_seconds'] > 0 and stats['writes_per_second'] > 0
+
+    with pytest.raises(AssertionError):
+        BatchWriter(client=client, batch_size=501)
+
+
+def test_in_flight_batches_are_bounded():
+    client = RecordingClient(commit_seconds=0.02)
+    with BatchWriter(client=client, batch_size=5, max_in_flight=2) as writer:
+        for i in range(50):
+            writer.set(doc_ref=client.collection('docs').document(f"{i:02d}"), data={'i': i})
+    assert client.max_in_flight == 2
+    assert len(client.committed_batches) == 10 and len(stored(client=client)) == 50
+
+
+def test_retryable_failures_are_retried_with_backoff(monkeypatch):
+    waits = []
+    monkeypatch.setattr(batch_writer.time, 'sleep', waits.append)
+    client = RecordingClient(failing_commits={1, 2})
+    with BatchWriter(client=client, max_retries=2, backoff_seconds=0.1) as writer:
+        writer.set(doc_ref=client.collection('docs').document('a'), data={'a': 1})
+        stats = writer.flush()
+    assert stats['retries'] == 2 and stats['batches'] == 1 and 'a' in stored(client=client)
+    # Doubled on each retry, with a jitter of +-50%
+    assert 0.05 <= waits[0] <= 0.15 and 0.1 <= waits[1] <= 0.3
+
+    # Once the retries run out, the error is raised by flush
+    client = RecordingClient(failing_commits={1, 2})
+    writer = BatchWriter(client=client, max_retries=1, backoff_seconds=0.1)
+    writer.set(doc_ref=client.collection('docs').document('a'), data={'a': 1})
+    with pytest.raises(ServiceUnavailable):
+        writer.close()
+    assert stored(client=client) == {}
+
+
+def test_other_errors_are_not_retried(monkeypatch):
+    monkeypatch.setattr(batch_writer.time, 'sleep', lambda seconds: None)
+    client = RecordingClient(failing_commits={1}, error=InvalidArgument)
+    writer = BatchWriter(client=client, max_retries=3)
+    writer.set(doc_ref=client.collection('docs').document('a'), data={'a': 1})
+    with pytest.raises(InvalidArgument):
+        writer.close()
+    assert client.commits == 1 and writer.stats['retries'] == 0
+
+
+def test_groups_are_never_split_across_batches():
+    client = RecordingClient()
+    docs = client.collection('docs')
+    with BatchWriter(client=client, batch_size=10) as writer:
+        for i in range(7):
+            writer.set(doc_ref=docs.document(f"loose-{i}"), data={'i': i})
+        with writer.group():
+            for i in range(5):
+                writer.delete(doc_ref=docs.document(f"group-{i}"))
+                writer.set(doc_ref=docs.document(f"group-{i}"), data={'i': i})
+        # Nothing of a group that raises is written
+        with pytest.raises(ValueError):
+            with writer.group():
+                writer.set(doc_ref=docs.document('failed'), data={})
+                raise ValueError
+        with pytest.raises(AssertionError):
+            with writer.group():
+                for i in range(11):
+                    writer.set(doc_ref=docs.document(f"too-big-{i}"), data={})
+        with pytest.raises(AssertionError):
+            with writer.group():
+                with writer.group():
+                    pass
+
+    group_batches = [batch for batch in client.committed_batches if any('group' in path for path in batch)]
+    # The group doesn't fit with the 7 pending writes, so they go first. Its delete and set of a document collapse
+    assert len(group_batches) == 1 and len(group_batches[0]) == 5
+    assert sorted(len(batch) for batch in client.committed_batches) == [5, 7]
+    assert set(stored(client=client)) == {f"loose-{i}" for i in range(7)} | {f"group-{i}" for i in range(5)}
@@ -0,0 +1,92 @@
+import io
+import json
+import subprocess
+import sys
+from datetime import date, timedelta
+
+import pytest
+
+import main
+from benchmarks.bench_cli_startup import HEAVY_MODULES, ROOT_FOLDER
+from data_management.constants import PRICE_FIELDS
+
+
+def loaded_heavy_modules(code: str) -> list[str]:
+    # Run the code in a fresh interpreter and list the heavy modules it loaded (stdout is left for the help)
+    code = f"{code}\nimport sys\nprint(','.join(m for m in {HEAVY_MODULES!r} if m in sys.modules), file=sys.stderr)"
+    lines = subprocess.run([sys.executable, '-c', code], cwd=ROOT_FOLDER, check=True, capture_output=True,
+                           text=True).stderr.strip().splitlines()
+    return [module for module in lines[-1].split(',') if module] if len(lines) > 0 else []
+
+
+def test_building_the_parser_loads_no_heavy_module():
+    assert loaded_heavy_modules(code='import main\nmain.build_parser()') == []
+
+
+@pytest.mark.parametrize('arguments', [['--help'], ['query', '--help'], ['ingest', '--help']])
+def test_help_loads_no_heavy_module(arguments: list[str]):
+    code = f"import main\ntry:\n    main.main({arguments!r})\nexcept SystemExit as e:\n    assert e.code == 0"
+    assert loaded_heavy_modules(code=code) == []
+
+
+def test_write_result_as_json_and_csv():
+    result = {0: 0.1, 1: 0.2}
+    file = io.StringIO()
+    main.write_result(result=result, output_format='json', key_name='hour', value_name='PVPC_price_kwh', file=file)
+    assert json.loads(file.getvalue()) == {'0': 0.1, '1': 0.2}
+
+    file = io.StringIO()
+    main.write_result(result=result, output_format='csv', key_name='hour', value_name='PVPC_price_kwh', file=file)
+    assert file.getvalue() == 'hour,PVPC_price_kwh\n0,0.1\n1,0.2\n'
+
+    # Nested stats are flattened, lists of rows keep their columns
+    file = io.StringIO()
+    main.write_result(result={'download': {'items': 3}}, output_format='csv', key_name='name', value_name='value',
+                      file=file)
+    assert file.getvalue() == 'name,value\ndownload.items,3\n'
+    file = io.StringIO()
+    main.write_result(result=[{'date': '2023-01-01', 'hour': 0}], output_format='csv', key_name='name',
+                      value_name='value', file=file)
+    assert file.getvalue() == 'date,hour\n2023-01-01,0\n'
+
+    # Hours without data are null in json and empty in csv
+    result = {0: float('nan'), 1: 0.2}
+    file = io.StringIO()
+    main.write_result(result=result, output_format='json', key_name='hour', value_name='PVPC_price_kwh', file=file)
+    assert 'NaN' not in file.getvalue() and json.loads(file.getvalue()) == {'0': None, '1': 0.2}
+    file = io.StringIO()
+    main.write_result(result=result, output_format='csv', key_name='hour', value_name='PVPC_price_kwh', file=file)
+    assert file.getvalue() == 'hour,PVPC_price_kwh\n0,\n1,0.2\n'
+
+
+def test_query_writes_the_plot_without_a_display(tmp_path):
+    matplotlib = pytest.importorskip('matplotlib')
+    pytest.importorskip('numpy')
+    from data_management.storage.sqlite_backend import SQLiteBackend
+
+    sqlite_path, plot_path, output_path = tmp_path / 'prices.sqlite3', tmp_path / 'hours.png', tmp_path / 'out.json'
+    backend = SQLiteBackend(path=str(sqlite_path))
+    backend.write_days(docs=[{'date': (date(2023, 6, 1) + timedelta(days=i)).strftime('%Y-%m-%d'), 'location': 'PCB',
+                              'toll': '2.0TD', 'period': [3] * 8 + [2] * 4 + [1] * 12,
+                              **{field: [0.01 * hour for hour in range(24)] for field in PRICE_FIELDS}}
+                             for i in range(3)])
+    backend.close()
+
+    assert main.main(['--output', str(output_path), 'query', 'avg-by-hour', '--start', '2023-06-01', '--end',
+                      '2023-06-03', '--backend', 'sqlite', '--sqlite-path', str(sqlite_path), '--plot',
+                      str(plot_path)]) == 0
+    assert matplotlib.get_backend().lower() == 'agg'
+    assert plot_path.stat().st_size > 0
+    with open(output_path) as f:
+        prices_by_hour = json.load(f)
+    assert len(prices_by_hour) == 24 and prices_by_hour['23'] == pytest.approx(0.23)
+
+
+def test_query_of_a_range_without_data_is_valid_json(tmp_path):
+    pytest.importorskip('numpy')
+    output_path = tmp_path / 'out.json'
+    assert main.main(['--output', str(output_path), 'query', 'avg-by-hour', '--start', '2023-06-01', '--end',
+                      '2023-06-03', '--backend', 'sqlite', '--sqlite-path', str(tmp_path / 'prices.sqlite3')]) == 0
+    with open(output_path) as f:
+        prices_by_hour = json.load(f, parse_constant=lambda constant: pytest.fail(f"Invalid json constant {constant}"))
+    assert prices_by_hour == {str(hour): None for hour in range(24)}
@@ -0,0 +1,49 @@
+import gc
+
+import pytest
+
+firebase_admin = pytest.importorskip('firebase_admin')
+
+from firebase_admin import credentials, firestore
+
+from benchmarks.memory_client import MemoryClient
+from data_management.firebase import client_pool
+from data_management.firebase.firebase_manager import FirebaseManager
+from data_management.manifest import DataManifest
+
+
+class FakeCredentials(credentials.Base):
+    def __init__(self, cert):
+        self.cert = cert
+
+
+@pytest.fixture
+def memory_clients(monkeypatch):
+    # Shared clients over memory, without real credentials
+    created = []
+
+    def client(app):
+        created.append(MemoryClient())
+        return created[-1]
+
+    monkeypatch.setattr(credentials, 'Certificate', FakeCredentials)
+    monkeypatch.setattr(firestore, 'client', client)
+    yield created
+    client_pool.close_clients()
+
+
+def test_closed_clients_are_created_again(memory_clients):
+    client = client_pool.get_client(credentials_path='credentials.json')
+    assert client_pool.get_client(credentials_path='credentials.json') is client
+
+    client_pool.close_clients()
+    assert memory_clients[0].closed
+    assert client_pool.get_client(credentials_path='credentials.json') is not client
+
+
+def test_manager_never_closes_the_client_it_was_given(tmp_path):
+    client = MemoryClient()
+    manager = FirebaseManager(client=client, manifest=DataManifest(data_folder=str(tmp_path)))
+    del manager
+    gc.collect()
+    assert not client.closed
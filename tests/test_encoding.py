@@ -0,0 +1,84 @@
+from datetime import date, timedelta
+
+import pytest
+
+np = pytest.importorskip('numpy')
+pd = pytest.importorskip('pandas')
+pytest.importorskip('firebase_admin')
+
+from benchmarks.memory_client import MemoryClient
+from data_management.constants import PRICE_FIELDS
+from data_management.firebase.encoding import encode_day, decode_day, ENCODING_FIELD, HOURLY_FIELD, \
+    PERIOD_PATTERN_FIELD
+from data_management.firebase.firebase_manager import FirebaseManager
+from data_management.firebase.firebase_querier import FirebaseQuerier
+from data_management.manifest import DataManifest
+
+START_DATE, DAYS = date(2023, 10, 27), 4
+PERIODS = [3] * 8 + [2] * 4 + [1] * 4 + [2] * 4 + [1] * 4
+
+
+def day_doc(day: date, seed: int = 0) -> dict:
+    rng = np.random.default_rng(seed=seed)
+    return {'date': day.strftime('%Y-%m-%d'), 'location': 'PCB', 'toll': '2.0TD', 'period': PERIODS,
+            **{field: list(rng.uniform(0.01, 0.3, size=24)) for field in PRICE_FIELDS}}
+
+
+def test_round_trip():
+    doc = day_doc(day=START_DATE)
+    encoded = encode_day(doc=doc)
+    assert set(encoded) == {'date', 'location', 'toll', ENCODING_FIELD, HOURLY_FIELD, PERIOD_PATTERN_FIELD}
+    assert encoded[PERIOD_PATTERN_FIELD] == ''.join(str(period) for period in PERIODS)
+    decoded = decode_day(doc=encoded)
+    assert set(decoded) == set(doc)
+    for field in PRICE_FIELDS:
+        assert list(decoded[field]) == doc[field]
+    assert list(decoded['period']) == PERIODS
+
+    # Float32 keeps 7 significant digits
+    decoded = decode_day(doc=encode_day(doc=doc, dtype='<f4'))
+    for field in PRICE_FIELDS:
+        assert list(decoded[field]) == pytest.approx(doc[field], rel=1e-6)
+    with pytest.raises(AssertionError):
+        encode_day(doc=doc, dtype='>f8')
+    with pytest.raises(AssertionError):
+        encode_day(doc={**doc, 'period': [10] * 24})
+
+    # Documents in the original format are returned as they are
+    assert decode_day(doc=doc) is doc
+
+
+def test_decoded_arrays_are_read_only_views():
+    encoded = encode_day(doc=day_doc(day=START_DATE))
+    decoded = decode_day(doc=encoded)
+    for field in PRICE_FIELDS + ('period',):
+        assert not decoded[field].flags.writeable
+        with pytest.raises(ValueError):
+            decoded[field][0] = 1.0
+    # Hourly fields are views over the packed bytes, and the periods are shared by the days with the same pattern
+    assert not decoded['PVPC_price_kwh'].flags.owndata
+    assert decode_day(doc=encode_day(doc=day_doc(day=START_DATE, seed=1)))['period'] is decoded['period']
+
+
+def test_queries_read_compact_and_original_days_mixed(tmp_path):
+    client = MemoryClient()
+    manager = FirebaseManager(client=client, manifest=DataManifest(data_folder=str(tmp_path)))
+    compact_manager = FirebaseManager(client=client, manifest=manager.manifest, compact=True)
+    docs = [day_doc(day=START_DATE + timedelta(days=i), seed=i) for i in range(DAYS)]
+    for i, doc in enumerate(docs):
+        df = pd.DataFrame({'date': doc['date'], 'hour': range(24), 'toll': '2.0TD', 'period': PERIODS,
+                           **{field: doc[field] for field in PRICE_FIELDS}, 'location': 'PCB'})
+        assert (compact_manager if i % 2 == 0 else manager).post_frame(df=df, location='PCB', toll='2.0TD',
+                                                                        skip_if_exist=False)
+
+    querier = FirebaseQuerier(client=client, use_cache=False, use_rollups=False)
+    read = querier.get_days_between_dates(start_date=START_DATE, end_date=START_DATE + timedelta(days=DAYS - 1))
+    assert [doc['date'] for doc in read] == [doc['date'] for doc in docs]
+    for doc, read_doc in zip(docs, read):
+        for field in PRICE_FIELDS:
+            assert list(read_doc[field]) == pytest.approx(doc[field])
+        assert list(read_doc['period']) == PERIODS
+    expected = {hour: np.mean([doc['PVPC_price_kwh'][hour] for doc in docs]) for hour in range(24)}
+    assert querier.avg_price_between_dates_by_hour(start_date=START_DATE,
+                                                   end_date=START_DATE + timedelta(days=DAYS - 1)) == \
+           pytest.approx(expected)
@@ -0,0 +1,76 @@
+import os
+from datetime import date, timedelta
+
+import pytest
+
+pd = pytest.importorskip('pandas')
+np = pytest.importorskip('numpy')
+pytest.importorskip('firebase_admin')
+
+from benchmarks.memory_client import MemoryClient
+from data_management.constants import PRICE_FIELDS, BY_DAY
+from data_management.firebase.encoding import encode_day, day_fingerprint
+from data_management.firebase.firebase_manager import FirebaseManager
+from data_management.manifest import DataManifest
+from utils.utils import get_collection
+
+START_DATE, DAYS = date(2023, 1, 1), 80
+END_DATE = START_DATE + timedelta(days=DAYS - 1)
+
+
+def day_frame(day: date, price: float = 0.1) -> pd.DataFrame:
+    return pd.DataFrame({'date': day.strftime('%Y-%m-%d'), 'hour': range(24), 'toll': '2.0TD',
+                         'period': [3] * 8 + [2] * 16, 'PVPC_price_kwh': [price + hour / 100 for hour in range(24)],
+                         'TEU_charges_kwh': 0.1, 'TCU_production_price_kwh': 0.05, 'location': 'PCB'})
+
+
+def csv_path(data_folder: str, day: date) -> str:
+    return os.path.join(data_folder, 'PCB', '2.0TD', f"{day.strftime('%Y-%m-%d')}.csv")
+
+
+def test_only_revised_days_are_written_again(tmp_path):
+    data_folder = str(tmp_path)
+    os.makedirs(os.path.join(data_folder, 'PCB', '2.0TD'))
+    for i in range(DAYS):
+        day = START_DATE + timedelta(days=i)
+        day_frame(day=day).to_csv(csv_path(data_folder=data_folder, day=day), index=False)
+    client = MemoryClient()
+    manager = FirebaseManager(client=client, manifest=DataManifest(data_folder=data_folder))
+    manager.post_for_date_range(start_date=START_DATE, end_date=END_DATE, skip_if_exist=False, skip_unchanged=True)
+    assert manager.unchanged_days == 0
+
+    # ESIOS revises a single day
+    revised_day = START_DATE + timedelta(days=41)
+    day_frame(day=revised_day, price=0.2).to_csv(csv_path(data_folder=data_folder, day=revised_day), index=False)
+    client.reset_rpc_counts()
+    manager.post_for_date_range(start_date=START_DATE, end_date=END_DATE, skip_if_exist=False, skip_unchanged=True)
+    assert manager.unchanged_days == DAYS - 1
+    # The 24 hours and the day, in a single batch
+    assert client.rpc_counts['commit'] == 1
+    collection_ref = get_collection(client=client, location='PCB', toll='2.0TD', aggregation=BY_DAY)
+    prices = {doc.to_dict()['date']: doc.to_dict()['PVPC_price_kwh'][0] for doc in collection_ref.stream()}
+    assert prices[revised_day.strftime('%Y-%m-%d')] == pytest.approx(0.2)
+    assert sum(price == pytest.approx(0.1) for price in prices.values()) == DAYS - 1
+
+    # Days posted one by one read the stored fingerprint
+    assert manager.post_frame(df=day_frame(day=revised_day, price=0.2), location='PCB', toll='2.0TD',
+                              skip_if_exist=False, skip_unchanged=True)
+    assert manager.unchanged_days == DAYS
+    assert manager.post_frame(df=day_frame(day=revised_day, price=0.3), location='PCB', toll='2.0TD',
+                              skip_if_exist=False, skip_unchanged=True)
+    assert manager.unchanged_days == DAYS
+
+
+def test_fingerprint_is_the_same_for_both_formats():
+    rng = np.random.default_rng(seed=0)
+    doc = {'date': '2023-01-01', 'location': 'PCB', 'toll': '2.0TD', 'period': [3] * 8 + [2] * 16,
+           **{field: list(rng.uniform(0.01, 0.3, size=24)) for field in PRICE_FIELDS}}
+    fingerprint = day_fingerprint(doc=doc)
+    assert day_fingerprint(doc=encode_day(doc=doc)) == fingerprint
+    # Float noise of a new parse and -0.0 don't change it, any value or period does
+    assert day_fingerprint(doc={**doc, 'TEU_charges_kwh': [value + 1e-12 for value in doc['TEU_charges_kwh']]}) == \
+           fingerprint
+    zeros = {**doc, 'TCU_production_price_kwh': [0.0] * 24}
+    assert day_fingerprint(doc={**zeros, 'TCU_production_price_kwh': [-0.0] * 24}) == day_fingerprint(doc=zeros)
+    assert day_fingerprint(doc={**doc, 'PVPC_price_kwh': [0.5] + doc['PVPC_price_kwh'][1:]}) != fingerprint
+    assert day_fingerprint(doc={**doc, 'period': [2] * 24}) != fingerprint
@@ -0,0 +1,48 @@
+import os
+from datetime import date
+
+from data_management.manifest import DataManifest
+
+
+def write_csv(data_folder: str, location: str, toll: str, date_str: str) -> str:
+    folder = os.path.join(data_folder, location, toll)
+    os.makedirs(folder, exist_ok=True)
+    path = os.path.join(folder, f"{date_str}.csv")
+    with open(path, 'w') as f:
+        f.write('date\n')
+    return path
+
+
+def test_manifest_is_not_read_nor_written_until_used(tmp_path):
+    write_csv(data_folder=str(tmp_path), location='PCB', toll='2.0TD', date_str='2023-01-01')
+    manifest = DataManifest(data_folder=str(tmp_path))
+    manifest.save()
+    assert not os.path.isfile(manifest.manifest_path)
+
+    assert manifest.location_tolls() == [('PCB', '2.0TD')]
+    assert os.path.isfile(manifest.manifest_path)
+
+
+def test_manifest_picks_up_files_changed_out_of_the_downloader(tmp_path):
+    kept = write_csv(data_folder=str(tmp_path), location='PCB', toll='2.0TD', date_str='2023-01-01')
+    deleted = write_csv(data_folder=str(tmp_path), location='PCB', toll='2.0TD', date_str='2023-01-02')
+    DataManifest(data_folder=str(tmp_path)).rebuild()
+    os.remove(deleted)
+    added = write_csv(data_folder=str(tmp_path), location='PCB', toll='2.0TD', date_str='2023-01-03')
+    # As if the folder was modified after the manifest was written
+    os.utime(os.path.join(str(tmp_path), 'manifest.json'), (0, 0))
+
+    manifest = DataManifest(data_folder=str(tmp_path))
+    assert manifest.get(day=date(2023, 1, 1), location='PCB', toll='2.0TD') == kept
+    assert manifest.get(day=date(2023, 1, 2), location='PCB', toll='2.0TD') is None
+    assert manifest.get(day=date(2023, 1, 3), location='PCB', toll='2.0TD') == added
+
+
+def test_manifest_forgets_listed_files_that_no_longer_exist(tmp_path):
+    path = write_csv(data_folder=str(tmp_path), location='CYM', toll='2.0TD', date_str='2023-01-01')
+    manifest = DataManifest(data_folder=str(tmp_path))
+    assert manifest.files_for_date(day=date(2023, 1, 1)) == {'CYM': {'2.0TD': path}}
+
+    os.remove(path)
+    assert manifest.files_for_date(day=date(2023, 1, 1)) == {}
+    assert manifest.location_tolls() == []
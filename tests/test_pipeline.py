@@ -0,0 +1,45 @@
+from datetime import datetime
+
+import pytest
+
+pytest.importorskip('aiohttp')
+pytest.importorskip('openpyxl')
+pytest.importorskip('firebase_admin')
+
+from benchmarks.esios_stand_in import EsiosStandIn
+from benchmarks.memory_client import MemoryClient
+from data_management.firebase.firebase_manager import FirebaseManager
+from data_management.manifest import DataManifest
+from data_management.pipeline import IngestPipeline
+from data_management.prices_downloader import PricesDownloader
+
+START_DATE, END_DATE = datetime(2023, 3, 1), datetime(2023, 3, 4)
+
+
+def run_pipeline(data_folder: str, stand_in: EsiosStandIn, client: MemoryClient, **kwargs) -> dict:
+    downloader = PricesDownloader(data_folder=data_folder, url=stand_in.url, parse_workers=0)
+    manager = FirebaseManager(client=client, manifest=DataManifest(data_folder=data_folder))
+    try:
+        return IngestPipeline(downloader=downloader, firebase_manager=manager, requests_per_second=0).run(
+            start_date=START_DATE, end_date=END_DATE, **kwargs)
+    finally:
+        downloader.close()
+
+
+def test_pipeline_publishes_every_day_once(tmp_path):
+    client = MemoryClient()
+    with EsiosStandIn() as stand_in:
+        stats = run_pipeline(data_folder=str(tmp_path), stand_in=stand_in, client=client)
+        assert stats['publish']['items'] == 4
+        assert stats['last_days']['PCB/2.0TD'] == '2023-03-04'
+        written = stats['writer']['writes']
+
+        # Existing days are found with one query per location/toll and not written again
+        stats = run_pipeline(data_folder=str(tmp_path), stand_in=stand_in, client=client)
+    assert written > 0 and stats['writer']['writes'] == 0
+
+
+def test_download_failures_fail_the_pipeline(tmp_path):
+    with EsiosStandIn(statuses={'2023-03-02': [404]}) as stand_in:
+        with pytest.raises(AssertionError, match='2023-03-02'):
+            run_pipeline(data_folder=str(tmp_path), stand_in=stand_in, client=MemoryClient())
@@ -0,0 +1,100 @@
+from datetime import date, timedelta
+
+import pytest
+
+np = pytest.importorskip('numpy')
+pd = pytest.importorskip('pandas')
+
+from data_management.constants import PRICE_CUBE_GROWTH_DAYS, PRICE_CUBE_START_DATE
+from data_management.price_cube import PriceCube, CUBE_FIELDS
+
+START_DATE = date(2023, 3, 1)
+
+
+def day_values(day: date, offset: float = 0.0) -> np.ndarray:
+    # Every value tells its day, hour and field
+    base = (day - START_DATE).days + offset
+    return np.array([[base + hour / 100 + field / 10000 for field in range(len(CUBE_FIELDS))] for hour in range(24)])
+
+
+def day_frame(day: date, location: str = 'PCB', toll: str = '2.0TD', hours: int = 24) -> pd.DataFrame:
+    values = day_values(day=day)
+    return pd.DataFrame({'date': day.strftime('%Y-%m-%d'), 'hour': range(hours), 'toll': toll, 'location': location,
+                         **{field: [values[min(hour, 23), i] for hour in range(hours)]
+                            for i, field in enumerate(CUBE_FIELDS)}})
+
+
+def test_written_days_are_read_back_after_reopening(tmp_path):
+    folder = str(tmp_path / 'cube')
+    cube = PriceCube(folder=folder)
+    written = [START_DATE, START_DATE + timedelta(days=1), START_DATE + timedelta(days=3)]
+    for day in written:
+        cube.write_day(day=day, location='PCB', toll='2.0TD', values=day_values(day=day))
+    cube.write_day(day=START_DATE, location='CYM', toll='2.0TD', values=day_values(day=START_DATE, offset=0.5))
+    cube.save()
+
+    reopened = PriceCube(folder=folder, read_only=True)
+    assert reopened.shape == cube.shape and reopened.days % PRICE_CUBE_GROWTH_DAYS == 0
+    assert reopened.tolls == ['2.0TD'] and reopened.fields == list(CUBE_FIELDS)
+    series = reopened.series(start_date=START_DATE, end_date=START_DATE + timedelta(days=4))
+    assert series.shape == (5, 24)
+    for i in range(5):
+        day = START_DATE + timedelta(days=i)
+        if day in written:
+            np.testing.assert_array_equal(series[i], day_values(day=day)[:, CUBE_FIELDS.index('PVPC_price_kwh')])
+        else:
+            # Missing days are NaN
+            assert np.isnan(series[i]).all()
+    np.testing.assert_array_equal(reopened.series(start_date=START_DATE, end_date=START_DATE, location='CYM',
+                                                  field='period')[0],
+                                  day_values(day=START_DATE, offset=0.5)[:, CUBE_FIELDS.index('period')])
+    assert np.isnan(reopened.series(start_date=START_DATE - timedelta(days=10), end_date=START_DATE - timedelta(days=1)))\
+        .all()
+
+    # Beyond the allocated days, the range is padded with NaN
+    last_day = PRICE_CUBE_START_DATE + timedelta(days=reopened.days - 1)
+    beyond = reopened.series(start_date=last_day, end_date=last_day + timedelta(days=2))
+    assert beyond.shape == (3, 24) and np.isnan(beyond).all()
+
+    with pytest.raises(AssertionError):
+        reopened.write_day(day=START_DATE, location='PCB', toll='2.0TD', values=day_values(day=START_DATE))
+    with pytest.raises(AssertionError):
+        reopened.series(start_date=START_DATE, end_date=START_DATE, toll='3.0TD')
+    with pytest.raises(AssertionError):
+        PriceCube(folder=str(tmp_path / 'missing'), read_only=True)
+
+
+def test_adding_a_toll_keeps_the_stored_days(tmp_path):
+    folder = str(tmp_path / 'cube')
+    cube = PriceCube(folder=folder)
+    cube.write_day(day=START_DATE, location='PCB', toll='2.0TD', values=day_values(day=START_DATE))
+    cube.write_day(day=START_DATE, location='PCB', toll='3.0TD', values=day_values(day=START_DATE, offset=0.5))
+    cube.save()
+
+    reopened = PriceCube(folder=folder)
+    assert reopened.tolls == ['2.0TD', '3.0TD']
+    np.testing.assert_array_equal(reopened.load(start_date=START_DATE, end_date=START_DATE)[0, :, 0, 0, :],
+                                  day_values(day=START_DATE))
+    np.testing.assert_array_equal(reopened.load(start_date=START_DATE, end_date=START_DATE)[0, :, 0, 1, :],
+                                  day_values(day=START_DATE, offset=0.5))
+    assert np.isnan(reopened.load(start_date=START_DATE, end_date=START_DATE)[0, :, 1]).all()
+
+
+def test_append_frame_fixes_the_day_length(tmp_path):
+    folder = str(tmp_path / 'cube')
+    cube = PriceCube(folder=folder)
+    summer_day, winter_day = date(2023, 3, 26), date(2023, 10, 29)
+    cube.append_frame(df=day_frame(day=summer_day, hours=23))
+    cube.append_frame(df=pd.concat([day_frame(day=winter_day, hours=25),
+                                    day_frame(day=winter_day, toll='3.0TD')], ignore_index=True))
+    cube.save()
+
+    reopened = PriceCube(folder=folder, read_only=True)
+    summer = reopened.series(start_date=summer_day, end_date=summer_day)[0]
+    # The missing hour repeats the last one
+    np.testing.assert_array_equal(summer[:23], day_values(day=summer_day)[:23, CUBE_FIELDS.index('PVPC_price_kwh')])
+    assert summer[23] == summer[22]
+    np.testing.assert_array_equal(reopened.series(start_date=winter_day, end_date=winter_day, toll='3.0TD')[0],
+                                  day_values(day=winter_day)[:, CUBE_FIELDS.index('PVPC_price_kwh')])
+    np.testing.assert_array_equal(reopened.series(start_date=winter_day, end_date=winter_day)[0],
+                                  day_values(day=winter_day)[:, CUBE_FIELDS.index('PVPC_price_kwh')])
@@ -0,0 +1,108 @@
+from datetime import date, timedelta
+
+import pytest
+
+np = pytest.importorskip('numpy')
+
+from data_management.constants import PRICE_FIELDS, PRICE_INDEX_MAX_PERIOD
+from data_management.price_index import PriceIndex
+
+START_DATE, DAYS = date(2023, 3, 1), 40
+# Days left out of the index, to check that gaps don't count for the averages
+GAPS = {5, 6, 20}
+# (first, last) day offsets from START_DATE: the whole index, inside, a gap alone, and clipped on each side
+RANGES = [(START_DATE + timedelta(days=first), START_DATE + timedelta(days=last))
+          for first, last in [(0, DAYS - 1), (3, 8), (6, 6), (-30, 2), (30, DAYS + 30), (DAYS + 5, DAYS + 9)]]
+
+
+def day_doc(index: int, rng) -> dict:
+    periods = [3] * 8 + [2] * 4 + [1] * 4 + [2] * 4 + [1] * 4 if index % 7 < 5 else [3] * 24
+    doc = {'date': (START_DATE + timedelta(days=index)).strftime('%Y-%m-%d'), 'period': periods,
+           **{field: list(rng.uniform(0.01, 0.3, size=24)) for field in PRICE_FIELDS}}
+    if index == 10:
+        # Only some hours of a single field are missing
+        doc['TEU_charges_kwh'][3:6] = [float('nan')] * 3
+    return doc
+
+
+def brute_force(docs: dict[date, dict], start_date: date, end_date: date, field: str) -> tuple[dict, dict]:
+    by_hour, by_period = {hour: [] for hour in range(24)}, {}
+    for day, doc in docs.items():
+        if start_date <= day <= end_date:
+            for hour, (value, period) in enumerate(zip(doc[field], doc['period'])):
+                if not np.isnan(value):
+                    by_hour[hour].append(value)
+                    by_period.setdefault(period, []).append(value)
+    return ({hour: np.mean(values) if len(values) > 0 else float('nan') for hour, values in by_hour.items()},
+            {period: np.mean(values) for period, values in by_period.items()})
+
+
+def check_against_brute_force(index: PriceIndex, docs: dict[date, dict]):
+    for field in PRICE_FIELDS:
+        hours_many = index.avg_by_hour_many(start_dates=[start for start, _ in RANGES],
+                                            end_dates=[end for _, end in RANGES], field=field)
+        periods_many = index.avg_by_period_many(start_dates=np.array([start for start, _ in RANGES],
+                                                                     dtype='datetime64[D]'),
+                                                end_dates=np.array([end for _, end in RANGES], dtype='datetime64[D]'),
+                                                field=field)
+        for i, (start_date, end_date) in enumerate(RANGES):
+            expected_by_hour, expected_by_period = brute_force(docs=docs, start_date=start_date, end_date=end_date,
+                                                               field=field)
+            by_hour = index.avg_by_hour(start_date=start_date, end_date=end_date, field=field)
+            assert by_hour == pytest.approx(expected_by_hour, nan_ok=True)
+            assert list(hours_many[i]) == pytest.approx([expected_by_hour[hour] for hour in range(24)], nan_ok=True)
+            assert index.avg_by_period(start_date=start_date, end_date=end_date, field=field) == \
+                   pytest.approx(expected_by_period)
+            assert list(periods_many[i]) == pytest.approx([expected_by_period.get(period, float('nan'))
+                                                           for period in range(1, PRICE_INDEX_MAX_PERIOD + 1)],
+                                                          nan_ok=True)
+
+
+def test_averages_match_a_brute_force_mean(tmp_path):
+    rng = np.random.default_rng(seed=0)
+    docs = {START_DATE + timedelta(days=i): day_doc(index=i, rng=rng) for i in range(DAYS) if i not in GAPS}
+    index = PriceIndex(folder=str(tmp_path))
+    # Later days first, then the earlier ones, so the cumulative sums are rebuilt from the middle
+    late, early = list(docs.values())[len(docs) // 2:], list(docs.values())[:len(docs) // 2]
+    index.add_docs(docs=late)
+    index.add_docs(docs=early)
+    check_against_brute_force(index=index, docs=docs)
+
+    # Replacing a past day updates every range after it
+    docs[START_DATE + timedelta(days=2)] = day_doc(index=2, rng=rng)
+    index.add_doc(doc=docs[START_DATE + timedelta(days=2)])
+    check_against_brute_force(index=index, docs=docs)
+
+    # Filling a gap too
+    docs[START_DATE + timedelta(days=20)] = day_doc(index=20, rng=rng)
+    index.add_doc(doc=docs[START_DATE + timedelta(days=20)])
+    check_against_brute_force(index=index, docs=docs)
+
+
+def test_missing_hours_of_a_field_do_not_count(tmp_path):
+    rng = np.random.default_rng(seed=1)
+    docs = {START_DATE + timedelta(days=10): day_doc(index=10, rng=rng)}
+    index = PriceIndex(folder=str(tmp_path))
+    index.add_docs(docs=list(docs.values()))
+    day = START_DATE + timedelta(days=10)
+    by_hour = index.avg_by_hour(start_date=day, end_date=day, field='TEU_charges_kwh')
+    assert all(np.isnan(by_hour[hour]) for hour in range(3, 6))
+    assert not np.isnan(index.avg_by_hour(start_date=day, end_date=day)[4])
+    check_against_brute_force(index=index, docs=docs)
+
+
+def test_save_and_reload(tmp_path):
+    rng = np.random.default_rng(seed=2)
+    docs = {START_DATE + timedelta(days=i): day_doc(index=i, rng=rng) for i in range(DAYS) if i not in GAPS}
+    index = PriceIndex(folder=str(tmp_path))
+    index.add_docs(docs=list(docs.values()))
+    index.save()
+
+    reloaded = PriceIndex(folder=str(tmp_path))
+    assert reloaded.days == index.days
+    check_against_brute_force(index=reloaded, docs=docs)
+
+    # The reloaded index keeps growing from where it was
+    docs[START_DATE + timedelta(days=DAYS + 6)] = day_doc(index=DAYS + 6, rng=rng)
+    reloaded.add_doc(doc=docs[START_DATE + timedelta(days=DAYS + 6)])
+    check_against_brute_force(index=reloaded, docs=docs)
@@ -0,0 +1,56 @@
+import os
+
+import pytest
+
+pd = pytest.importorskip('pandas')
+pytest.importorskip('xlrd')
+
+from benchmarks.bench_xls_parsing import XLS_PATH, legacy_parse_workbook
+from data_management.prices_downloader import PricesDownloader, parse_workbook
+
+
+def legacy_csv_files(data_folder: str) -> dict[str, bytes]:
+    # Csv files as the old cast_to_csv wrote them, one per location and toll
+    files = {}
+    for location, data in legacy_parse_workbook(xls_path=XLS_PATH).items():
+        for toll in data['toll'].unique():
+            csv_path = os.path.join(data_folder, location, toll, f"{data['date'].iloc[0]}.csv")
+            os.makedirs(os.path.dirname(csv_path), exist_ok=True)
+            data[data['toll'] == toll].sort_values(by='hour').to_csv(csv_path, index=False)
+            with open(csv_path, 'rb') as f:
+                files[os.path.relpath(csv_path, data_folder)] = f.read()
+    return files
+
+
+def test_parse_workbook_matches_the_old_cast_to_csv(tmp_path):
+    legacy, parsed = legacy_parse_workbook(xls_path=XLS_PATH), parse_workbook(xls_path=XLS_PATH)
+    assert list(parsed) == list(legacy) == ['PCB', 'CYM']
+    for location in parsed:
+        pd.testing.assert_frame_equal(parsed[location], legacy[location])
+
+    expected = legacy_csv_files(data_folder=str(tmp_path / 'legacy'))
+    data_folder = str(tmp_path / 'data')
+    downloader = PricesDownloader(data_folder=data_folder, cache_raw=False, parse_workers=0)
+    os.makedirs(data_folder)
+    paths = downloader.cast_to_csv(xls_path=XLS_PATH)
+    assert sorted(os.path.relpath(path, data_folder) for path in paths) == sorted(expected)
+    for path in paths:
+        with open(path, 'rb') as f:
+            assert f.read() == expected[os.path.relpath(path, data_folder)]
+
+
+def test_parse_pool_is_started_on_the_first_parse(tmp_path):
+    data_folder = str(tmp_path)
+    with PricesDownloader(data_folder=data_folder, cache_raw=False, parse_workers=1) as downloader:
+        assert downloader.parse_executor is None
+        with open(XLS_PATH, 'rb') as f:
+            data_by_location = downloader.parse_content(content=f.read())
+        assert downloader.parse_executor is not None
+        pd.testing.assert_frame_equal(data_by_location['PCB'], parse_workbook(xls_path=XLS_PATH)['PCB'])
+    assert downloader.parse_executor is None
+
+    # Closed downloaders start a new pool if they parse again, and closing twice does nothing
+    assert downloader.cast_to_csv(xls_path=XLS_PATH)
+    downloader.close()
+    downloader.close()
+    assert downloader.parse_executor is None
@@ -0,0 +1,159 @@
+import os
+from datetime import date, datetime, timedelta
+
+import pytest
+
+pd = pytest.importorskip('pandas')
+pytest.importorskip('firebase_admin')
+
+from google.api_core.exceptions import ServiceUnavailable
+
+from benchmarks.memory_client import MemoryClient
+from data_management.constants import NO_AGGREGATION, BY_DAY, BY_MONTH
+from data_management.firebase.firebase_manager import FirebaseManager
+from data_management.firebase.firebase_querier import FirebaseQuerier
+from data_management.firebase.query_cache import QueryCache
+from data_management.manifest import DataManifest
+from utils.utils import get_collection
+
+START_DATE, DAYS = date(2023, 3, 1), 4
+END_DATE = START_DATE + timedelta(days=DAYS - 1)
+LOCATION_TOLLS = [('PCB', '2.0TD'), ('PCB', '3.0TD')]
+
+
+class FailingClient(MemoryClient):
+    def __init__(self, failing_commits: set[int]):
+        """
+        MemoryClient whose commits with the given numbers (counting from 1) fail with ServiceUnavailable
+        """
+        super().__init__()
+        self.failing_commits = failing_commits
+        self.commits = 0
+
+    def batch(self):
+        batch = super().batch()
+        commit = batch.commit
+
+        def failing_commit() -> list:
+            with self._lock:
+                self.commits += 1
+                number = self.commits
+            if number in self.failing_commits:
+                raise ServiceUnavailable(f"Commit {number} failed")
+            return commit()
+
+        batch.commit = failing_commit
+        return batch
+
+
+def write_csvs(data_folder: str, price: float, days: int = DAYS):
+    for location, toll in LOCATION_TOLLS:
+        os.makedirs(os.path.join(data_folder, location, toll), exist_ok=True)
+        for i in range(days):
+            day = (START_DATE + timedelta(days=i)).strftime('%Y-%m-%d')
+            pd.DataFrame({'date': day, 'hour': range(24), 'toll': toll, 'period': [3] * 8 + [2] * 16,
+                          'PVPC_price_kwh': [price + hour for hour in range(24)], 'TEU_charges_kwh': 0.1,
+                          'TCU_production_price_kwh': 0.05, 'location': location}).\
+                to_csv(os.path.join(data_folder, location, toll, f"{day}.csv"), index=False)
+
+
+def stored_days(client: MemoryClient, location: str, toll: str) -> dict[str, list[float]]:
+    # Price of hour 0 of each day, from its hourly documents and its BY_DAY document
+    hours = {}
+    for doc in get_collection(client=client, location=location, toll=toll, aggregation=NO_AGGREGATION).stream():
+        doc = doc.to_dict()
+        hours.setdefault(doc['date'], []).append(doc['PVPC_price_kwh'] - doc['hour'])
+    for doc in get_collection(client=client, location=location, toll=toll, aggregation=BY_DAY).stream():
+        doc = doc.to_dict()
+        hours.setdefault(doc['date'], []).append(doc['PVPC_price_kwh'][0])
+    return hours
+
+
+def rollup_days(client: MemoryClient, location: str = 'PCB', toll: str = '2.0TD') -> dict[str, int]:
+    collection_ref = get_collection(client=client, location=location, toll=toll, aggregation=BY_MONTH)
+    return {doc.to_dict()['month']: doc.to_dict()['days'] for doc in collection_ref.stream()}
+
+
+@pytest.fixture
+def posted(tmp_path):
+    data_folder = str(tmp_path / 'data')
+    write_csvs(data_folder=data_folder, price=1.0)
+    client = MemoryClient()
+    cache = QueryCache(path=str(tmp_path / 'cache.json'))
+    manager = FirebaseManager(client=client, manifest=DataManifest(data_folder=data_folder), query_cache=cache)
+    manager.post_for_date_range(start_date=START_DATE, end_date=END_DATE, skip_if_exist=False)
+    querier = FirebaseQuerier(client=client, cache=cache)
+    # Every day is in the cache before changing them
+    assert len(querier.get_days_between_dates(start_date=START_DATE, end_date=END_DATE)) == DAYS
+    return data_folder, client, manager, querier
+
+
+def test_purge_range_deletes_the_days_and_updates_rollups_and_cache(posted):
+    data_folder, client, manager, querier = posted
+    deleted = manager.purge_range(start_date=START_DATE + timedelta(days=1), end_date=END_DATE,
+                                  location_tolls=[('PCB', '2.0TD')])
+    assert deleted == (DAYS - 1) * 25
+    assert stored_days(client=client, location='PCB', toll='2.0TD') == {'2023-03-01': [1.0] * 25}
+    assert len(stored_days(client=client, location='PCB', toll='3.0TD')) == DAYS
+    assert rollup_days(client=client) == {'2023-03': 1}
+    assert [doc['date'] for doc in querier.get_days_between_dates(start_date=START_DATE, end_date=END_DATE)] == \
+           ['2023-03-01']
+
+    # A month left without days loses its rollup
+    manager.purge_range(start_date=START_DATE, end_date=START_DATE, location_tolls=[('PCB', '2.0TD')])
+    assert rollup_days(client=client) == {}
+    assert querier.get_days_between_dates(start_date=START_DATE, end_date=END_DATE) == []
+
+
+def test_repost_range_replaces_the_days_and_updates_rollups_and_cache(posted):
+    data_folder, client, manager, querier = posted
+    write_csvs(data_folder=data_folder, price=2.0, days=2)
+    manager.repost_range(start_date=START_DATE, end_date=START_DATE + timedelta(days=1))
+    for location, toll in LOCATION_TOLLS:
+        assert stored_days(client=client, location=location, toll=toll) == \
+               {'2023-03-01': [2.0] * 25, '2023-03-02': [2.0] * 25, '2023-03-03': [1.0] * 25,
+                '2023-03-04': [1.0] * 25}
+    assert rollup_days(client=client) == {'2023-03': DAYS}
+    assert [doc['PVPC_price_kwh'][0] for doc in querier.get_days_between_dates(start_date=START_DATE,
+                                                                                end_date=END_DATE)] == [2, 2, 1, 1]
+    assert querier.avg_price_between_dates_by_hour(start_date=START_DATE, end_date=END_DATE)[0] == 1.5
+
+    # Days without csv file are only purged
+    os.remove(os.path.join(data_folder, 'PCB', '3.0TD', '2023-03-04.csv'))
+    manager.repost_range(start_date=END_DATE, end_date=END_DATE, location_tolls=[('PCB', '3.0TD')])
+    assert '2023-03-04' not in stored_days(client=client, location='PCB', toll='3.0TD')
+    assert rollup_days(client=client, toll='3.0TD') == {'2023-03': DAYS - 1}
+
+
+def test_purge_collections_deletes_everything(posted):
+    data_folder, client, manager, querier = posted
+    assert manager.purge_collections(location_tolls=LOCATION_TOLLS) == len(LOCATION_TOLLS) * (DAYS * 25 + 1)
+    for location, toll in LOCATION_TOLLS:
+        assert stored_days(client=client, location=location, toll=toll) == {}
+        assert rollup_days(client=client, location=location, toll=toll) == {}
+    assert querier.get_days_between_dates(start_date=START_DATE, end_date=END_DATE) == []
+
+
+@pytest.mark.parametrize('max_retries', [0, 1])
+def test_failed_atomic_replacements_never_leave_half_days(tmp_path, max_retries: int):
+    data_folder = str(tmp_path / 'data')
+    write_csvs(data_folder=data_folder, price=1.0)
+    client = FailingClient(failing_commits=set())
+    manager = FirebaseManager(client=client, manifest=DataManifest(data_folder=data_folder))
+    manager.post_for_date_range(start_date=START_DATE, end_date=END_DATE, skip_if_exist=False)
+
+    # A group (24 hours and the day) fits only once in a batch, so each day is a commit. The second one fails
+    write_csvs(data_folder=data_folder, price=2.0)
+    client.commits, client.failing_commits = 0, {2}
+    if max_retries == 0:
+        with pytest.raises(ServiceUnavailable):
+            manager.repost_range(start_date=START_DATE, end_date=END_DATE, location_tolls=[('PCB', '2.0TD')],
+                                 write_batch_size=30, max_retries=max_retries, _batch_size=1)
+    else:
+        manager.repost_range(start_date=START_DATE, end_date=END_DATE, location_tolls=[('PCB', '2.0TD')],
+                             write_batch_size=30, max_retries=max_retries, _batch_size=1)
+    days = stored_days(client=client, location='PCB', toll='2.0TD')
+    assert sorted(days) == [(START_DATE + timedelta(days=i)).strftime('%Y-%m-%d') for i in range(DAYS)]
+    # Each day is fully replaced or fully kept
+    assert all(prices in ([1.0] * 25, [2.0] * 25) for prices in days.values())
+    assert sum(prices == [1.0] * 25 for prices in days.values()) == (1 if max_retries == 0 else 0)
@@ -0,0 +1,112 @@
+import os
+from datetime import date, timedelta
+
+import pytest
+
+pytest.importorskip('loguru')
+
+from data_management.constants import EXPECTED_DATE_FORMAT
+from data_management.firebase.query_cache import QueryCache
+
+START_DATE, END_DATE = date(2023, 1, 1), date(2023, 1, 10)
+
+
+class Database:
+    def __init__(self):
+        self.version = 1
+        self.fetched_days = 0
+
+    def fetch(self, first: date, last: date) -> list[dict]:
+        self.fetched_days += (last - first).days + 1
+        return [{'date': (first + timedelta(days=i)).strftime(EXPECTED_DATE_FORMAT), 'version': self.version}
+                for i in range((last - first).days + 1)]
+
+
+def test_cached_ranges_are_not_fetched_again(tmp_path):
+    database = Database()
+    cache = QueryCache(path=str(tmp_path / 'cache.json'))
+    cache.get_range(start_date=START_DATE, end_date=date(2023, 1, 5), location='PCB', toll='2.0TD',
+                    fetch=database.fetch)
+    docs = cache.get_range(start_date=START_DATE, end_date=END_DATE, location='PCB', toll='2.0TD',
+                           fetch=database.fetch)
+    assert len(docs) == 10 and database.fetched_days == 10
+    cache.save()
+
+    # Another process reads it from disk
+    docs = QueryCache(path=str(tmp_path / 'cache.json')).get_range(start_date=START_DATE, end_date=END_DATE,
+                                                                   location='PCB', toll='2.0TD', fetch=database.fetch)
+    assert len(docs) == 10 and database.fetched_days == 10
+
+
+def test_invalidations_of_other_processes_are_seen_before_trusting_the_cache(tmp_path):
+    database = Database()
+    reader = QueryCache(path=str(tmp_path / 'cache.json'))
+    reader.get_range(start_date=START_DATE, end_date=END_DATE, location='PCB', toll='2.0TD', fetch=database.fetch)
+    reader.save()
+
+    # A sync in another process re-ingests a day, without loading the cache
+    database.version = 2
+    writer = QueryCache(path=str(tmp_path / 'cache.json'))
+    writer.invalidate(location='PCB', toll='2.0TD', day=date(2023, 1, 4))
+    writer.save()
+
+    docs = reader.get_range(start_date=START_DATE, end_date=END_DATE, location='PCB', toll='2.0TD',
+                            fetch=database.fetch)
+    assert [doc['version'] for doc in docs] == [1, 1, 1, 2, 1, 1, 1, 1, 1, 1]
+    assert database.fetched_days == 11
+
+
+def test_saves_append_only_the_changes_and_compact_the_journal(tmp_path):
+    database = Database()
+    cache = QueryCache(path=str(tmp_path / 'cache.json'), journal_min_bytes=10 ** 9)
+    cache.get_range(start_date=START_DATE, end_date=END_DATE, location='PCB', toll='2.0TD', fetch=database.fetch)
+    cache.save()
+    journal_size = os.path.getsize(cache.journal_path)
+    cache.save()
+    assert os.path.getsize(cache.journal_path) == journal_size
+
+    cache.invalidate(location='PCB', toll='2.0TD', day=date(2023, 1, 4))
+    cache.save()
+    assert 0 < os.path.getsize(cache.journal_path) - journal_size < journal_size
+    assert not os.path.isfile(cache.path)
+
+    # Folded into the snapshot once the journal is larger than it
+    cache.journal_min_bytes = 0
+    cache.get_range(start_date=END_DATE + timedelta(days=1), end_date=END_DATE + timedelta(days=2), location='PCB',
+                    toll='2.0TD', fetch=database.fetch)
+    cache.save()
+    assert os.path.isfile(cache.path) and os.path.getsize(cache.journal_path) == 0
+
+    reloaded = QueryCache(path=str(tmp_path / 'cache.json'))
+    docs = reloaded.get_range(start_date=START_DATE, end_date=END_DATE + timedelta(days=2), location='PCB',
+                              toll='2.0TD', fetch=database.fetch)
+    assert len(docs) == 12 and database.fetched_days == 13
+
+
+def test_days_written_through_a_writer_are_invalidated_once_committed(tmp_path):
+    pd = pytest.importorskip('pandas')
+    pytest.importorskip('firebase_admin')
+    from data_management.firebase.batch_writer import BatchWriter
+    from data_management.firebase.firebase_manager import FirebaseManager
+    from data_management.firebase.firebase_querier import FirebaseQuerier
+    from benchmarks.memory_client import MemoryClient
+    from data_management.manifest import DataManifest
+
+    def day_frame(price: float) -> pd.DataFrame:
+        return pd.DataFrame({'date': START_DATE.strftime(EXPECTED_DATE_FORMAT), 'hour': range(24), 'toll': '2.0TD',
+                             'period': 1, 'PVPC_price_kwh': price, 'TEU_charges_kwh': 0.1,
+                             'TCU_production_price_kwh': 0.05, 'location': 'PCB'})
+
+    client, cache = MemoryClient(), QueryCache(path=str(tmp_path / 'cache.json'))
+    manager = FirebaseManager(client=client, manifest=DataManifest(data_folder=str(tmp_path)), query_cache=cache)
+    querier = FirebaseQuerier(client=client, cache=cache)
+    assert manager.post_frame(df=day_frame(price=1.0), location='PCB', toll='2.0TD', skip_if_exist=False)
+
+    writer = BatchWriter(client=client)
+    assert manager.post_frame(df=day_frame(price=2.0), location='PCB', toll='2.0TD', skip_if_exist=False,
+                              writer=writer)
+    # A query between the buffering and the commit caches the old document again
+    assert querier.avg_price_between_dates_by_hour(start_date=START_DATE, end_date=START_DATE)[0] == 1.0
+    writer.close()
+    manager.flush()
+    assert querier.avg_price_between_dates_by_hour(start_date=START_DATE, end_date=START_DATE)[0] == 2.0
@@ -0,0 +1,87 @@
+import os
+from datetime import date, datetime, timedelta
+
+import pytest
+
+from data_management.raw_cache import RawCache
+
+DAY = date(2023, 3, 1)
+
+
+def read_bytes(path: str) -> bytes:
+    with open(path, 'rb') as f:
+        return f.read()
+
+
+def test_put_and_get(tmp_path):
+    cache = RawCache(folder=str(tmp_path))
+    assert cache.get(day=DAY) is None
+    assert cache.put(day=DAY, content=b'first', etag='"a"')
+    assert cache.get(day=DAY) == b'first'
+    # Same content again is not a change, and is stored once
+    assert not cache.put(day=DAY, content=b'first', etag='"a"')
+    assert cache.put(day=DAY + timedelta(days=1), content=b'first')
+    assert len(os.listdir(os.path.join(str(tmp_path), 'objects'))) == 1
+    # A revised day is
+    assert cache.put(day=DAY, content=b'revised', etag='"b"')
+    assert cache.get(day=DAY) == b'revised'
+
+    # Only persisted on save
+    assert RawCache(folder=str(tmp_path)).get(day=DAY) is None
+    cache.save()
+    reloaded = RawCache(folder=str(tmp_path))
+    assert reloaded.get(day=DAY) == b'revised' and reloaded.get(day=DAY + timedelta(days=1)) == b'first'
+
+
+def test_conditional_headers(tmp_path):
+    cache = RawCache(folder=str(tmp_path))
+    assert cache.conditional_headers(day=DAY) == {}
+    cache.put(day=DAY, content=b'content', etag='"a"', last_modified='Wed, 01 Mar 2023 00:00:00 GMT')
+    assert cache.conditional_headers(day=DAY) == {'If-None-Match': '"a"',
+                                                  'If-Modified-Since': 'Wed, 01 Mar 2023 00:00:00 GMT'}
+    cache.put(day=DAY + timedelta(days=1), content=b'other', last_modified='Thu, 02 Mar 2023 00:00:00 GMT')
+    assert cache.conditional_headers(day=DAY + timedelta(days=1)) == \
+           {'If-Modified-Since': 'Thu, 02 Mar 2023 00:00:00 GMT'}
+
+    # Without the content, the day must be downloaded again in full
+    for folder, _, files in os.walk(os.path.join(str(tmp_path), 'objects')):
+        for file in files:
+            os.remove(os.path.join(folder, file))
+    assert cache.conditional_headers(day=DAY) == {} and cache.get(day=DAY) is None
+
+
+def test_days_between(tmp_path):
+    cache = RawCache(folder=str(tmp_path))
+    for offset in (0, 2, 3, 9):
+        cache.put(day=DAY + timedelta(days=offset), content=f"{offset}".encode())
+    assert cache.days_between(start_date=DAY + timedelta(days=1), end_date=DAY + timedelta(days=5)) == \
+           [DAY + timedelta(days=2), DAY + timedelta(days=3)]
+    assert cache.days_between(start_date=DAY - timedelta(days=5), end_date=DAY - timedelta(days=1)) == []
+
+
+def test_unchanged_days_are_not_downloaded_again_and_can_be_reparsed_offline(tmp_path):
+    pytest.importorskip('pandas')
+    pytest.importorskip('openpyxl')
+    from benchmarks.esios_stand_in import EsiosStandIn
+    from data_management.prices_downloader import PricesDownloader
+
+    data_folder = str(tmp_path)
+    days = [datetime(2023, 3, 1) + timedelta(days=i) for i in range(2)]
+    with EsiosStandIn() as stand_in:
+        downloader = PricesDownloader(data_folder=data_folder, url=stand_in.url, parse_workers=0)
+        paths = [path for day in days for path in downloader.download_day(date=day)]
+        assert stand_in.not_modified == 0
+        contents = {path: read_bytes(path=path) for path in paths}
+
+        # The server answers 304 and the existing csv files are kept
+        again = PricesDownloader(data_folder=data_folder, url=stand_in.url, parse_workers=0)
+        assert sorted(again.download_day(date=days[0])) == sorted(path for path in paths if '2023-03-01' in path)
+        assert stand_in.not_modified == 1 and stand_in.requests == 3
+
+    # Without the server
+    for path in paths:
+        os.remove(path)
+    offline = PricesDownloader(data_folder=data_folder, url='http://127.0.0.1:9/{date}', parse_workers=0)
+    reparsed = offline.reparse_range(start_date=days[0].date(), end_date=days[-1].date() + timedelta(days=1))
+    assert sorted(reparsed) == sorted(paths)
+    assert all(read_bytes(path=path) == content for path, content in contents.items())
@@ -0,0 +1,70 @@
+from datetime import date, timedelta
+
+import pytest
+
+pd = pytest.importorskip('pandas')
+pytest.importorskip('firebase_admin')
+
+from benchmarks.memory_client import MemoryClient
+from data_management.constants import BY_MONTH
+from data_management.firebase.firebase_manager import FirebaseManager
+from data_management.firebase.firebase_querier import FirebaseQuerier
+from data_management.manifest import DataManifest
+from utils.utils import get_collection
+
+# A whole month plus a day on each side
+START_DATE, END_DATE = date(2023, 2, 28), date(2023, 4, 1)
+
+
+def day_frame(day: date, price: float) -> pd.DataFrame:
+    return pd.DataFrame({'date': day.strftime('%Y-%m-%d'), 'hour': range(24), 'toll': '2.0TD',
+                         'period': [3] * 8 + [2] * 4 + [1] * 12, 'PVPC_price_kwh': [price + hour for hour in range(24)],
+                         'TEU_charges_kwh': 0.1, 'TCU_production_price_kwh': 0.05, 'location': 'PCB'})
+
+
+def post(manager: FirebaseManager, days: list[date], price: float):
+    for day in days:
+        assert manager.post_frame(df=day_frame(day=day, price=price), location='PCB', toll='2.0TD',
+                                  skip_if_exist=False)
+
+
+def hourly_means(client: MemoryClient, use_rollups: bool) -> dict[int, float]:
+    querier = FirebaseQuerier(client=client, use_cache=False, use_rollups=use_rollups)
+    return querier.aggregate_between_dates(start_date=START_DATE, end_date=END_DATE).hourly_means()
+
+
+def rollup_days(client: MemoryClient) -> dict[str, int]:
+    collection_ref = get_collection(client=client, location='PCB', toll='2.0TD', aggregation=BY_MONTH)
+    return {doc.to_dict()['month']: doc.to_dict()['days'] for doc in collection_ref.stream()}
+
+
+def days_between(first: date, last: date) -> list[date]:
+    return [first + timedelta(days=i) for i in range((last - first).days + 1)]
+
+
+def test_closing_the_manager_recomputes_the_rollups_of_revised_days(tmp_path):
+    client = MemoryClient()
+    with FirebaseManager(client=client, manifest=DataManifest(data_folder=str(tmp_path))) as manager:
+        post(manager=manager, days=days_between(START_DATE, END_DATE), price=1.0)
+    assert rollup_days(client=client)['2023-03'] == 31
+    assert hourly_means(client=client, use_rollups=True) == pytest.approx(hourly_means(client=client,
+                                                                                       use_rollups=False))
+
+    # Revised days posted one by one
+    with FirebaseManager(client=client, manifest=DataManifest(data_folder=str(tmp_path))) as manager:
+        post(manager=manager, days=[date(2023, 3, 10), date(2023, 3, 11)], price=5.0)
+    assert hourly_means(client=client, use_rollups=True)[0] > 1.0
+    assert hourly_means(client=client, use_rollups=True) == pytest.approx(hourly_means(client=client,
+                                                                                       use_rollups=False))
+
+
+def test_rollups_missing_days_are_not_trusted(tmp_path):
+    client = MemoryClient()
+    manager = FirebaseManager(client=client, manifest=DataManifest(data_folder=str(tmp_path)))
+    post(manager=manager, days=days_between(START_DATE, date(2023, 3, 20)), price=1.0)
+    manager.flush()
+    # The rest of the month is posted, but its rollup is not recomputed
+    post(manager=manager, days=days_between(date(2023, 3, 21), END_DATE), price=3.0)
+
+    assert hourly_means(client=client, use_rollups=True) == pytest.approx(hourly_means(client=client,
+                                                                                       use_rollups=False))
@@ -0,0 +1,100 @@
+import itertools
+
+import pytest
+
+np = pytest.importorskip('numpy')
+
+from analysis.scheduling import cheapest_windows, cheapest_hours
+
+DAYS = 6
+# Day without prices, and day with a single hour missing
+MISSING_DAY, GAP_DAY, GAP_HOUR = 2, 4, 3
+# (hours, earliest, latest): inside a day, crossing midnight, and the 24 hours from earliest
+WINDOWS = [(3, 8, 20), (4, 22, 7), (2, 18, 18), (5, 6, None), (1, 0, None)]
+
+
+def prices() -> np.ndarray:
+    prices = np.random.default_rng(seed=0).uniform(0.05, 0.3, size=(DAYS, 24))
+    prices[MISSING_DAY] = np.nan
+    prices[GAP_DAY, GAP_HOUR] = np.nan
+    return prices
+
+
+def availability(earliest: int, latest: int | None, hours: int) -> range:
+    if latest is None:
+        return range(earliest, earliest + 24 + hours - 1)
+    return range(earliest, latest if latest > earliest else latest + 24)
+
+
+def window_cost(flat: np.ndarray, start: int, hours: int) -> float:
+    # Hours beyond the last day have no prices
+    window = flat[start:start + hours]
+    return float('nan') if len(window) < hours or np.isnan(window).any() else float(window.sum())
+
+
+@pytest.mark.parametrize('hours, earliest, latest', WINDOWS)
+def test_cheapest_windows_match_a_search_over_every_start(hours: int, earliest: int, latest: int | None):
+    flat = prices().reshape(-1)
+    available = availability(earliest=earliest, latest=latest, hours=hours)
+    fixed_start = available[-hours] % 24
+    result = cheapest_windows(prices=prices(), hours=hours, earliest=earliest, latest=latest, fixed_start=fixed_start,
+                              power_kw=2.0)
+    for day in range(DAYS):
+        costs = {start: window_cost(flat=flat, start=day * 24 + start, hours=hours)
+                 for start in available[:len(available) - hours + 1]}
+        costs = {start: cost for start, cost in costs.items() if not np.isnan(cost)}
+        if len(costs) == 0:
+            assert list(result.hours[day]) == [-1] * hours and np.isnan(result.costs[day])
+            continue
+        best = min(costs, key=costs.get)
+        assert list(result.hours[day]) == list(range(best, best + hours))
+        assert result.costs[day] == pytest.approx(2.0 * costs[best])
+        expected_fixed = window_cost(flat=flat, start=day * 24 + available[-hours], hours=hours)
+        assert result.fixed_costs[day] == pytest.approx(2.0 * expected_fixed, nan_ok=True)
+    assert result.total_savings == pytest.approx(float(np.nansum(result.fixed_costs - result.costs)))
+
+
+def test_windows_edges():
+    # A day without prices has no window
+    result = cheapest_windows(prices=prices(), hours=3, earliest=8, latest=20)
+    assert list(result.hours[MISSING_DAY]) == [-1] * 3
+    assert np.isnan(result.costs[MISSING_DAY]) and np.isnan(result.savings[MISSING_DAY])
+    # The night of the day before it ends in it, while its own night can run in the next day
+    result = cheapest_windows(prices=prices(), hours=4, earliest=22, latest=7)
+    assert result.starts[MISSING_DAY - 1] == -1 and 24 <= result.starts[MISSING_DAY] <= 27
+    # The night of the last day runs into the hours after the range
+    assert result.starts[-1] == -1
+    # The window of a day with a missing hour avoids it
+    gap_result = cheapest_windows(prices=prices(), hours=3, earliest=0, latest=8)
+    assert GAP_HOUR not in gap_result.hours[GAP_DAY]
+    # Without latest, the last day still has the windows inside it
+    assert cheapest_windows(prices=prices(), hours=4, earliest=6).starts[-1] != -1
+
+    # The fixed schedule is given as an hour of the day, and must fit in the availability window
+    assert cheapest_windows(prices=prices(), hours=2, earliest=22, latest=7, fixed_start=3).fixed_costs[0] == \
+           pytest.approx(prices()[1, 3:5].sum())
+    with pytest.raises(AssertionError):
+        cheapest_windows(prices=prices(), hours=2, earliest=22, latest=7, fixed_start=6)
+    with pytest.raises(AssertionError):
+        cheapest_windows(prices=prices(), hours=2, earliest=22, latest=7, fixed_start=12)
+    with pytest.raises(AssertionError):
+        cheapest_windows(prices=prices(), hours=5, earliest=8, latest=12)
+
+
+@pytest.mark.parametrize('hours, earliest, latest', WINDOWS)
+def test_cheapest_hours_match_a_search_over_every_combination(hours: int, earliest: int, latest: int | None):
+    flat = np.concatenate([prices().reshape(-1), np.full(48, np.nan)])
+    available = availability(earliest=earliest, latest=24 + earliest if latest is None else latest, hours=hours)
+    result = cheapest_hours(prices=prices(), hours=hours, earliest=earliest, latest=latest)
+    for day in range(DAYS):
+        costs = {selection: float(flat[[day * 24 + hour for hour in selection]].sum())
+                 for selection in itertools.combinations(available, hours)}
+        costs = {selection: cost for selection, cost in costs.items() if not np.isnan(cost)}
+        if len(costs) == 0:
+            assert list(result.hours[day]) == [-1] * hours and np.isnan(result.costs[day])
+            continue
+        best = min(costs, key=costs.get)
+        assert tuple(result.hours[day]) == best
+        assert result.costs[day] == pytest.approx(costs[best])
+        assert result.fixed_costs[day] == pytest.approx(flat[day * 24 + available[0]:
+                                                             day * 24 + available[0] + hours].sum(), nan_ok=True)
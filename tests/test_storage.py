@@ -0,0 +1,75 @@
+from datetime import date, timedelta
+
+import pytest
+
+pytest.importorskip('numpy')
+pytest.importorskip('firebase_admin')
+
+from benchmarks.memory_client import MemoryClient
+from data_management.constants import PRICE_FIELDS
+from data_management.storage.base import StorageBackend, replicate
+from data_management.storage.firestore_backend import FirestoreBackend
+from data_management.storage.sqlite_backend import SQLiteBackend
+
+START_DATE, DAYS = date(2023, 5, 30), 5
+
+
+def day_doc(day: date) -> dict:
+    return {'date': day.strftime('%Y-%m-%d'), 'location': 'PCB', 'toll': '2.0TD', 'period': [3] * 8 + [2] * 16,
+            **{field: [0.1 * hour for hour in range(24)] for field in PRICE_FIELDS}}
+
+
+class CountingFirestoreBackend(FirestoreBackend):
+    def __init__(self, client):
+        super().__init__(client=client)
+        self.range_queries = 0
+
+    def get_days_between_dates(self, *args, **kwargs) -> list[dict]:
+        self.range_queries += 1
+        return super().get_days_between_dates(*args, **kwargs)
+
+
+def test_replicate_starts_at_the_first_day_of_the_source(tmp_path):
+    source = CountingFirestoreBackend(client=MemoryClient())
+    source.write_days(docs=[day_doc(day=START_DATE + timedelta(days=i)) for i in range(DAYS)])
+    assert source.first_date() == START_DATE
+    assert source.last_date() == START_DATE + timedelta(days=DAYS - 1)
+
+    target = SQLiteBackend(path=':memory:')
+    assert target.first_date() is None
+    assert replicate(source=source, target=target, location_tolls=[('PCB', '2.0TD')]) == DAYS
+    assert source.range_queries == 1
+    assert target.first_date() == START_DATE
+    assert target.avg_price_between_dates_by_hour(start_date=START_DATE, end_date=START_DATE + timedelta(days=DAYS)) \
+        == pytest.approx(source.avg_price_between_dates_by_hour(start_date=START_DATE,
+                                                                end_date=START_DATE + timedelta(days=DAYS)))
+
+    # Only the days after the last one of the target are copied
+    assert replicate(source=source, target=target, location_tolls=[('PCB', '2.0TD')]) == 0
+
+
+def test_backends_must_implement_the_core_methods():
+    class IncompleteBackend(StorageBackend):
+        def write_days(self, docs: list[dict]) -> int:
+            return len(docs)
+
+    with pytest.raises(TypeError):
+        IncompleteBackend()
+
+
+def test_price_index_and_backtester_read_from_any_backend(tmp_path):
+    from analysis.backtesting import BillBacktester
+    from data_management.price_index import PriceIndex
+
+    backend = SQLiteBackend(path=':memory:')
+    backend.write_days(docs=[day_doc(day=START_DATE + timedelta(days=i)) for i in range(DAYS)])
+    end_date = START_DATE + timedelta(days=DAYS - 1)
+
+    index = PriceIndex(folder=str(tmp_path))
+    index.update(source=backend, start_date=START_DATE, end_date=end_date)
+    assert index.avg_by_hour(start_date=START_DATE, end_date=end_date) == \
+           pytest.approx(backend.avg_price_between_dates_by_hour(start_date=START_DATE, end_date=end_date))
+
+    backtester = BillBacktester.from_backend(backend=backend, start_date=START_DATE, end_date=end_date,
+                                             pairs=[('PCB', '2.0TD')])
+    assert not backtester.prices.missing.any()
@@ -0,0 +1,66 @@
+from datetime import date, datetime, timedelta
+
+import pytest
+
+pytest.importorskip('aiohttp')
+pytest.importorskip('firebase_admin')
+
+from data_management.constants import EXPECTED_DATE_FORMAT
+from data_management.sync import IncrementalSync
+
+# ESIOS stopped publishing the old tolls after this day
+RETIRED_AFTER = date(2021, 5, 31)
+
+
+class FakePipeline:
+    def __init__(self):
+        self.runs = []
+
+    def run(self, start_date: datetime, end_date: datetime, skip_if_exist: bool, skip_unchanged: bool) -> dict:
+        self.runs.append((start_date.date(), end_date.date()))
+        last_days = {'PCB/2.0TD': end_date.date()}
+        if start_date.date() <= RETIRED_AFTER:
+            last_days['PCB/2.0A'] = min(end_date.date(), RETIRED_AFTER)
+        return {'last_days': {pair: day.strftime(EXPECTED_DATE_FORMAT) for pair, day in last_days.items()}}
+
+
+def build_sync(tmp_path, pipeline: FakePipeline) -> IncrementalSync:
+    return IncrementalSync(pipeline=pipeline, state_path=str(tmp_path / 'state.json'),
+                           lock_path=str(tmp_path / 'sync.lock'), lookback_days=3, initial_date=date(2020, 1, 1))
+
+
+def test_retired_tolls_do_not_hold_the_sync_back(tmp_path):
+    pipeline = FakePipeline()
+    build_sync(tmp_path=tmp_path, pipeline=pipeline).run(end_date=date(2024, 1, 10))
+    sync = build_sync(tmp_path=tmp_path, pipeline=pipeline)
+    assert sync.watermarks == {'PCB/2.0TD': '2024-01-10'}
+    assert sync.retired == {'PCB/2.0A': '2021-05-31'}
+
+    sync.run(end_date=date(2024, 1, 11))
+    assert pipeline.runs[-1] == (date(2024, 1, 8), date(2024, 1, 11))
+    assert sync.watermarks == {'PCB/2.0TD': '2024-01-11'}
+
+
+def test_sync_starts_from_the_newest_watermark(tmp_path):
+    pipeline = FakePipeline()
+    sync = build_sync(tmp_path=tmp_path, pipeline=pipeline)
+    # State written before tolls were retired
+    sync.watermarks = {'PCB/2.0TD': '2024-01-10', 'PCB/2.0A': '2021-05-31'}
+    sync.save()
+
+    sync.run(end_date=date(2024, 1, 12))
+    assert pipeline.runs == [(date(2024, 1, 8), date(2024, 1, 12))]
+    assert sync.watermarks == {'PCB/2.0TD': '2024-01-12'} and sync.retired == {'PCB/2.0A': '2021-05-31'}
+
+
+def test_retired_tolls_published_again_are_synced(tmp_path):
+    pipeline = FakePipeline()
+    sync = build_sync(tmp_path=tmp_path, pipeline=pipeline)
+    sync.watermarks, sync.retired = {'PCB/2.0TD': '2024-01-10'}, {'CYM/2.0TD': '2023-12-01'}
+    sync.save()
+    pipeline.run = lambda start_date, end_date, **kwargs: {
+        'last_days': {'PCB/2.0TD': end_date.strftime(EXPECTED_DATE_FORMAT),
+                      'CYM/2.0TD': (end_date - timedelta(days=1)).strftime(EXPECTED_DATE_FORMAT)}}
+
+    sync.run(end_date=date(2024, 1, 12))
+    assert sync.watermarks == {'PCB/2.0TD': '2024-01-12', 'CYM/2.0TD': '2024-01-11'} and sync.retired == {}
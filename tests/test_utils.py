@@ -0,0 +1,112 @@
+import os
+from copy import deepcopy
+from datetime import date, datetime, timedelta
+
+import pytest
+
+np = pytest.importorskip('numpy')
+pd = pytest.importorskip('pandas')
+
+from benchmarks.bench_csv_loader import legacy_load_csv_as_dicts
+from data_management.constants import PRICE_FIELDS
+from data_management.manifest import DataManifest
+from utils.utils import load_csv_as_dicts, load_date_range_as_frame, frame_to_day_arrays, add_datetime_column
+
+# The summer time change day (23 hours) and the winter one (25 hours) of 2023, among regular days
+DAYS = {date(2023, 3, 25): 24, date(2023, 3, 26): 23, date(2023, 3, 27): 24,
+        date(2023, 10, 28): 24, date(2023, 10, 29): 25, date(2023, 10, 30): 24}
+LOCATION_TOLLS = [('CYM', '2.0TD'), ('PCB', '2.0TD'), ('PCB', '3.0TD')]
+
+
+def write_csvs(data_folder: str) -> dict[tuple[str, str, date], str]:
+    rng = np.random.default_rng(seed=0)
+    paths = {}
+    for location, toll in LOCATION_TOLLS:
+        os.makedirs(os.path.join(data_folder, location, toll))
+        for day, hours in DAYS.items():
+            teu, tcu = np.round(rng.uniform(0.0, 0.05, size=hours), 6), np.round(rng.uniform(0.05, 0.3, size=hours), 6)
+            path = os.path.join(data_folder, location, toll, f"{day.strftime('%Y-%m-%d')}.csv")
+            pd.DataFrame({'date': day.strftime('%Y-%m-%d'), 'hour': [min(hour, 23) for hour in range(hours)],
+                          'toll': toll, 'period': rng.integers(1, 4, size=hours), 'PVPC_price_kwh': teu + tcu,
+                          'TEU_charges_kwh': teu, 'TCU_production_price_kwh': tcu, 'location': location}).\
+                to_csv(path, index=False)
+            paths[(location, toll, day)] = path
+    return paths
+
+
+def legacy_day_rows(csv_path: str) -> list[dict]:
+    # Row-wise loader, and the day length fix the posting logic applied to its rows
+    rows = legacy_load_csv_as_dicts(csv_path=csv_path)
+    if len(rows) == 23:
+        fake_last_hour = deepcopy(rows[-1])
+        fake_last_hour['hour'] = 23
+        rows.append(fake_last_hour)
+    assert len(rows) == 24
+    return rows
+
+
+@pytest.fixture
+def data(tmp_path):
+    data_folder = str(tmp_path)
+    return data_folder, write_csvs(data_folder=data_folder)
+
+
+def test_load_date_range_as_frame_matches_the_row_wise_loader(data):
+    data_folder, paths = data
+    start_date, end_date = date(2023, 3, 20), date(2023, 11, 5)
+    frame = load_date_range_as_frame(start_date=start_date, end_date=end_date, data_folder=data_folder)
+    # Days without csv are missing, and every other day has 24 rows
+    assert len(frame) == len(paths) * 24
+
+    expected = [row for location, toll in LOCATION_TOLLS for day in DAYS
+                for row in legacy_day_rows(csv_path=paths[(location, toll, day)])]
+    rows = frame.to_dict(orient='records')
+    for row, legacy_row in zip(rows, expected):
+        assert {key: row[key] for key in legacy_row if key != 'datetime_spain'} == \
+               {key: value for key, value in legacy_row.items() if key != 'datetime_spain'}
+        if legacy_row['hour'] == 23 and legacy_row['datetime_spain'].hour == 22:
+            # The hour repeated in the summer time change day gets its own datetime, instead of the one of hour 22
+            assert row['datetime_spain'] == legacy_row['datetime_spain'] + timedelta(hours=1)
+        else:
+            assert row['datetime_spain'] == legacy_row['datetime_spain']
+    assert frame['datetime_spain'].dt.hour.tolist() == list(range(24)) * len(paths)
+
+    # The manifest resolves the same files
+    manifest = DataManifest(data_folder=data_folder)
+    pd.testing.assert_frame_equal(load_date_range_as_frame(start_date=start_date, end_date=end_date,
+                                                           manifest=manifest), frame)
+    # Only the requested pairs and days
+    only = load_date_range_as_frame(start_date=date(2023, 3, 26), end_date=date(2023, 3, 26),
+                                    location_tolls=[('PCB', '3.0TD')], data_folder=data_folder)
+    assert len(only) == 24 and set(only['toll']) == {'3.0TD'} and set(only['date']) == {'2023-03-26'}
+    empty = load_date_range_as_frame(start_date=date(2023, 1, 1), end_date=date(2023, 1, 2), data_folder=data_folder)
+    assert len(empty) == 0 and 'datetime_spain' in empty.columns
+
+
+def test_frame_to_day_arrays(data):
+    data_folder, paths = data
+    frame = load_date_range_as_frame(start_date=min(DAYS), end_date=max(DAYS), data_folder=data_folder)
+    arrays = frame_to_day_arrays(df=frame)
+    assert all(arrays[field].shape == (len(paths), 24) for field in PRICE_FIELDS + ('period',))
+    keys = list(zip(arrays['location'], arrays['toll'], arrays['date']))
+    assert keys == [(location, toll, day.strftime('%Y-%m-%d')) for location, toll in LOCATION_TOLLS for day in DAYS]
+    for i, (location, toll, date_str) in enumerate(keys):
+        legacy_rows = legacy_day_rows(csv_path=paths[(location, toll, datetime.strptime(date_str, '%Y-%m-%d').date())])
+        for field in PRICE_FIELDS + ('period',):
+            np.testing.assert_array_equal(arrays[field][i], [row[field] for row in legacy_rows])
+
+    with pytest.raises(AssertionError):
+        frame_to_day_arrays(df=frame.iloc[:-1])
+
+
+def test_add_datetime_column_matches_the_row_wise_loader(data):
+    data_folder, paths = data
+    for path in paths.values():
+        legacy_rows, rows = legacy_load_csv_as_dicts(csv_path=path), load_csv_as_dicts(csv_path=path)
+        assert [row['datetime_spain'] for row in rows] == [row['datetime_spain'] for row in legacy_rows]
+
+    df = pd.DataFrame({'date': ['2023-03-26', '2023-10-29'], 'hour': [0, 23]})
+    assert add_datetime_column(df=df, datetime_column_name='when')['when'].tolist() == \
+           [datetime(2023, 3, 26, 0), datetime(2023, 10, 29, 23)]
+    with pytest.raises(AssertionError):
+        add_datetime_column(df=pd.DataFrame({'date': ['2023-03-26'], 'hour': [24]}))
@@ -0,0 +1,310 @@
+"""
+Process wide metrics of the ingest and query paths: timing histograms, counters (bytes, RPCs, documents...) and
+gauges (queue depths). Collection is disabled by default, and then every call returns right after checking a flag,
+so the instrumented code runs at the same speed. Snapshots are written as a Prometheus text file (for the textfile
+collector of node_exporter) or as json. A single pipeline stage can also be profiled with cProfile
+"""
+
+import cProfile
+import json
+import os
+import time
+from bisect import bisect_left
+from contextlib import nullcontext, contextmanager
+from datetime import datetime
+from functools import wraps
+from threading import Lock
+
+from data_management.constants import METRICS_PREFIX, METRICS_TIME_BUCKETS, METRICS_PROMETHEUS_PATH, \
+    METRICS_JSON_PATH, PROFILE_FOLDER
+
+# Shared by every disabled timer or profile block, it does nothing
+_NULL_CONTEXT = nullcontext()
+
+
+class Histogram:
+    def __init__(self, buckets: tuple[float, ...] = METRICS_TIME_BUCKETS):
+        """
+        Distribution of observed values, as counts per bucket
+
+        :param buckets: tuple[float, ...]. Sorted upper bounds of the buckets. Larger values go to an implicit +Inf one
+        """
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.count, self.sum = 0, 0.0
+        self.min, self.max = float('inf'), float('-inf')
+
+    def observe(self, value: float):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+        self.min, self.max = min(self.min, value), max(self.max, value)
+
+    def cumulative_counts(self) -> list[int]:
+        """
+        :return: list[int]. Observations lower or equal than each bucket bound (and +Inf), as Prometheus expects
+        """
+        cumulative, total = [], 0
+        for count in self.counts:
+            total += count
+            cumulative.append(total)
+        return cumulative
+
+
+class _Timer:
+    __slots__ = ('registry', 'name', 'labels', 'start_time')
+
+    def __init__(self, registry, name: str, labels: dict[str, str]):
+        self.registry, self.name, self.labels = registry, name, labels
+
+    def __enter__(self):
+        self.start_time = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.registry.observe(self.name, time.perf_counter() - self.start_time, **self.labels)
+
+
+class MetricsRegistry:
+    def __init__(self, prefix: str = METRICS_PREFIX):
+        """
+        Thread safe registry of metrics, identified by name and labels. Names follow the Prometheus conventions
+        (counters end in _total, timings in _seconds)
+
+        :param prefix: str. Prefix added to every metric name when exported
+        """
+        self.prefix = prefix
+        self.enabled = False
+        self.profile_stage = None
+        self._lock = Lock()
+        self._counters, self._gauges, self._histograms = {}, {}, {}
+        self._profiler, self._profile_lock = None, Lock()
+
+    def enable(self, profile_stage: str | None = None):
+        """
+        Start collecting metrics
+
+        :param profile_stage: str | None. If given, the code run inside profile(stage=profile_stage) blocks is
+                                profiled with cProfile (one block at a time, other threads in the same stage are
+                                not profiled meanwhile). Stages: 'download', 'parse', 'publish' (see IngestPipeline)
+        """
+        self.enabled = True
+        self.profile_stage = profile_stage
+        if profile_stage is not None and self._profiler is None:
+            self._profiler = cProfile.Profile()
+
+    def disable(self):
+        """
+        Stop collecting metrics and profiling. The metrics and profile stats collected so far are kept until reset()
+        """
+        self.enabled = False
+
+    def reset(self):
+        """
+        Drop every metric collected and the profile stats
+        """
+        with self._lock:
+            self._counters, self._gauges, self._histograms = {}, {}, {}
+        self._profiler = cProfile.Profile() if self.profile_stage is not None else None
+
+    def inc(self, name: str, amount: float = 1, **labels):
+        """
+        Increase a counter
+
+        :param name: str. Name of the counter, as 'http_bytes_total'
+        :param amount: float. Amount to add
+        :param labels: Labels of the counter, as status='200'
+        """
+        if not self.enabled:
+            return
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + amount
+
+    def set_gauge(self, name: str, value: float, **labels):
+        """
+        Set the current value of a gauge. The maximum value set is kept as <name>_max
+
+        :param name: str. Name of the gauge, as 'pipeline_queue_depth'
+        :param value: float. Current value
+        :param labels: Labels of the gauge, as queue='parse'
+        """
+        if not self.enabled:
+            return
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            _, maximum = self._gauges.get(key, (value, value))
+            self._gauges[key] = (value, max(maximum, value))
+
+    def observe(self, name: str, value: float, buckets: tuple[float, ...] = METRICS_TIME_BUCKETS, **labels):
+        """
+        Add an observation to a histogram
+
+        :param name: str. Name of the histogram, as 'xls_parse_seconds'
+        :param value: float. Observed value
+        :param buckets: tuple[float, ...]. Bucket bounds, only used when the histogram is created
+        :param labels: Labels of the histogram
+        """
+        if not self.enabled:
+            return
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = Histogram(buckets=buckets)
+            histogram.observe(value)
+
+    def timer(self, name: str, **labels):
+        """
+        Context manager that observes the seconds spent inside it in a histogram
+
+        :param name: str. Name of the histogram, as 'firestore_commit_seconds'
+        :param labels: Labels of the histogram
+
+        :return: Context manager. A shared no-op one when metrics are disabled
+        """
+        if not self.enabled:
+            return _NULL_CONTEXT
+        return _Timer(registry=self, name=name, labels=labels)
+
+    def timed(self, name: str, **labels):
+        """
+        Decorator version of timer()
+        """
+        def decorator(function):
+            @wraps(function)
+            def wrapper(*args, **kwargs):
+                with self.timer(name, **labels):
+                    return function(*args, **kwargs)
+            return wrapper
+        return decorator
+
+    def profile(self, stage: str):
+        """
+        Context manager that profiles the code inside it with cProfile, only if stage is the one given to enable()
+
+        :param stage: str. Stage the code belongs to
+
+        :return: Context manager. A shared no-op one when the stage is not being profiled
+        """
+        if not self.enabled or stage != self.profile_stage or self._profiler is None:
+            return _NULL_CONTEXT
+        return self.__profiled()
+
+    @contextmanager
+    def __profiled(self):
+        # cProfile only follows the thread that enabled it, and a profiler can't be enabled twice
+        if not self._profile_lock.acquire(blocking=False):
+            yield
+            return
+        try:
+            self._profiler.enable()
+            yield
+        finally:
+            self._profiler.disable()
+            self._profile_lock.release()
+
+    def snapshot(self) -> dict:
+        """
+        :return: dict. Every metric collected, as {'timestamp', 'counters', 'gauges', 'histograms'}. Each metric is a
+                        dict with its name and labels
+        """
+        with self._lock:
+            return {
+                'timestamp': datetime.now().isoformat(),
+                'counters': [{'name': name, 'labels': dict(labels), 'value': value}
+                             for (name, labels), value in sorted(self._counters.items())],
+                'gauges': [{'name': name, 'labels': dict(labels), 'value': value, 'max': maximum}
+                           for (name, labels), (value, maximum) in sorted(self._gauges.items())],
+                'histograms': [{'name': name, 'labels': dict(labels), 'count': histogram.count, 'sum': histogram.sum,
+                                'min': histogram.min, 'max': histogram.max,
+                                'buckets': dict(zip([*map(str, histogram.buckets), '+Inf'],
+                                                    histogram.cumulative_counts()))}
+                               for (name, labels), histogram in sorted(self._histograms.items())]
+            }
+
+    def to_prometheus(self) -> str:
+        """
+        :return: str. Every metric collected in the Prometheus text exposition format
+        """
+        snapshot = self.snapshot()
+        lines, typed = [], set()
+
+        def add(name: str, labels: dict, value: float, kind: str | None = None):
+            # The TYPE line goes once, before the first sample of each metric
+            if kind is not None and name not in typed:
+                typed.add(name)
+                lines.append(f"# TYPE {name} {kind}")
+            labels = ','.join(f'{key}="{_escape(label)}"' for key, label in labels.items())
+            lines.append(f"{name}{{{labels}}} {value}" if labels else f"{name} {value}")
+
+        for counter in snapshot['counters']:
+            add(f"{self.prefix}_{counter['name']}", counter['labels'], counter['value'], kind='counter')
+        for gauge in snapshot['gauges']:
+            add(f"{self.prefix}_{gauge['name']}", gauge['labels'], gauge['value'], kind='gauge')
+        for gauge in snapshot['gauges']:
+            add(f"{self.prefix}_{gauge['name']}_max", gauge['labels'], gauge['max'], kind='gauge')
+        for histogram in snapshot['histograms']:
+            name = f"{self.prefix}_{histogram['name']}"
+            if name not in typed:
+                typed.add(name)
+                lines.append(f"# TYPE {name} histogram")
+            for bound, count in histogram['buckets'].items():
+                add(f"{name}_bucket", {**histogram['labels'], 'le': bound}, count)
+            add(f"{name}_sum", histogram['labels'], histogram['sum'])
+            add(f"{name}_count", histogram['labels'], histogram['count'])
+        return '\n'.join(lines) + '\n'
+
+    def write_prometheus(self, path: str = METRICS_PROMETHEUS_PATH) -> str:
+        """
+        Write the metrics as a Prometheus text file (atomically, so a collector never reads half a file)
+
+        :param path: str. Path of the file
+
+        :return: str. Path of the file
+        """
+        return self.__write(path=path, content=self.to_prometheus())
+
+    def write_json(self, path: str = METRICS_JSON_PATH) -> str:
+        """
+        Write a json snapshot of the metrics (atomically)
+
+        :param path: str. Path of the file
+
+        :return: str. Path of the file
+        """
+        return self.__write(path=path, content=json.dumps(self.snapshot(), indent=2))
+
+    def write_profile(self, folder: str = PROFILE_FOLDER) -> str | None:
+        """
+        Write the cProfile stats of the profiled stage, readable with pstats or snakeviz
+
+        :param folder: str. Folder of the stats, written as <folder>/<stage>.prof
+
+        :return: str | None. Path of the stats. None if no stage was profiled
+        """
+        if self._profiler is None or self.profile_stage is None:
+            return None
+        os.makedirs(folder, exist_ok=True)
+        path = os.path.join(folder, f"{self.profile_stage}.prof")
+        with self._profile_lock:
+            self._profiler.dump_stats(path)
+        return path
+
+    @staticmethod
+    def __write(path: str, content: str) -> str:
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, 'w') as f:
+            f.write(content)
+        os.replace(tmp_path, path)
+        return path
+
+
+def _escape(label) -> str:
+    # Backslashes, quotes and new lines must be escaped in Prometheus label values
+    return str(label).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+# Registry used by every instrumented module
+metrics = MetricsRegistry()
@@ -0,0 +1,49 @@
+"""
+Plots of the query results. matplotlib is only imported when a plot is drawn, and plots written to a file use the
+non-interactive Agg backend, so they work without a display (servers, cron, CI)
+"""
+
+PERIOD_COLORS = {
+    1: 'red',
+    2: 'orange',
+    3: 'green'
+}
+
+
+def plot_avg_price_by_hour(prices_by_hour: dict[int, float], periods_by_hour: list[int],
+                           plot_path: str | None = None) -> str | None:
+    """
+    Bar plot of the average price of each hour, colored by the period of the hour
+
+    :param prices_by_hour: dict[int, float]. Average price of each hour
+    :param periods_by_hour: list[int]. Period of each hour, to color the bars
+    :param plot_path: str | None. If given, the plot is written to this file (format from its extension) without
+                        opening any window. If None, it is shown in an interactive window (blocking)
+
+    :return: str | None. Path of the file written, if any
+    """
+    import matplotlib
+    if plot_path is not None:
+        matplotlib.use('Agg')
+    import matplotlib.pyplot as plt
+
+    figure, axes = plt.subplots()
+    # Use the period by hour as color for the bars (periods of tolls with more than 3 are grey)
+    colors = [PERIOD_COLORS.get(period, 'grey') for period in periods_by_hour] if periods_by_hour else None
+    axes.bar(list(prices_by_hour.keys()), list(prices_by_hour.values()), color=colors)
+    # Draw the value of the average price
+    axes.axhline(y=sum(prices_by_hour.values()) / max(len(prices_by_hour), 1), color='r', linestyle='-')
+    # Write the value of each bar
+    for i, price in prices_by_hour.items():
+        axes.text(i, round(price, 3), f'{price:.2f}', ha='center', va='bottom')
+    axes.set_xlabel('Hour')
+    axes.set_ylabel('Average price')
+    axes.set_title('Average price by hour')
+    # Show all x-ticks
+    axes.set_xticks(range(24))
+    if plot_path is None:
+        plt.show()
+        return None
+    figure.savefig(plot_path)
+    plt.close(figure)
+    return plot_path
@@ -1,12 +1,12 @@
 import os
-from collections import defaultdict
-from datetime import datetime
+from datetime import datetime, date, timedelta
+import numpy as np
 import pandas as pd
 
-from data_management.constants import PVPC_PRICES, LOCATIONS, TOLLS, NO_AGGREGATION, PRICES, LOCATION_DESCRIPTIONS, \
-    BY_DAY
-
-CHECKED_LOCATIONS, CHECKED_TOLLS = {NO_AGGREGATION: set(), BY_DAY: set()}, {NO_AGGREGATION: defaultdict(set), BY_DAY: defaultdict(set)}
+from data_management.constants import NO_AGGREGATION, LOCATION_DESCRIPTIONS, DATA_FOLDER, EXPECTED_DATE_FORMAT, \
+    PRICE_FIELDS
+from data_management.firebase.client_pool import get_registry
+from utils.metrics import metrics
 
 def load_csv_as_dicts(csv_path: str, datetime_column_name: str = 'datetime_spain') -> list[dict]:
     """
@@ -16,19 +16,107 @@ def load_csv_as_dicts(csv_path: str, datetime_column_name: str = 'datetime_spain
     :return: list[dict]. List of dictionaries with the data from the csv file
     """
     # Read the csv
-    df = pd.read_csv(filepath_or_buffer=csv_path, sep=',')
+    with metrics.timer('csv_read_seconds'):
+        df = pd.read_csv(filepath_or_buffer=csv_path, sep=',')
+    metrics.inc('csv_files_read_total')
     # If the day contains 25 hours, that's a winter time change, let's assume the last hour never existed
     if len(df) == 25:
         df = df[:-1]
     # Build a date time column
-    df[datetime_column_name] = df.apply(
-        lambda row: datetime.strptime(f"{row['date']} {row['hour']}:00", "%Y-%m-%d %H:%M"), axis=1)
+    df = add_datetime_column(df=df, datetime_column_name=datetime_column_name)
 
     # Convertir el dataframe a una lista de diccionarios
     data_list = df.to_dict(orient='records')
 
     return data_list
 
+def add_datetime_column(df: pd.DataFrame, datetime_column_name: str = 'datetime_spain') -> pd.DataFrame:
+    """
+    Build the datetime column from the 'date' and 'hour' columns in a single vectorized operation
+
+    :param df: pd.DataFrame. Dataframe with the 'date' (as %Y-%m-%d) and 'hour' (0 to 23) columns
+    :param datetime_column_name: str. Name of the column to create
+
+    :return: pd.DataFrame. The same dataframe with the new column
+    """
+    assert df['hour'].between(0, 23).all(), f"Hours must be between 0 and 23"
+    df[datetime_column_name] = pd.to_datetime(df['date'], format=EXPECTED_DATE_FORMAT) + \
+                               pd.to_timedelta(df['hour'].astype(int), unit='h')
+    return df
+
+def fix_day_length(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    Make a single day dataframe have exactly 24 rows, one for each hour. Same criteria as the posting logic: in the
+    summer time change day (23 rows) the last hour is repeated as hour 23, and in the winter time change day
+    (25 rows) the last hour is dropped
+
+    :param df: pd.DataFrame. Dataframe with the rows of a single day, sorted by hour
+
+    :return: pd.DataFrame. Dataframe with 24 rows
+    """
+    if len(df) == 23:
+        fake_last_hour = df.iloc[[-1]].copy()
+        fake_last_hour['hour'] = 23
+        df = pd.concat([df, fake_last_hour], ignore_index=True)
+    elif len(df) == 25:
+        df = df[:-1]
+    assert len(df) == 24, f"Expected 24 rows, got {len(df)}"
+    return df
+
+def load_date_range_as_frame(start_date: date, end_date: date, location_tolls: list[tuple[str, str]] | None = None,
+                             data_folder: str = DATA_FOLDER, manifest=None,
+                             datetime_column_name: str = 'datetime_spain') -> pd.DataFrame:
+    """
+    Load all the csv files of a date range into a single dataframe. Every day is normalized to 24 rows and the
+    datetime column is built once for the whole range
+
+    :param start_date: date. Start date of the range (included)
+    :param end_date: date. End date of the range (included)
+    :param location_tolls: list[tuple[str, str]] | None. (location, toll) pairs to load. If None, all the ones
+                            found in data_folder
+    :param data_folder: str. Folder organized as <data_folder>/<PCB|CYM>/<TOLL>/<date>.csv
+    :param manifest: DataManifest | None. If given, files are resolved through it instead of data_folder
+    :param datetime_column_name: str. Name of the datetime column to create
+
+    :return: pd.DataFrame. Dataframe with 24 rows per location/toll/day found, sorted by location, toll and datetime.
+                            Days without csv are just missing
+    """
+    assert start_date <= end_date, f"start_date must be before end_date"
+    if location_tolls is None:
+        location_tolls = get_location_tolls(parent_folder=data_folder) if manifest is None else manifest.location_tolls()
+    frames = []
+    for location, toll in location_tolls:
+        for i in range((end_date - start_date).days + 1):
+            day = start_date + timedelta(days=i)
+            if manifest is None:
+                csv_path = os.path.join(data_folder, location, toll, f"{day.strftime(EXPECTED_DATE_FORMAT)}.csv")
+            else:
+                csv_path = manifest.get(day=day, location=location, toll=toll)
+            if csv_path is not None and os.path.isfile(csv_path):
+                with metrics.timer('csv_read_seconds'):
+                    frames.append(fix_day_length(df=pd.read_csv(filepath_or_buffer=csv_path, sep=',')))
+                metrics.inc('csv_files_read_total')
+    if len(frames) == 0:
+        return pd.DataFrame(columns=['date', 'hour', 'toll', 'period', *PRICE_FIELDS, 'location', datetime_column_name])
+    df = pd.concat(frames, ignore_index=True)
+    return add_datetime_column(df=df, datetime_column_name=datetime_column_name)
+
+def frame_to_day_arrays(df: pd.DataFrame, fields: tuple[str, ...] = PRICE_FIELDS + ('period',)) -> dict[str, np.ndarray]:
+    """
+    Reshape a dataframe built by load_date_range_as_frame into arrays of shape (days, 24)
+
+    :param df: pd.DataFrame. Dataframe with 24 consecutive rows per location/toll/day
+    :param fields: tuple[str, ...]. Columns to reshape
+
+    :return: dict[str, np.ndarray]. Dict with an array of shape (days, 24) for each field, and the 'date', 'location'
+                                    and 'toll' arrays of shape (days,) identifying each row
+    """
+    assert len(df) % 24 == 0, f"Expected 24 rows per day, got {len(df)} rows"
+    arrays = {field: df[field].to_numpy().reshape(-1, 24) for field in fields}
+    for key in ('date', 'location', 'toll'):
+        arrays[key] = df[key].to_numpy()[::24]
+    return arrays
+
 def get_all_files_with_filename_in_subfolders(parent_folder: str, filename: str) -> dict[dict[str, str]]:
     """
     Get all the files with a given filename in a folder and its subfolders. Organized by subfolders as
@@ -58,6 +146,25 @@ def get_all_files_with_filename_in_subfolders(parent_folder: str, filename: str)
 
     return files_dict
 
+def get_location_tolls(parent_folder: str) -> list[tuple[str, str]]:
+    """
+    Get the (location, toll) pairs that have data in a folder organized as <parent_folder>/<PCB|CYM>/<TOLL>/
+
+    :param parent_folder: str. Path to the data folder
+
+    :return: list[tuple[str, str]]. List of (location, toll) pairs found
+    """
+    assert os.path.isdir(parent_folder), f"Folder {parent_folder} does not exist"
+    location_tolls = []
+    for location in sorted(os.listdir(parent_folder)):
+        location_folder = os.path.join(parent_folder, location)
+        if location not in LOCATION_DESCRIPTIONS or not os.path.isdir(location_folder):
+            continue
+        for toll in sorted(os.listdir(location_folder)):
+            if os.path.isdir(os.path.join(location_folder, toll)):
+                location_tolls.append((location, toll))
+    return location_tolls
+
 def get_doc_id_for_row(row: dict[str, str | datetime | float | int]) -> str:
     """
     Get the document id for a given row
@@ -84,31 +191,12 @@ def get_collection_name(location: str = 'PCB', toll: str = '2.0TD', optimization
 
 def get_collection(client, location: str = 'PCB', toll: str = '2.0TD', aggregation: str = NO_AGGREGATION):
     """
-    Returns a collection ref, hidding the subcollections logic
+    Returns a collection ref, hidding the subcollections logic. References come from the registry of the client
+    (see client_pool.CollectionRegistry), so parent documents are only checked the first time
     :param client: Firestore client
     :param location: str. Location of the data [PCB (Peninsula, Canarias, Baleares) or CYM (Ceuta, Melilla)]
     :param toll: str. Toll of the data (2.0TD, 2.0A, 2.0DHA, 2.0-DHS...)
     :param aggregation: str. Aggregation of the data (NO_AGGREGATION, BY_DAY, BY_MONTH)
     :return: Collection ref
     """
-    toll = toll.replace('.', '-')
-    global CHECKED_LOCATIONS, CHECKED_TOLLS
-    if location not in CHECKED_LOCATIONS[aggregation]:
-        # Check if location is an existent document
-        document_ref = client.collection(PVPC_PRICES).document(aggregation).collection(LOCATIONS).\
-            document(location)
-        if not document_ref.get().exists:
-            document_ref.set({'name': LOCATION_DESCRIPTIONS[location]})
-        CHECKED_LOCATIONS[aggregation].add(location)
-
-    if toll not in CHECKED_TOLLS[aggregation][location]:
-        # Check if toll is an existent document
-        document_ref = client.collection(PVPC_PRICES).document(aggregation).collection(LOCATIONS).\
-            document(location).collection(TOLLS).document(toll)
-        if not document_ref.get().exists:
-            document_ref.set({'name': toll.replace('-', '.')})
-        CHECKED_TOLLS[aggregation][location].add(toll)
-
-
-    return client.collection(PVPC_PRICES).document(aggregation).collection(LOCATIONS).\
-        document(location).collection(TOLLS).document(toll).collection(PRICES)
\ No newline at end of file
+    return get_registry(client=client).collection(location=location, toll=toll, aggregation=aggregation)